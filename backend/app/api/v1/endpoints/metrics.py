@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from fastapi import APIRouter
+
+from app.models.response import MetricsResponse
+from app.services.embedding_service import embedding_service
+from app.services.document_service import document_service
+from app.services.index_service import index_service
+from app.services.rag_service import rag_service
+from app.services.answer_cache import answer_cache
+from app.services.web_search_service import web_search_service
+from app.services.session_service import session_service
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/metrics", response_model=MetricsResponse)
+async def get_metrics():
+    """
+    Get service metrics.
+    
+    Returns cache and throughput counters for the backend components.
+    """
+    # Counting sessions queries the session store, so keep it off the event loop
+    sessions = await asyncio.to_thread(session_service.get_stats)
+    return MetricsResponse(
+        success=True,
+        metrics={
+            "embeddings": embedding_service.get_stats(),
+            "sessions": sessions,
+            "documents": document_service.get_stats(),
+            "index": index_service.get_stats(),
+            "rag": rag_service.get_stats(),
+            "answer_cache": answer_cache.get_stats(),
+            "web_search": web_search_service.get_stats()
+        }
+    )
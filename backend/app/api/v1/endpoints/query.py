@@ -1,50 +1,185 @@
 import time
+import json
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
-from app.models.request import QueryRequest
-from app.models.response import QueryResponse, QueryMetadata, WebSource
+from app.core.config import settings
+from app.models.request import QueryRequest, BatchQueryRequest
+from app.models.response import (
+    QueryResponse,
+    QueryMetadata,
+    WebSource,
+    BatchQueryResult,
+    BatchQueryResponse,
+)
 from app.services.session_service import session_service
+from app.services.document_service import document_service
 from app.services.rag_service import rag_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-@router.post("/query", response_model=QueryResponse)
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _session_documents(session_id: str) -> List:
+    """
+    The session's queryable documents; 404 if there are none.
+    
+    409 if the session's documents are all still being indexed on another
+    worker. Reads the session store, so call this off the event loop.
+    """
+    session = session_service.get_session(session_id)
+    if not session:
+        raise HTTPException(
+            status_code=404,
+            detail="Session not found. Please upload a PDF first."
+        )
+    
+    records = [
+        record for record in (
+            document_service.get_document(document_id) for document_id in session.document_ids
+        )
+        if record is not None
+    ]
+    documents = [record for record in records if record.is_queryable]
+    if not documents and records:
+        raise HTTPException(
+            status_code=409,
+            detail="This session's PDFs are still being indexed on another worker. Please try again once indexing completes."
+        )
+    if not documents:
+        raise HTTPException(
+            status_code=404,
+            detail="No PDF found for this session. Please upload a PDF first."
+        )
+    return documents
+
+
+@asynccontextmanager
+async def _snapshots(documents: List) -> AsyncIterator[List]:
+    """Pin the documents' current index versions for one query."""
+    # Evicted indexes are loaded from disk here
+    snapshots = await asyncio.to_thread(document_service.open_snapshots, documents)
+    try:
+        yield snapshots
+    finally:
+        # Freeing an arena shard on its last unpin may wait for the arena lock
+        await asyncio.to_thread(document_service.close_snapshots, snapshots)
+
+
+def _snapshot_versions(snapshots: List) -> Dict[str, int]:
+    """Index version of each pinned document, by document ID."""
+    return {snapshot.content_hash: snapshot.version for snapshot in snapshots}
+
+
+def _query_metadata(result: Dict[str, Any], snapshots: List) -> QueryMetadata:
+    """Response metadata for a RAG service result."""
+    return QueryMetadata(
+        model="gpt-3.5-turbo",
+        tokens_used=result["prompt_tokens"] + result["completion_tokens"],
+        prompt_tokens=result["prompt_tokens"],
+        completion_tokens=result["completion_tokens"],
+        retrieval=result["retrieval"],
+        route=result["route"],
+        cache=result["cache"],
+        snapshot_versions=_snapshot_versions(snapshots)
+    )
+
+
+async def _stream_answer(session_id: str, documents: List, question: str, start_time: float) -> AsyncIterator[str]:
+    """Relay the RAG service's answer events as SSE, adding timings and metadata to the final one."""
+    retrieval = None
+    route = None
+    cache = None
+    time_to_first_token = None
+    try:
+        async with _snapshots(documents) as snapshots:
+            async for event, data in rag_service.stream_query(snapshots, question, session_id=session_id):
+                if event == "retrieval":
+                    retrieval = data["retrieval"]
+                    route = data["route"]
+                    cache = data["cache"]
+                elif event == "token" and time_to_first_token is None:
+                    time_to_first_token = time.time() - start_time
+                elif event == "done":
+                    processing_time = time.time() - start_time
+                    data = dict(data)
+                    prompt_tokens, completion_tokens = data.pop("prompt_tokens"), data.pop("completion_tokens")
+                    await asyncio.to_thread(session_service.record_usage, session_id, prompt_tokens, completion_tokens)
+                    data = dict(
+                        data,
+                        processing_time=round(processing_time, 2),
+                        time_to_first_token=round(time_to_first_token, 2) if time_to_first_token is not None else None,
+                        metadata=QueryMetadata(
+                            model="gpt-3.5-turbo",
+                            tokens_used=prompt_tokens + completion_tokens,
+                            prompt_tokens=prompt_tokens,
+                            completion_tokens=completion_tokens,
+                            retrieval=retrieval,
+                            route=route,
+                            cache=cache,
+                            snapshot_versions=_snapshot_versions(snapshots)
+                        ).model_dump()
+                    )
+                    logger.info(
+                        f"Query streamed successfully from {data['source']} in {processing_time:.2f}s "
+                        f"(first token after {data['time_to_first_token']}s)"
+                    )
+                yield _sse(event, data)
+    except Exception as e:
+        logger.error(f"Error streaming query: {e}", exc_info=True)
+        yield _sse("error", {"detail": "Failed to process query. Please try again."})
+
+
+@router.post(
+    "/query",
+    response_model=QueryResponse,
+    responses={200: {"content": {"text/event-stream": {}}}}
+)
 async def query_pdf(request: QueryRequest):
     """
     Query the uploaded PDF document.
     
     Retrieves relevant content from the PDF and generates an answer.
     Falls back to web search if PDF doesn't contain sufficient information.
+    
+    With stream=true the answer is sent as Server-Sent Events: "retrieval",
+    then "token" events as the answer is generated, then "done" with the
+    source, chunks used, web sources and timings. A "fallback" event means
+    the PDF could not answer; text received before it should be discarded.
+    Failures after streaming has started arrive as an "error" event.
     """
     start_time = time.time()
     
     try:
-        # Get session
-        session = session_service.get_session(request.session_id)
-        if not session:
-            raise HTTPException(
-                status_code=404,
-                detail="Session not found. Please upload a PDF first."
-            )
+        documents = await asyncio.to_thread(_session_documents, request.session_id)
+        logger.info(f"Processing query for session {request.session_id} across {len(documents)} documents")
         
-        if not session.vector_store:
-            raise HTTPException(
-                status_code=404,
-                detail="No PDF found for this session. Please upload a PDF first."
+        if request.stream:
+            return StreamingResponse(
+                _stream_answer(request.session_id, documents, request.question, start_time),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
             )
         
-        logger.info(f"Processing query for session {request.session_id}")
-        
-        # Query using RAG service
-        result = rag_service.query_pdf(
-            vector_store=session.vector_store,
-            question=request.question
-        )
+        # Query using RAG service, on the index versions current now
+        async with _snapshots(documents) as snapshots:
+            result = await rag_service.query_pdf(
+                documents=snapshots,
+                question=request.question,
+                session_id=request.session_id
+            )
         
         processing_time = time.time() - start_time
+        await asyncio.to_thread(session_service.record_usage, request.session_id, result["prompt_tokens"], result["completion_tokens"])
         
         # Prepare response
         response_data = {
@@ -52,10 +187,8 @@ async def query_pdf(request: QueryRequest):
             "answer": result["answer"],
             "source": result["source"],
             "processing_time": round(processing_time, 2),
-            "metadata": QueryMetadata(
-                model="gpt-3.5-turbo",
-                tokens_used=None  # Can be added if needed
-            )
+            "indexed_fraction": round(result["indexed_fraction"], 4),
+            "metadata": _query_metadata(result, snapshots)
         }
         
         # Add source-specific data
@@ -81,3 +214,99 @@ async def query_pdf(request: QueryRequest):
             detail="Failed to process query. Please try again."
         )
 
+
+def _batch_result(index: int, question: str, result: Dict[str, Any], snapshots: List) -> BatchQueryResult:
+    """One question's entry in a batch response."""
+    if "error" in result:
+        return BatchQueryResult(index=index, question=question, success=False, error=result["error"])
+    return BatchQueryResult(
+        index=index,
+        question=question,
+        success=True,
+        answer=result["answer"],
+        source=result["source"],
+        chunks_used=result["chunks_used"] if result["source"] == "pdf" else None,
+        web_sources=[WebSource(**source) for source in result["web_sources"] or []] if result["source"] == "web" else None,
+        indexed_fraction=round(result["indexed_fraction"], 4),
+        metadata=_query_metadata(result, snapshots)
+    )
+
+
+async def _stream_batch(session_id: str, documents: List, questions: List[str], start_time: float) -> AsyncIterator[str]:
+    """Send each batch answer as a "result" SSE as it finishes, then "done" with the totals."""
+    answered = 0
+    try:
+        async with _snapshots(documents) as snapshots:
+            async for index, result in rag_service.query_batch(snapshots, questions, session_id=session_id):
+                if "error" not in result:
+                    await asyncio.to_thread(session_service.record_usage, session_id, result["prompt_tokens"], result["completion_tokens"])
+                    answered += 1
+                yield _sse("result", _batch_result(index, questions[index], result, snapshots).model_dump())
+        processing_time = time.time() - start_time
+        logger.info(f"Batch of {len(questions)} queries streamed in {processing_time:.2f}s ({answered} answered)")
+        yield _sse("done", {"processing_time": round(processing_time, 2), "answered": answered, "failed": len(questions) - answered})
+    except Exception as e:
+        logger.error(f"Error streaming batch query: {e}", exc_info=True)
+        yield _sse("error", {"detail": "Failed to process queries. Please try again."})
+
+
+@router.post(
+    "/query/batch",
+    response_model=BatchQueryResponse,
+    responses={200: {"content": {"text/event-stream": {}}}}
+)
+async def query_batch(request: BatchQueryRequest):
+    """
+    Ask several questions about the session's PDFs in one request.
+    
+    The questions are embedded in one request and searched together, and
+    their LLM calls run concurrently. Each question is answered as by
+    /query; one that fails is reported in its result without failing the
+    others. Results come back in request order.
+    
+    With stream=true each result is sent as a "result" Server-Sent Event as
+    soon as it is ready (in completion order, with its index), followed by
+    "done" with the total processing time.
+    """
+    start_time = time.time()
+    
+    if len(request.questions) > settings.BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.BATCH_MAX_QUESTIONS} questions per batch"
+        )
+    
+    try:
+        documents = await asyncio.to_thread(_session_documents, request.session_id)
+        logger.info(
+            f"Processing batch of {len(request.questions)} queries for session {request.session_id} "
+            f"across {len(documents)} documents"
+        )
+        
+        if request.stream:
+            return StreamingResponse(
+                _stream_batch(request.session_id, documents, request.questions, start_time),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        results = []
+        async with _snapshots(documents) as snapshots:
+            async for index, result in rag_service.query_batch(snapshots, request.questions, session_id=request.session_id):
+                if "error" not in result:
+                    await asyncio.to_thread(session_service.record_usage, request.session_id, result["prompt_tokens"], result["completion_tokens"])
+                results.append(_batch_result(index, request.questions[index], result, snapshots))
+        results.sort(key=lambda result: result.index)
+        
+        processing_time = time.time() - start_time
+        logger.info(f"Batch of {len(results)} queries processed in {processing_time:.2f}s")
+        return BatchQueryResponse(success=True, results=results, processing_time=round(processing_time, 2))
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing batch query: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to process queries. Please try again."
+        )
@@ -1,8 +1,15 @@
+import asyncio
 import logging
 from fastapi import APIRouter, HTTPException
 
-from app.models.response import SessionStatusResponse, SessionClearResponse
+from app.models.response import (
+    SessionStatusResponse,
+    SessionClearResponse,
+    SessionDocumentInfo,
+    DocumentRemoveResponse,
+)
 from app.services.session_service import session_service
+from app.services.document_service import document_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -13,19 +20,46 @@ async def get_session_status(session_id: str):
     """
     Get the status of a session.
     
-    Returns information about the session including uploaded PDF details.
+    Returns information about the session including per-document chunk
+    counts, memory usage and whether each index is loaded.
     """
     try:
-        session = session_service.get_session(session_id)
+        # Reads the session store, so keep it off the event loop
+        session = await asyncio.to_thread(session_service.get_session, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
+        documents = []
+        for session_document in session.documents.values():
+            record = document_service.get_document(session_document.document_id)
+            if record is None:
+                continue
+            documents.append((session_document, record, record.memory_bytes))
+        
         return SessionStatusResponse(
             success=True,
             session_id=session.session_id,
-            has_pdf=session.vector_store is not None,
-            pdf_filename=session.pdf_filename,
-            num_chunks=session.num_chunks,
+            has_pdf=any(record.is_queryable for _, record, _ in documents),
+            pdf_filename=documents[-1][0].filename if documents else None,
+            num_chunks=sum(record.num_chunks or 0 for _, record, _ in documents) if documents else None,
+            indexed_chunks=sum(record.indexed_chunks for _, record, _ in documents) if documents else None,
+            documents=[
+                SessionDocumentInfo(
+                    document_id=session_document.document_id,
+                    filename=session_document.filename,
+                    num_chunks=record.num_chunks,
+                    indexed_chunks=record.indexed_chunks,
+                    memory_bytes=memory_bytes,
+                    loaded=record.is_loaded,
+                    status=record.status,
+                    added_at=session_document.added_at.isoformat()
+                )
+                for session_document, record, memory_bytes in documents
+            ],
+            memory_bytes=sum(memory_bytes for _, _, memory_bytes in documents),
+            queries=session.queries,
+            prompt_tokens=session.prompt_tokens,
+            completion_tokens=session.completion_tokens,
             created_at=session.created_at.isoformat(),
             last_activity=session.last_activity.isoformat()
         )
@@ -37,6 +71,36 @@ async def get_session_status(session_id: str):
         raise HTTPException(status_code=500, detail="Failed to get session status")
 
 
+@router.delete("/session/{session_id}/documents/{document_id}", response_model=DocumentRemoveResponse)
+async def remove_document(session_id: str, document_id: str):
+    """
+    Remove a document from a session.
+    
+    The session's other documents are unaffected. The document's index and
+    file are deleted once no other session references them.
+    """
+    try:
+        session = await asyncio.to_thread(session_service.get_session, session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        # Deleting the index and file blocks, so keep it off the event loop
+        if not await asyncio.to_thread(session_service.remove_document, session_id, document_id):
+            raise HTTPException(status_code=404, detail="Document not found in session")
+        
+        logger.info(f"Document {document_id[:12]} removed from session: {session_id}")
+        return DocumentRemoveResponse(
+            success=True,
+            message="Document removed successfully"
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error removing document: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to remove document")
+
+
 @router.delete("/session/{session_id}", response_model=SessionClearResponse)
 async def clear_session(session_id: str):
     """
@@ -45,7 +109,7 @@ async def clear_session(session_id: str):
     Deletes the vector store and uploaded PDF file.
     """
     try:
-        success = session_service.clear_session(session_id)
+        success = await asyncio.to_thread(session_service.clear_session, session_id)
         if not success:
             raise HTTPException(status_code=404, detail="Session not found")
         
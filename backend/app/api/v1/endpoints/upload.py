@@ -1,79 +1,98 @@
 import time
+import asyncio
 import logging
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from typing import Optional
 
-from app.models.response import UploadResponse, ErrorResponse
+from app.models.response import UploadResponse, UploadStatusResponse, ErrorResponse
 from app.services.session_service import session_service
-from app.services.pdf_service import pdf_service
+from app.services.pdf_service import pdf_service, PDFValidationError
+from app.services.document_service import document_service
+from app.services.ingestion_service import ingestion_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+def _upload_session(session_id: Optional[str], replace_document_id: Optional[str]) -> str:
+    """The session to add an upload to: the given one if it exists, otherwise a new one."""
+    session = session_service.get_session(session_id) if session_id else None
+    if replace_document_id and (session is None or replace_document_id not in session.documents):
+        raise HTTPException(status_code=404, detail="Document to replace not found in session")
+    if session:
+        return session_id
+    return session_service.create_session()
+
+
 @router.post("/upload", response_model=UploadResponse, responses={400: {"model": ErrorResponse}, 413: {"model": ErrorResponse}})
 async def upload_pdf(
     file: UploadFile = File(..., description="PDF file to upload"),
-    session_id: Optional[str] = Form(None, description="Optional session ID")
+    session_id: Optional[str] = Form(None, description="Optional session ID"),
+    replace_document_id: Optional[str] = Form(None, description="ID of a session document this upload replaces")
 ):
     """
-    Upload and process a PDF document.
+    Upload a PDF document and queue it for processing.
     
-    Creates a new session if session_id is not provided.
-    Processes the PDF by extracting text, chunking, and creating embeddings.
+    Creates a new session if session_id is not provided; otherwise the PDF
+    is added to the session's existing documents. With replace_document_id,
+    that document is removed from the session once the new one is added;
+    documents are never replaced just because their filenames match.
+    Returns immediately with a job ID; extraction, chunking and embedding run
+    in the background and can be tracked via the upload status endpoint.
     """
     start_time = time.time()
     
     try:
-        # Read file content
-        content = await file.read()
-        file_size = len(content)
+        # Stream file to disk, validating as it is read
+        try:
+            tmp_path, content_hash, file_size = await pdf_service.save_uploaded_file(file, file.filename)
+        except PDFValidationError as e:
+            logger.warning(f"File validation failed: {e}")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
         
         logger.info(f"Received file: {file.filename}, size: {file_size} bytes")
         
-        # Validate file
-        is_valid, error_msg = pdf_service.validate_pdf_file(content, file.filename, file_size)
-        if not is_valid:
-            logger.warning(f"File validation failed: {error_msg}")
-            if "size exceeds" in error_msg:
-                raise HTTPException(status_code=413, detail=error_msg)
-            else:
-                raise HTTPException(status_code=400, detail=error_msg)
-        
-        # Create or get session
-        if not session_id:
-            session_id = session_service.create_session()
-        else:
-            session = session_service.get_session(session_id)
-            if not session:
-                session_id = session_service.create_session()
+        # Session, document and job state live in the session store and on
+        # disk, so those calls run off the event loop. Create or get session
+        session_id = await asyncio.to_thread(_upload_session, session_id, replace_document_id)
         
-        # Save file
-        file_path = await pdf_service.save_uploaded_file(content, file.filename)
-        
-        # Process PDF
-        logger.info(f"Processing PDF for session {session_id}")
-        vector_store, num_chunks = pdf_service.process_pdf(file_path)
-        
-        # Update session
-        session_service.update_session(
+        # Record the job, then reference the document, before storing its file,
+        # so a session releasing the same content on any worker can't delete
+        # the file before the job runs
+        file_path = pdf_service.upload_path(content_hash)
+        job_id = await asyncio.to_thread(
+            ingestion_service.create_job,
             session_id=session_id,
-            vector_store=vector_store,
-            pdf_filename=file.filename,
-            num_chunks=num_chunks,
-            pdf_path=file_path
+            file_path=file_path,
+            filename=file.filename,
+            content_hash=content_hash,
+            replace_document_id=replace_document_id
         )
+        acquired = False
+        try:
+            await asyncio.to_thread(document_service.acquire, content_hash, file_path)
+            acquired = True
+            await pdf_service.store_uploaded_file(tmp_path, content_hash)
+            
+            # Queue PDF for background processing; the job takes over the reference
+            await asyncio.to_thread(ingestion_service.start_job, job_id)
+        except Exception as e:
+            await asyncio.to_thread(ingestion_service.cancel_job, job_id, f"Upload failed: {e}")
+            if acquired:
+                await asyncio.to_thread(document_service.release, content_hash)
+            raise
         
         processing_time = time.time() - start_time
-        logger.info(f"PDF processed successfully in {processing_time:.2f}s: {num_chunks} chunks")
+        logger.info(f"PDF queued for session {session_id} as job {job_id} in {processing_time:.2f}s")
         
         return UploadResponse(
             success=True,
-            message="PDF processed successfully",
+            message="PDF uploaded and queued for processing",
             session_id=session_id,
+            document_id=content_hash,
+            job_id=job_id,
             filename=file.filename,
-            num_chunks=num_chunks,
-            processing_time=round(processing_time, 2)
+            status="queued"
         )
     
     except HTTPException:
@@ -82,3 +101,31 @@ async def upload_pdf(
         logger.error(f"Error uploading PDF: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
 
+
+@router.get("/upload/{job_id}", response_model=UploadStatusResponse)
+async def get_upload_status(job_id: str):
+    """
+    Get the status of a PDF ingestion job.
+    
+    Reports the current stage, progress and any processing error.
+    """
+    # Jobs run by another worker are read from the session store
+    job = await asyncio.to_thread(ingestion_service.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    
+    processing_time = job.processing_time
+    return UploadStatusResponse(
+        success=True,
+        job_id=job.job_id,
+        session_id=job.session_id,
+        document_id=job.content_hash,
+        filename=job.filename,
+        status=job.status,
+        progress=job.progress,
+        num_chunks=job.num_chunks,
+        error=job.error,
+        reused_index=job.reused_index,
+        processing_time=round(processing_time, 2) if processing_time is not None else None
+    )
+
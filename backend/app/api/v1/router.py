@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import upload, query, session, health
+from app.api.v1.endpoints import upload, query, session, health, metrics
 
 api_router = APIRouter()
 
@@ -9,4 +9,5 @@ api_router.include_router(upload.router, tags=["upload"])
 api_router.include_router(query.router, tags=["query"])
 api_router.include_router(session.router, tags=["session"])
 api_router.include_router(health.router, tags=["health"])
+api_router.include_router(metrics.router, tags=["metrics"])
 
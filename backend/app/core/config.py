@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -7,13 +7,86 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str
     TAVILY_API_KEY: str
     
+    # External Services (override to point at a proxy or a local stub)
+    OPENAI_BASE_URL: Optional[str] = None
+    TAVILY_BASE_URL: Optional[str] = None
+    WEB_SEARCH_MAX_CONCURRENCY: int = 16
+    WEB_SEARCH_CACHE_TTL_SECONDS: int = 600
+    WEB_SEARCH_CACHE_MAX_ENTRIES: int = 1000
+    
     # Application Settings
     MAX_FILE_SIZE_MB: int = 50
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
     TOP_K_CHUNKS: int = 3
+    CONTEXT_TOKEN_BUDGET: int = 2000
+    WEB_CONTEXT_TOKEN_BUDGET: int = 1500
     SESSION_TIMEOUT_MINUTES: int = 30
     
+    # Ingestion Settings
+    UPLOAD_CHUNK_SIZE_KB: int = 1024
+    INGESTION_WORKERS: int = 2
+    EXTRACTION_PROCESSES: int = 4
+    PARALLEL_EXTRACTION_MIN_PAGES: int = 100
+    JOB_RETENTION_MINUTES: int = 60
+    
+    # Embedding Settings
+    EMBEDDING_MODEL: str = "text-embedding-3-large"
+    EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_CACHE_PATH: str = "cache/embeddings.sqlite3"
+    
+    # Storage Settings
+    INDEX_STORAGE_DIR: str = "storage/indexes"
+    SESSION_BACKEND: str = "sqlite"
+    SESSION_DB_PATH: str = "storage/sessions.sqlite3"
+    SESSION_REDIS_URL: str = "redis://localhost:6379/0"
+    SESSION_CACHE_TTL_SECONDS: float = 2.0
+    SESSION_ACTIVITY_FLUSH_SECONDS: float = 30.0
+    SESSION_EXPIRY_BATCH: int = 500
+    INDEX_MMAP: bool = True
+    DOCUMENT_MEMORY_BUDGET_MB: int = 2048
+    
+    # Index Settings
+    INDEX_TYPE: str = "auto"
+    INDEX_FLAT_MAX_CHUNKS: int = 5000
+    INDEX_MEMORY_BUDGET_MB: int = 512
+    INDEX_HNSW_M: int = 32
+    INDEX_HNSW_EF_CONSTRUCTION: int = 80
+    INDEX_HNSW_EF_SEARCH: int = 128
+    INDEX_IVF_NPROBE: int = 32
+    INDEX_PQ_M: int = 128
+    EMBEDDING_DIMENSIONS: int = 0
+    INDEX_PRECISION: str = "float32"
+    INDEX_RESCORE: bool = True
+    INDEX_RESCORE_FACTOR: int = 4
+    INDEX_SHARED_ARENA: bool = True
+    INDEX_ARENA_COMPACT_RATIO: float = 0.25
+    
+    # Retrieval Settings
+    HYBRID_CANDIDATES: int = 20
+    RRF_K: int = 60
+    LEXICAL_FAST_PATH_RATIO: float = 0.5
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    SPECULATIVE_WEB_SEARCH: str = "auto"
+    SPECULATIVE_MIN_SIMILARITY: float = 0.35
+    ROUTER_ENABLED: bool = True
+    ROUTER_PDF_MIN_SIMILARITY: float = 0.6
+    ROUTER_WEB_MAX_SIMILARITY: float = 0.2
+    
+    # Answer Cache Settings
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 5000
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_WEB_TTL_SECONDS: int = 600
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+    
+    # Batch Query Settings
+    BATCH_MAX_QUESTIONS: int = 100
+    BATCH_LLM_CONCURRENCY: int = 8
+    
     # Server Settings
     HOST: str = "0.0.0.0"
     PORT: int = 8000
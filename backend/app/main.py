@@ -9,22 +9,53 @@ from app.core.config import settings
 from app.core.logging_config import setup_logging
 from app.api.v1.router import api_router
 from app.services.session_service import session_service
+from app.services.ingestion_service import ingestion_service, JOB_HEARTBEAT_SECONDS
+from app.services.pdf_service import pdf_service
+from app.services.document_service import document_service
+from app.services.web_search_service import web_search_service
+from app.services.session_store import session_store
+from app.services.token_service import token_service
 
 # Setup logging
 logger = setup_logging(settings.LOG_LEVEL)
 
 
-# Background task for session cleanup
-async def cleanup_sessions_periodically():
-    """Background task to cleanup expired sessions."""
+# Background task for session expiry
+async def expire_sessions():
+    """Expire sessions as their deadlines come due, off the event loop."""
+    while True:
+        try:
+            delay = await asyncio.to_thread(session_service.expire_due)
+        except Exception as e:
+            logger.error(f"Error in session expiry task: {e}")
+            delay = 5
+        await asyncio.sleep(delay)
+
+
+# Background task for job cleanup
+async def cleanup_jobs_periodically():
+    """Background task to cleanup finished ingestion jobs."""
     while True:
         try:
             await asyncio.sleep(300)  # Run every 5 minutes
-            expired_count = session_service.cleanup_expired_sessions()
-            if expired_count > 0:
-                logger.info(f"Cleaned up {expired_count} expired sessions")
+            expired_jobs = await asyncio.to_thread(
+                ingestion_service.cleanup_finished_jobs, settings.JOB_RETENTION_MINUTES
+            )
+            if expired_jobs > 0:
+                logger.info(f"Cleaned up {expired_jobs} finished ingestion jobs")
+        except Exception as e:
+            logger.error(f"Error in job cleanup task: {e}")
+
+
+# Background task for job heartbeats
+async def heartbeat_jobs_periodically():
+    """Refresh this worker's unfinished jobs, so other workers don't fail them as lost."""
+    while True:
+        try:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            await asyncio.to_thread(ingestion_service.heartbeat)
         except Exception as e:
-            logger.error(f"Error in session cleanup task: {e}")
+            logger.error(f"Error in job heartbeat task: {e}")
 
 
 @asynccontextmanager
@@ -34,18 +65,33 @@ async def lifespan(app: FastAPI):
     logger.info("Starting PDF RAG API...")
     logger.info(f"CORS origins: {settings.cors_origins_list}")
     
-    # Start background task for session cleanup
-    cleanup_task = asyncio.create_task(cleanup_sessions_periodically())
+    # tiktoken may download the tokenizer, so load it before serving requests
+    await asyncio.to_thread(token_service.load)
+    
+    # Sessions live in the shared session store; their indexes load on first query
+    orphans = document_service.remove_orphans()
+    if orphans > 0:
+        logger.info(f"Removed {orphans} orphaned indexes and uploads")
+    
+    # Start background tasks for session expiry, job cleanup and job heartbeats
+    tasks = [
+        asyncio.create_task(expire_sessions()),
+        asyncio.create_task(cleanup_jobs_periodically()),
+        asyncio.create_task(heartbeat_jobs_periodically()),
+    ]
     
     yield
     
     # Shutdown
     logger.info("Shutting down PDF RAG API...")
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    ingestion_service.shutdown()
+    pdf_service.shutdown()
+    web_search_service.shutdown()
+    session_service.flush()
+    session_store.close()
 
 
 # Create FastAPI app
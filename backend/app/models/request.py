@@ -1,3 +1,5 @@
+from typing import Annotated, List
+
 from pydantic import BaseModel, Field
 
 
@@ -16,3 +18,18 @@ class QueryRequest(BaseModel):
             }
         }
 
+
+class BatchQueryRequest(BaseModel):
+    """Request model for asking several questions about a session's PDFs."""
+    session_id: str = Field(..., description="Session ID associated with the uploaded PDFs")
+    questions: List[Annotated[str, Field(min_length=1)]] = Field(..., min_length=1, description="Questions to ask, answered independently")
+    stream: bool = Field(default=False, description="Whether to stream each answer as it finishes")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "session_id": "123e4567-e89b-12d3-a456-426614174000",
+                "questions": ["What is the main topic of this document?", "Who is the author?"],
+                "stream": False
+            }
+        }
@@ -8,9 +8,25 @@ class UploadResponse(BaseModel):
     success: bool = Field(..., description="Whether the operation was successful")
     message: str = Field(..., description="Status message")
     session_id: str = Field(..., description="Session ID for this upload")
+    document_id: str = Field(..., description="Document ID (SHA-256 of the file content)")
+    job_id: str = Field(..., description="ID of the ingestion job processing the PDF")
     filename: str = Field(..., description="Name of the uploaded file")
-    num_chunks: int = Field(..., description="Number of chunks created from the PDF")
-    processing_time: float = Field(..., description="Time taken to process the PDF in seconds")
+    status: str = Field(..., description="Current ingestion job status")
+
+
+class UploadStatusResponse(BaseModel):
+    """Response model for ingestion job status."""
+    success: bool = Field(..., description="Whether the operation was successful")
+    job_id: str = Field(..., description="Ingestion job ID")
+    session_id: str = Field(..., description="Session ID the PDF is being added to")
+    document_id: str = Field(..., description="Document ID (SHA-256 of the file content)")
+    filename: str = Field(..., description="Name of the uploaded file")
+    status: str = Field(..., description="Job stage: queued, loading, splitting, embedding, indexing, completed or failed")
+    progress: float = Field(..., description="Fraction of the job completed, between 0 and 1")
+    num_chunks: Optional[int] = Field(None, description="Number of chunks created from the PDF (once completed)")
+    error: Optional[str] = Field(None, description="Error message (if the job failed)")
+    reused_index: bool = Field(False, description="Whether an existing index for identical content was reused")
+    processing_time: Optional[float] = Field(None, description="Time spent processing the PDF in seconds")
 
 
 class WebSource(BaseModel):
@@ -23,7 +39,13 @@ class WebSource(BaseModel):
 class QueryMetadata(BaseModel):
     """Metadata about the query processing."""
     model: str = Field(..., description="LLM model used")
-    tokens_used: Optional[int] = Field(None, description="Number of tokens used")
+    tokens_used: Optional[int] = Field(None, description="Number of tokens used (prompt plus completion)")
+    prompt_tokens: Optional[int] = Field(None, description="Prompt tokens across the query's LLM calls")
+    completion_tokens: Optional[int] = Field(None, description="Completion tokens across the query's LLM calls")
+    retrieval: Optional[str] = Field(None, description="Retrieval mode: 'lexical' (identifier fast path) or 'hybrid'")
+    route: Optional[str] = Field(None, description="Answer route: 'pdf', 'web' (chosen from retrieval scores) or 'check' (LLM sufficiency check)")
+    cache: Optional[str] = Field(None, description="Answer cache match: 'exact' or 'semantic' (None if the answer was generated)")
+    snapshot_versions: Optional[Dict[str, int]] = Field(None, description="Index version of each document the query searched, by document ID")
 
 
 class QueryResponse(BaseModel):
@@ -34,16 +56,56 @@ class QueryResponse(BaseModel):
     chunks_used: Optional[int] = Field(None, description="Number of PDF chunks used (if source is pdf)")
     web_sources: Optional[List[WebSource]] = Field(None, description="Web sources (if source is web)")
     processing_time: float = Field(..., description="Time taken to process the query in seconds")
+    indexed_fraction: float = Field(..., description="Fraction of the document's chunks that were indexed when the query was answered")
     metadata: QueryMetadata = Field(..., description="Metadata about the query processing")
 
 
+class BatchQueryResult(BaseModel):
+    """Answer to one question of a batch query."""
+    index: int = Field(..., description="Position of the question in the request")
+    question: str = Field(..., description="The question")
+    success: bool = Field(..., description="Whether the question was answered")
+    answer: Optional[str] = Field(None, description="Answer to the question")
+    source: Optional[str] = Field(None, description="Source of the answer: 'pdf' or 'web'")
+    chunks_used: Optional[int] = Field(None, description="Number of PDF chunks used (if source is pdf)")
+    web_sources: Optional[List[WebSource]] = Field(None, description="Web sources (if source is web)")
+    indexed_fraction: Optional[float] = Field(None, description="Fraction of the documents' chunks that were indexed when the question was answered")
+    metadata: Optional[QueryMetadata] = Field(None, description="Metadata about the query processing")
+    error: Optional[str] = Field(None, description="Error message (if the question failed)")
+
+
+class BatchQueryResponse(BaseModel):
+    """Response model for batch query."""
+    success: bool = Field(..., description="Whether the operation was successful")
+    results: List[BatchQueryResult] = Field(..., description="One result per question, in request order")
+    processing_time: float = Field(..., description="Time taken to answer all questions in seconds")
+
+
+class SessionDocumentInfo(BaseModel):
+    """A document held by a session."""
+    document_id: str = Field(..., description="Document ID (SHA-256 of the file content)")
+    filename: str = Field(..., description="Name of the uploaded PDF")
+    num_chunks: Optional[int] = Field(None, description="Number of chunks in the document")
+    indexed_chunks: int = Field(..., description="Number of chunks indexed so far (less than num_chunks while indexing)")
+    memory_bytes: int = Field(..., description="Approximate memory used by the document's vectors and chunk text (0 while evicted)")
+    loaded: bool = Field(..., description="Whether the document's index is in memory; evicted indexes reload on the next query")
+    status: str = Field(..., description="ready, indexing (partly queryable) or indexing_elsewhere (queryable on this worker once another worker finishes indexing it)")
+    added_at: str = Field(..., description="When the document was added to the session")
+
+
 class SessionStatusResponse(BaseModel):
     """Response model for session status."""
     success: bool = Field(..., description="Whether the operation was successful")
     session_id: str = Field(..., description="Session ID")
     has_pdf: bool = Field(..., description="Whether a PDF is uploaded for this session")
-    pdf_filename: Optional[str] = Field(None, description="Name of the uploaded PDF")
-    num_chunks: Optional[int] = Field(None, description="Number of chunks in the vector store")
+    pdf_filename: Optional[str] = Field(None, description="Name of the most recently added PDF")
+    num_chunks: Optional[int] = Field(None, description="Total number of chunks across the session's documents")
+    indexed_chunks: Optional[int] = Field(None, description="Total number of chunks indexed so far")
+    documents: List[SessionDocumentInfo] = Field(default_factory=list, description="Documents in the session")
+    memory_bytes: int = Field(0, description="Approximate memory used by the session's loaded documents, including those shared with other sessions")
+    queries: int = Field(0, description="Number of queries answered in this session")
+    prompt_tokens: int = Field(0, description="Prompt tokens used by the session's queries")
+    completion_tokens: int = Field(0, description="Completion tokens used by the session's queries")
     created_at: str = Field(..., description="Session creation timestamp")
     last_activity: str = Field(..., description="Last activity timestamp")
 
@@ -54,6 +116,12 @@ class SessionClearResponse(BaseModel):
     message: str = Field(..., description="Status message")
 
 
+class DocumentRemoveResponse(BaseModel):
+    """Response model for removing a document from a session."""
+    success: bool = Field(..., description="Whether the operation was successful")
+    message: str = Field(..., description="Status message")
+
+
 class HealthResponse(BaseModel):
     """Response model for health check."""
     status: str = Field(..., description="Health status")
@@ -61,6 +129,12 @@ class HealthResponse(BaseModel):
     services: Dict[str, str] = Field(..., description="Status of external services")
 
 
+class MetricsResponse(BaseModel):
+    """Response model for service metrics."""
+    success: bool = Field(..., description="Whether the operation was successful")
+    metrics: Dict[str, Dict[str, Any]] = Field(..., description="Counters and gauges grouped by component")
+
+
 class ErrorResponse(BaseModel):
     """Response model for errors."""
     success: bool = Field(default=False, description="Always false for errors")
@@ -0,0 +1,186 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Any, Iterable
+import logging
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?.!").strip()
+
+
+@dataclass
+class CachedAnswer:
+    """A stored answer and the question that produced it."""
+    scope: str
+    question: str
+    embedding: Optional[np.ndarray]
+    result: Dict[str, Any]
+    expires_at: float
+
+
+class AnswerCache:
+    """
+    Cache of generated answers, scoped to the exact set of documents queried.
+    
+    The scope is derived from the content hashes of a session's documents,
+    so sessions querying the same documents share answers; a session with
+    no documents gets a scope of its own. A lookup first
+    tries the normalised question text, then the most similar cached
+    question embedding in the same scope, which must reach
+    similarity_threshold (cosine). PDF answers live for ttl_seconds and
+    web answers for web_ttl_seconds; beyond max_entries the least recently
+    used entry is evicted. Embeddings are stored as float16.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 5000,
+        ttl_seconds: float = 3600,
+        web_ttl_seconds: float = 600,
+        similarity_threshold: float = 0.95
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.web_ttl_seconds = web_ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        
+        self._entries: "OrderedDict[Tuple[str, str], CachedAnswer]" = OrderedDict()
+        self._by_scope: Dict[str, Dict[str, CachedAnswer]] = {}
+        self._lock = threading.Lock()
+        
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        logger.info(f"AnswerCache initialized (max {max_entries} entries)")
+    
+    @staticmethod
+    def scope(content_hashes: Iterable[str], session_id: Optional[str] = None) -> str:
+        """
+        Cache scope for a set of documents, independent of their order.
+        
+        Without documents the scope is the session's own, so sessions with no
+        documents don't share (web) answers with each other.
+        """
+        content_hashes = sorted(content_hashes)
+        key = "|".join(content_hashes) if content_hashes else f"session:{session_id}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+    
+    def _remove(self, entry: CachedAnswer):
+        """Drop an entry from both indexes (lock held)."""
+        self._entries.pop((entry.scope, entry.question), None)
+        scope_entries = self._by_scope.get(entry.scope)
+        if scope_entries is not None:
+            scope_entries.pop(entry.question, None)
+            if not scope_entries:
+                del self._by_scope[entry.scope]
+    
+    def _live(self, entry: Optional[CachedAnswer], now: float) -> Optional[CachedAnswer]:
+        """The entry if it has not expired; expired entries are removed (lock held)."""
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(entry)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end((entry.scope, entry.question))
+        return entry
+    
+    def get_exact(self, scope: str, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an answer to the same normalised question.
+        
+        A miss is not counted, since the caller follows it with get_similar.
+        """
+        with self._lock:
+            entry = self._live(self._entries.get((scope, normalize_question(question))), time.monotonic())
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return dict(entry.result)
+    
+    def get_similar(self, scope: str, query_embedding: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        """Look up the answer to the most similar cached question, if similar enough."""
+        with self._lock:
+            # Expired entries are evicted here, so an expired best match can't hide a live one
+            now = time.monotonic()
+            candidates = []
+            for entry in list(self._by_scope.get(scope, {}).values()) if query_embedding is not None else []:
+                if entry.expires_at <= now:
+                    self._remove(entry)
+                    self.expirations += 1
+                elif entry.embedding is not None:
+                    candidates.append(entry)
+            if candidates:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                query /= np.linalg.norm(query) or 1.0
+                similarities = np.stack([entry.embedding for entry in candidates]).astype(np.float32) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    entry = candidates[best]
+                    self._entries.move_to_end((entry.scope, entry.question))
+                    self.semantic_hits += 1
+                    return dict(entry.result)
+            self.misses += 1
+            return None
+    
+    def put(self, scope: str, question: str, query_embedding: Optional[List[float]], result: Dict[str, Any]):
+        """Store an answer; web-sourced answers expire sooner."""
+        ttl = self.web_ttl_seconds if result.get("source") == "web" else self.ttl_seconds
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            embedding = (embedding / (np.linalg.norm(embedding) or 1.0)).astype(np.float16)
+        entry = CachedAnswer(
+            scope=scope,
+            question=normalize_question(question),
+            embedding=embedding,
+            result=dict(result),
+            expires_at=time.monotonic() + ttl
+        )
+        
+        with self._lock:
+            previous = self._entries.get((scope, entry.question))
+            if previous is not None:
+                self._remove(previous)
+            self._entries[(scope, entry.question)] = entry
+            self._by_scope.setdefault(scope, {})[entry.question] = entry
+            while len(self._entries) > self.max_entries:
+                _, oldest = self._entries.popitem(last=False)
+                self._remove(oldest)
+                self.evictions += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# Global answer cache instance
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    web_ttl_seconds=settings.ANSWER_CACHE_WEB_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY
+)
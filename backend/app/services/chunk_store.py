@@ -0,0 +1,66 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+_MISSING = object()
+
+# Approximate cost of one per-chunk metadata value: a list slot plus a small int object
+METADATA_CELL_BYTES = 36
+
+
+class ChunkStore:
+    """
+    Chunk text and metadata for one document, stored column-wise.
+    
+    Loader metadata is almost entirely per-document (source, title, page
+    count...), so keys whose value is the same for every chunk are kept once
+    and only the varying ones (page, start_index, end_index) are stored per
+    chunk. Documents are materialised on lookup instead of being held as one
+    object per chunk.
+    """
+    
+    def __init__(self):
+        self.texts: List[str] = []
+        self.shared: Optional[Dict[str, Any]] = None
+        self.columns: Dict[str, list] = {}
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+    
+    @property
+    def metadata_nbytes(self) -> int:
+        """Approximate size of the per-chunk metadata columns."""
+        return len(self.texts) * len(self.columns) * METADATA_CELL_BYTES
+    
+    def add(self, texts: Iterable[str], metadatas: Iterable[dict]):
+        """Append chunks in index order."""
+        for text, metadata in zip(texts, metadatas):
+            row = len(self.texts)
+            if self.shared is None:
+                self.shared = dict(metadata)
+            
+            # A shared key that changes becomes a column, backfilled for earlier rows
+            for key in list(self.shared):
+                if metadata.get(key, _MISSING) != self.shared[key]:
+                    self.columns[key] = [self.shared.pop(key)] * row
+            for key, value in metadata.items():
+                if key in self.columns:
+                    self.columns[key].append(value)
+                elif key not in self.shared:
+                    self.columns[key] = [_MISSING] * row + [value]
+            for column in self.columns.values():
+                if len(column) == row:
+                    column.append(_MISSING)
+            
+            self.texts.append(text)
+    
+    def metadata(self, chunk_id: int) -> dict:
+        metadata = dict(self.shared or {})
+        for key, column in self.columns.items():
+            value = column[chunk_id]
+            if value is not _MISSING:
+                metadata[key] = value
+        return metadata
+    
+    def get(self, chunk_id: int) -> Document:
+        return Document(page_content=self.texts[chunk_id], metadata=self.metadata(chunk_id))
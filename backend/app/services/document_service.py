@@ -0,0 +1,552 @@
+import os
+import time
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Optional, List, Tuple, Any
+from dataclasses import dataclass, field
+import logging
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.services.index_store import index_store
+from app.services.index_service import Shard, index_service
+from app.services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+# Uploads younger than this may belong to another worker's upload in progress
+ORPHAN_MIN_AGE_SECONDS = 3600
+
+
+@dataclass(frozen=True)
+class DocumentSnapshot:
+    """
+    One version of a document's index, pinned by a query for its duration.
+    
+    A snapshot sees exactly the chunks indexed when it was taken: batches
+    appended later are hidden, and a compressed or rebuilt index swapped in
+    meanwhile doesn't replace the shard it reads. Searches never take the
+    document's lock.
+    """
+    content_hash: str
+    version: int
+    num_chunks: Optional[int]
+    indexed_chunks: int
+    shard: Shard = field(repr=False, compare=False)
+    
+    @property
+    def is_indexed(self) -> bool:
+        return self.num_chunks is not None and self.indexed_chunks >= self.num_chunks
+    
+    def search(self, query_embedding: List[float], k: int) -> List[Tuple[int, float]]:
+        """
+        Search the vector index.
+        
+        Returns:
+            List of (chunk id, L2 distance) pairs, closest first
+        """
+        return self.search_batch([query_embedding], k)[0]
+    
+    def search_batch(self, query_embeddings: List[List[float]], k: int) -> List[List[Tuple[int, float]]]:
+        """
+        Search the vector index for several queries at once.
+        
+        Returns:
+            Per query, a list of (chunk id, L2 distance) pairs, closest first
+        """
+        return index_service.search_shard(self.shard, query_embeddings, k, limit=self.indexed_chunks)
+    
+    def lexical_search(self, question: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Search the BM25 index.
+        
+        Returns:
+            List of (chunk id, BM25 score) pairs, best first
+        """
+        return index_service.lexical_search_shard(self.shard, question, k, limit=self.indexed_chunks)
+    
+    def get_chunks(self, chunk_ids: List[int]) -> List[Document]:
+        """Look up chunks by their position in the index."""
+        return index_service.shard_chunks(self.shard, chunk_ids)
+
+
+@dataclass
+class DocumentRecord:
+    """
+    A stored PDF and its index state, keyed by the SHA-256 of the file content.
+    
+    version is bumped each time a new state of the index is published: an
+    appended batch, a compressed index, a reset for rebuilding or a restore
+    from disk. Queries read it through a DocumentSnapshot.
+    """
+    content_hash: str
+    file_path: str
+    num_chunks: Optional[int] = None
+    indexed_chunks: int = 0
+    text_bytes: int = 0
+    ref_count: int = 0
+    persisted: bool = False
+    version: int = 0
+    created_at: datetime = field(default_factory=datetime.now)
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    
+    @property
+    def is_indexed(self) -> bool:
+        """Whether every chunk of the document has been indexed."""
+        return self.num_chunks is not None and self.indexed_chunks >= self.num_chunks
+    
+    @property
+    def is_queryable(self) -> bool:
+        """Whether at least one batch of chunks has been indexed, in memory or on disk."""
+        return self.indexed_chunks > 0 and (self.is_loaded or self.persisted)
+    
+    @property
+    def is_loaded(self) -> bool:
+        return index_service.is_loaded(self.content_hash)
+    
+    @property
+    def status(self) -> str:
+        """
+        ready, indexing (partly queryable here) or indexing_elsewhere.
+        
+        Batches are only published on the worker building the index, and a
+        session holds a document from its first batch, so a session document
+        that isn't queryable is being indexed on another worker. It becomes
+        queryable here once its complete index is stored.
+        """
+        if self.is_queryable:
+            return "ready" if self.is_indexed else "indexing"
+        return "indexing_elsewhere"
+    
+    @property
+    def indexed_fraction(self) -> float:
+        if not self.num_chunks:
+            return 0.0
+        return min(self.indexed_chunks / self.num_chunks, 1.0)
+    
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate resident size: vectors, BM25 postings, chunk text and metadata, and unpersisted re-score vectors."""
+        if not self.is_loaded:
+            return 0
+        return index_service.memory_bytes(self.content_hash) + self.text_bytes
+    
+    def _ensure_loaded(self):
+        """Load a persisted index that was evicted or not yet loaded after a restart, and mark the document used (lock held)."""
+        self.last_used = time.monotonic()
+        if self.persisted and not self.is_loaded:
+            index_service.load(self.content_hash)
+            document_service.note_load()
+
+
+class DocumentService:
+    """
+    Service for content-addressed documents shared across sessions.
+    
+    Identical uploads resolve to the same record, so the stored file, chunks
+    and vectors are built once and held by the index service, shared
+    read-only. Each session (or
+    in-flight ingestion job) holding a document owns one reference; the
+    in-memory index is dropped when the worker's last reference is
+    released, and the file and stored index too unless the session store
+    shows another worker's session or job still using them.
+    
+    Completed indexes are persisted through the index store, so a document
+    registered again after a restart is queryable without re-embedding and
+    its index is only loaded when first searched.
+    
+    Loaded indexes are kept within memory_budget_bytes (0 for no limit):
+    when an index is loaded or built past the budget, the least recently
+    searched persisted indexes are evicted and reload from disk on their
+    next search. Indexes still being built, or that failed to persist, are
+    never evicted, since they can't be reloaded.
+    
+    Queries search versioned snapshots (open_snapshots), so ingestion never
+    changes an index under a running query: each appended batch, compressed
+    index or rebuild is published as a new version, and the memory of a
+    version that was replaced, evicted or released is freed when the last
+    query reading it closes its snapshot.
+    """
+    
+    def __init__(self, memory_budget_bytes: int = 0):
+        self.documents: Dict[str, DocumentRecord] = {}
+        self.memory_budget_bytes = memory_budget_bytes
+        self._lock = threading.Lock()
+        self._index_locks: Dict[str, threading.Lock] = {}
+        
+        self.loads = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        logger.info(f"DocumentService initialized (memory budget {memory_budget_bytes // (1024 * 1024) or 'unlimited'} MB)")
+    
+    def get_document(self, content_hash: str) -> Optional[DocumentRecord]:
+        """Get a document record by content hash."""
+        with self._lock:
+            return self.documents.get(content_hash)
+    
+    def acquire(self, content_hash: str, file_path: str) -> DocumentRecord:
+        """Take a reference to a document, registering it if it is new."""
+        with self._lock:
+            record = self.documents.get(content_hash)
+            if record is None:
+                record = DocumentRecord(content_hash=content_hash, file_path=file_path)
+                self._restore(record)
+                self.documents[content_hash] = record
+                self._index_locks[content_hash] = threading.Lock()
+                logger.info(f"Registered document {content_hash[:12]}")
+            record.ref_count += 1
+            return record
+    
+    def release(self, content_hash: str):
+        """Drop a reference to a document, deleting it once unreferenced."""
+        with self._lock:
+            record = self.documents.get(content_hash)
+            if record is None:
+                return
+            record.ref_count -= 1
+            if record.ref_count > 0:
+                return
+            del self.documents[content_hash]
+            self._index_locks.pop(content_hash, None)
+        index_service.remove(content_hash)
+        
+        # Clean up PDF file and stored index outside the registry lock
+        if not self._delete_if_unused(content_hash, record.file_path):
+            logger.info(f"Released document {content_hash[:12]}; still used by another worker")
+            return
+        logger.info(f"Released document {content_hash[:12]}")
+    
+    def delete_unused(self, content_hash: str, file_path: str):
+        """Delete a document's file and stored index if no worker's session or job uses it any more."""
+        if self._delete_if_unused(content_hash, file_path):
+            logger.info(f"Deleted unused document {content_hash[:12]}")
+    
+    def _delete_if_unused(self, content_hash: str, file_path: str) -> bool:
+        """
+        Delete a document's file and stored index unless a session or job on any worker uses it.
+        
+        Checked and deleted under the document's lock in the session store.
+        An upload records its job under the same lock before storing the
+        file, so a new upload of the same content is either seen as a use
+        here or stores its file after the delete.
+        
+        Returns:
+            True if the files were deleted
+        """
+        try:
+            with session_store.document_lock(content_hash):
+                if self.get_document(content_hash) is not None or session_store.document_in_use(content_hash):
+                    return False
+                self._delete_files(content_hash, file_path)
+                return True
+        except Exception as e:
+            # Left for remove_orphans at the next startup
+            logger.error(f"Error deleting unused document {content_hash[:12]}: {e}")
+            return False
+    
+    @staticmethod
+    def _delete_files(content_hash: str, file_path: str):
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Deleted PDF file: {file_path}")
+        except Exception as e:
+            logger.error(f"Error deleting PDF file: {e}")
+        index_store.delete(content_hash)
+    
+    @staticmethod
+    def _restore(record: DocumentRecord):
+        """Mark a new record as indexed if a complete index for it is stored on disk."""
+        try:
+            meta = index_store.load_meta(record.content_hash)
+        except Exception as e:
+            logger.error(f"Error reading stored index for {record.content_hash[:12]}: {e}")
+            return
+        if meta is None:
+            return
+        record.num_chunks = meta["num_chunks"]
+        record.indexed_chunks = meta["num_chunks"]
+        record.text_bytes = meta.get("text_bytes", 0)
+        record.persisted = True
+        record.version += 1
+        logger.info(f"Restored stored index for document {record.content_hash[:12]}")
+    
+    def refresh(self, content_hash: str):
+        """Mark a document indexed if another worker has stored its index since it was registered here."""
+        record = self.get_document(content_hash)
+        if record is None or record.persisted or record.indexed_chunks:
+            return
+        with record.lock:
+            self._restore(record)
+    
+    def open_snapshots(self, records: List[DocumentRecord]) -> List[DocumentSnapshot]:
+        """
+        Pin the current index version of each queryable document, for one query.
+        
+        Evicted indexes are loaded from disk first, so call this off the
+        event loop. Every snapshot must be given back to close_snapshots.
+        """
+        snapshots = []
+        try:
+            for record in records:
+                with record.lock:
+                    if not record.is_queryable:
+                        continue
+                    record._ensure_loaded()
+                    shard = index_service.pin(record.content_hash)
+                    if shard is None:
+                        continue
+                    snapshots.append(DocumentSnapshot(
+                        content_hash=record.content_hash,
+                        version=record.version,
+                        num_chunks=record.num_chunks,
+                        indexed_chunks=record.indexed_chunks,
+                        shard=shard
+                    ))
+        except Exception:
+            self.close_snapshots(snapshots)
+            raise
+        return snapshots
+    
+    @staticmethod
+    def close_snapshots(snapshots: List[DocumentSnapshot]):
+        """Unpin a query's snapshots, freeing versions that have since been replaced."""
+        for snapshot in snapshots:
+            index_service.unpin(snapshot.shard)
+    
+    def index_lock(self, content_hash: str) -> threading.Lock:
+        """
+        Lock serialising index builds for one document.
+        
+        A job that finds the lock held waits for the concurrent build of the
+        same content and then reuses its index instead of embedding again.
+        """
+        with self._lock:
+            return self._index_locks[content_hash]
+    
+    def append_index(
+        self,
+        content_hash: str,
+        text_embeddings: List[Tuple[str, List[float]]],
+        metadatas: List[dict],
+        num_chunks: int
+    ):
+        """
+        Add a batch of embedded chunks to a document's index.
+        
+        The first batch creates the vector and BM25 indexes, making the
+        document queryable; later batches are appended to both in place and
+        published as a new version, which snapshots taken before don't see.
+        Once the last batch is in, documents large enough for IVF-PQ are
+        compressed; the flat index keeps serving queries while the
+        compressed one is trained, and queries already running finish on it.
+        Small documents move to the shared index later, in consolidate.
+        """
+        record = self.get_document(content_hash)
+        if record is None:
+            raise ValueError(f"Document {content_hash} not found")
+        
+        texts = [text for text, _ in text_embeddings]
+        embeddings = np.asarray([embedding for _, embedding in text_embeddings], dtype=np.float32)
+        
+        # Hidden from snapshots until the new version is published below
+        index_service.add(content_hash, texts, embeddings, metadatas, num_chunks)
+        with record.lock:
+            record.num_chunks = num_chunks
+            record.indexed_chunks += len(text_embeddings)
+            record.text_bytes += sum(len(text.encode("utf-8")) for text in texts)
+            record.version += 1
+            complete = record.is_indexed
+        
+        # Make room among the other documents as this one grows
+        self.enforce_memory_budget()
+        if not complete:
+            return
+        
+        # No appends can race this: the caller holds the document's index lock
+        compressed = index_service.build_compressed(content_hash, num_chunks)
+        if compressed is not None:
+            with record.lock:
+                index_service.replace_index(content_hash, compressed)
+                record.version += 1
+    
+    def reset_index(self, content_hash: str):
+        """Discard a partially built index so the document can be rebuilt (running queries keep the old version)."""
+        record = self.get_document(content_hash)
+        if record is None:
+            return
+        with record.lock:
+            index_service.remove(content_hash)
+            record.num_chunks = None
+            record.indexed_chunks = 0
+            record.text_bytes = 0
+            record.persisted = False
+            record.version += 1
+        index_store.delete(content_hash)
+    
+    def persist(self, content_hash: str):
+        """
+        Write a fully indexed document to the index store.
+        
+        Queries keep searching while it is written; the caller holds the
+        document's index lock, so the index can't change meanwhile, and it
+        can't be evicted before it is marked persisted.
+        """
+        record = self.get_document(content_hash)
+        if record is None or not record.is_indexed:
+            return
+        with record.lock:
+            if not record.is_loaded or record.persisted:
+                return
+            meta = {
+                "num_chunks": record.num_chunks,
+                "text_bytes": record.text_bytes,
+            }
+        try:
+            index_service.save(content_hash, meta)
+        except Exception as e:
+            # The in-memory index still serves queries; it just won't survive a restart
+            logger.error(f"Error persisting index for document {content_hash[:12]}: {e}")
+            return
+        with record.lock:
+            record.persisted = True
+    
+    def consolidate(self, content_hash: str):
+        """Move a completed small document into the index service's shared index."""
+        record = self.get_document(content_hash)
+        if record is None or not record.is_indexed:
+            return
+        with record.lock:
+            index_service.consolidate(content_hash)
+    
+    def evict(self, content_hash: str) -> int:
+        """
+        Drop a persisted document's in-memory index.
+        
+        The index is reloaded from disk on its next search.
+        
+        Returns:
+            Approximate bytes freed
+        """
+        record = self.get_document(content_hash)
+        if record is None:
+            return 0
+        with record.lock:
+            return self._evict_locked(record)
+    
+    def _evict_locked(self, record: DocumentRecord) -> int:
+        """Drop a persisted document's in-memory index unless a query has it pinned (record lock held)."""
+        if not record.persisted or not record.is_loaded or index_service.in_use(record.content_hash):
+            return 0
+        freed = record.memory_bytes
+        index_service.remove(record.content_hash)
+        with self._lock:
+            self.evictions += 1
+            self.evicted_bytes += freed
+        logger.info(f"Evicted index for document {record.content_hash[:12]} ({freed / 1024:.0f} KB)")
+        return freed
+    
+    def note_load(self):
+        """Count an index load from disk and make room for it (called with that document's lock held)."""
+        with self._lock:
+            self.loads += 1
+        self.enforce_memory_budget()
+    
+    def enforce_memory_budget(self) -> int:
+        """
+        Evict least recently used indexes until the loaded documents fit the memory budget.
+        
+        Documents pinned by a running query, or being loaded or published
+        (their lock is held, including by the caller), are skipped rather
+        than waited for.
+        
+        Returns:
+            Approximate bytes freed
+        """
+        if not self.memory_budget_bytes:
+            return 0
+        with self._lock:
+            records = list(self.documents.values())
+        sizes = [(record, record.memory_bytes) for record in records if record.is_loaded]
+        used = sum(size for _, size in sizes)
+        if used <= self.memory_budget_bytes:
+            return 0
+        
+        freed = 0
+        for record, _ in sorted(sizes, key=lambda item: item[0].last_used):
+            if used - freed <= self.memory_budget_bytes:
+                break
+            if not record.persisted or not record.lock.acquire(blocking=False):
+                continue
+            try:
+                freed += self._evict_locked(record)
+            finally:
+                record.lock.release()
+        
+        if used - freed > self.memory_budget_bytes:
+            logger.warning(
+                f"Loaded documents use {(used - freed) / (1024 * 1024):.1f} MB, over the "
+                f"{self.memory_budget_bytes / (1024 * 1024):.0f} MB budget; the rest are in use or not persisted"
+            )
+        return freed
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Loaded documents, memory use against the budget and eviction counters."""
+        with self._lock:
+            records = list(self.documents.values())
+        loaded = [record for record in records if record.is_loaded]
+        return {
+            "documents": len(records),
+            "loaded_documents": len(loaded),
+            "memory_bytes": sum(record.memory_bytes for record in loaded),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+        }
+    
+    def remove_orphans(self) -> int:
+        """
+        Delete stored indexes and uploads that no session or ingestion job uses.
+        
+        Run at startup to clear what a previous process left behind. Uploads
+        written in the last ORPHAN_MIN_AGE_SECONDS are kept, since they may
+        belong to an upload in progress on another worker.
+        
+        Returns:
+            Number of indexes and files removed
+        """
+        with self._lock:
+            keep = set(self.documents.keys())
+        keep |= session_store.referenced_documents()
+        
+        removed = 0
+        for content_hash in index_store.stored_hashes():
+            if content_hash not in keep:
+                index_store.delete(content_hash)
+                removed += 1
+        
+        uploads_dir = Path("uploads")
+        now = time.time()
+        for path in uploads_dir.glob("*"):
+            try:
+                recent = now - path.stat().st_mtime < ORPHAN_MIN_AGE_SECONDS
+            except OSError:
+                continue
+            if recent:
+                continue
+            if path.suffix == ".tmp" or (path.suffix == ".pdf" and path.stem not in keep):
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.error(f"Error deleting orphaned upload {path}: {e}")
+        return removed
+
+
+# Global document service instance
+document_service = DocumentService(memory_budget_bytes=settings.DOCUMENT_MEMORY_BUDGET_MB * 1024 * 1024)
@@ -0,0 +1,200 @@
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any
+import logging
+
+import numpy as np
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a persistent per-chunk cache.
+    
+    Vectors are stored in SQLite keyed by (model, SHA-256 of the text), so
+    re-ingesting a document, or an edited revision of it, only sends the
+    chunks that have not been embedded before. Cache misses are sent in
+    fixed-size batches with bounded concurrency and retried with
+    exponential backoff when the API rate-limits or fails transiently.
+    """
+    
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        cache_path: str,
+        batch_size: int = 100,
+        max_concurrency: int = 4,
+        max_retries: int = 5
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.api_batches = 0
+        self.retries = 0
+    
+    @staticmethod
+    def _text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def _lookup(self, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Fetch cached vectors for the given hashes."""
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(text_hashes), 500):
+            batch = text_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._db_lock:
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch]
+                ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+    
+    def _store(self, vectors: Dict[str, List[float]]):
+        """Write newly embedded vectors to the cache."""
+        rows = [
+            (self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+            for text_hash, vector in vectors.items()
+        ]
+        with self._db_lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, backing off on rate limits and transient errors."""
+        attempt = 0
+        while True:
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                with self._stats_lock:
+                    self.api_batches += 1
+                return vectors
+            except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                with self._stats_lock:
+                    self.retries += 1
+                logger.warning(f"Embedding batch failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """Honour Retry-After when the API sends it, else exponential backoff with jitter."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return min(2 ** attempt, 30) + random.uniform(0, 1)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, only sending cache misses to the underlying model."""
+        text_hashes = [self._text_hash(text) for text in texts]
+        vectors = self._lookup(list(set(text_hashes)))
+        
+        # Embed each distinct missing text once
+        missing = {}
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        
+        with self._stats_lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        
+        if missing:
+            missing_hashes = list(missing.keys())
+            batches = [
+                missing_hashes[start:start + self.batch_size]
+                for start in range(0, len(missing_hashes), self.batch_size)
+            ]
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = executor.map(
+                    lambda batch: self._embed_batch([missing[text_hash] for text_hash in batch]),
+                    batches
+                )
+                new_vectors = {}
+                for batch, batch_vectors in zip(batches, results):
+                    new_vectors.update(zip(batch, batch_vectors))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+        
+        return [vectors[text_hash] for text_hash in text_hashes]
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query; queries are not cached."""
+        return self.embeddings.embed_query(text)
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a query asynchronously; queries are not cached."""
+        return await self.embeddings.aembed_query(text)
+    
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries asynchronously in one request; queries are not cached."""
+        return await self.embeddings.aembed_documents(texts)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache hit/miss and API call counters."""
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "api_batches": self.api_batches,
+                "retries": self.retries,
+            }
+
+
+# Global cached embedding model instance
+embedding_service = CachedEmbeddings(
+    embeddings=OpenAIEmbeddings(
+        model=settings.EMBEDDING_MODEL,
+        openai_api_key=settings.OPENAI_API_KEY,
+        openai_api_base=settings.OPENAI_BASE_URL
+    ),
+    model_name=settings.EMBEDDING_MODEL,
+    cache_path=settings.EMBEDDING_CACHE_PATH,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+    max_retries=settings.EMBEDDING_MAX_RETRIES
+)
@@ -0,0 +1,59 @@
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class ExpiryScheduler:
+    """
+    Deadlines for a set of keys, kept in a heap ordered by deadline.
+    
+    Each key has at most one live deadline. Rescheduling a key pushes a new
+    heap entry and leaves the old one to be discarded when it reaches the
+    top, so scheduling is O(log n) and nothing is ever scanned; the heap is
+    rebuilt once discarded entries outnumber live ones.
+    """
+    
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._deadlines)
+    
+    def schedule(self, key: str, deadline: float):
+        """Set (or move) a key's deadline."""
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+                heapq.heapify(self._heap)
+    
+    def cancel(self, key: str):
+        with self._lock:
+            self._deadlines.pop(key, None)
+    
+    def _drop_stale(self):
+        """Pop superseded and cancelled entries off the top of the heap (lock held)."""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+    
+    def next_deadline(self) -> Optional[float]:
+        """The earliest deadline, or None if nothing is scheduled."""
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[str]:
+        """Remove and return the keys whose deadline is at or before now, earliest first."""
+        due = []
+        with self._lock:
+            while limit is None or len(due) < limit:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, key = heapq.heappop(self._heap)
+                del self._deadlines[key]
+                due.append(key)
+        return due
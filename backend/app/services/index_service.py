@@ -0,0 +1,510 @@
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple, Any
+import logging
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.services.chunk_store import ChunkStore
+from app.services.index_store import index_store
+from app.services.lexical_index import LexicalIndex
+from app.services.pdf_service import pdf_service
+
+logger = logging.getLogger(__name__)
+
+# int8 arena codes are trained on the first document; leave room for the rest
+ARENA_RANGE_MARGIN = 0.1
+
+
+class _ReadWriteLock:
+    """Any number of concurrent readers or one writer; a waiting writer holds off new readers."""
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+@dataclass
+class Shard:
+    """
+    One document's chunks and indexes inside the IndexService.
+    
+    Appends take the shard's write lock and searches its read lock, so a
+    search only ever waits for one batch being added in memory. readers
+    counts the queries that have pinned the shard.
+    """
+    chunks: ChunkStore = field(default_factory=ChunkStore)
+    lexical_index: LexicalIndex = field(
+        default_factory=lambda: LexicalIndex(k1=settings.BM25_K1, b=settings.BM25_B)
+    )
+    index: Optional[faiss.Index] = None
+    arena_start: int = -1
+    count: int = 0
+    full_vectors: Optional[np.ndarray] = None
+    lock: _ReadWriteLock = field(default_factory=_ReadWriteLock, repr=False)
+    readers: int = 0
+    
+    @property
+    def in_arena(self) -> bool:
+        return self.arena_start >= 0
+
+
+class IndexService:
+    """
+    Process-wide store of document chunks and vector indexes.
+    
+    Every document is held once, under its content hash, however many
+    sessions reference it; sessions only keep the hash. Chunk text and
+    metadata live in a compact ChunkStore and each document keeps its own
+    BM25 index, so lexical scores are not skewed by other documents.
+    
+    Completed documents small enough for a flat index are moved into one
+    shared FAISS "arena" index at the configured precision, each occupying a
+    contiguous row range, and are searched with their range as a filter.
+    Thousands of small documents therefore cost one index rather than
+    thousands of objects. Larger documents, and documents still being
+    embedded, keep a dedicated HNSW, IVF-PQ or flat index. Removing an arena
+    document only marks its rows dead; the arena is compacted once dead rows
+    exceed INDEX_ARENA_COMPACT_RATIO of it.
+    
+    Writes to one document are serialised by the caller (DocumentService
+    holds the document's index lock); the arena has its own read/write lock.
+    
+    Queries pin the shard they search. A pinned shard that is removed, or
+    replaced by a compressed version, stays searchable (and keeps its arena
+    rows) until its last reader unpins it.
+    """
+    
+    def __init__(self, use_arena: bool = True, compact_ratio: float = 0.25):
+        self.use_arena = use_arena
+        self.compact_ratio = compact_ratio
+        self.shards: Dict[str, Shard] = {}
+        self._retired: List[Shard] = []
+        self._lock = threading.Lock()
+        
+        # Arena state (the index, shard row ranges, dead ranges) changes under the write lock
+        self._arena: Optional[faiss.Index] = None
+        self._arena_lock = _ReadWriteLock()
+        self._dead_ranges: List[Tuple[int, int]] = []
+        self._dead_rows = 0
+        self.compactions = 0
+        logger.info(f"IndexService initialized (shared arena {'on' if use_arena else 'off'})")
+    
+    def _get(self, document_id: str) -> Optional[Shard]:
+        with self._lock:
+            return self.shards.get(document_id)
+    
+    def is_loaded(self, document_id: str) -> bool:
+        with self._lock:
+            return document_id in self.shards
+    
+    def in_use(self, document_id: str) -> bool:
+        """Whether a query has the document's current shard pinned."""
+        with self._lock:
+            shard = self.shards.get(document_id)
+            return shard is not None and shard.readers > 0
+    
+    def pin(self, document_id: str) -> Optional[Shard]:
+        """Take a reader reference to a document's current shard, or None if it isn't loaded."""
+        with self._lock:
+            shard = self.shards.get(document_id)
+            if shard is not None:
+                shard.readers += 1
+            return shard
+    
+    def unpin(self, shard: Shard):
+        """Drop a reader reference, freeing the shard if it was retired and this was the last one."""
+        with self._lock:
+            shard.readers -= 1
+            free = shard.readers == 0 and any(retired is shard for retired in self._retired)
+        if free:
+            self._free(shard)
+    
+    def _retire(self, shard: Shard) -> bool:
+        """
+        Take a shard no longer reachable by document id out of service (lock held).
+        
+        The shard stays listed as retired until it is freed, so a compaction
+        meanwhile still shifts its arena rows.
+        
+        Returns:
+            True if it can be freed now; a pinned shard is freed by its last unpin
+        """
+        self._retired.append(shard)
+        return not shard.readers
+    
+    def add(
+        self,
+        document_id: str,
+        texts: List[str],
+        embeddings: np.ndarray,
+        metadatas: List[dict],
+        num_chunks: int
+    ):
+        """
+        Append a batch of embedded chunks to a document's indexes.
+        
+        The first batch creates the document's float32 index (sized for its
+        full chunk count) and BM25 index; later batches are appended in place.
+        Full-size embeddings are kept for re-scoring when the stored vectors
+        will be reduced or compressed.
+        """
+        dimension = pdf_service.index_dimension(embeddings.shape[1])
+        vectors = pdf_service.reduce_vectors(embeddings, dimension)
+        
+        with self._lock:
+            shard = self.shards.get(document_id)
+            if shard is None:
+                shard = Shard(index=pdf_service.create_index(num_chunks, dimension))
+                index_type = pdf_service.choose_index_type(num_chunks, dimension)
+                if settings.INDEX_RESCORE and pdf_service.is_compressed(index_type, dimension, embeddings.shape[1]):
+                    shard.full_vectors = np.empty((num_chunks, embeddings.shape[1]), dtype=np.float32)
+                self.shards[document_id] = shard
+        
+        with shard.lock.write():
+            shard.index.add(vectors)
+            shard.chunks.add(texts, metadatas)
+            shard.lexical_index.add(texts)
+            if shard.full_vectors is not None:
+                shard.full_vectors[shard.count:shard.count + len(embeddings)] = embeddings
+            shard.count += len(texts)
+    
+    def build_compressed(self, document_id: str, num_chunks: int) -> Optional[faiss.Index]:
+        """
+        Build the compressed index for a fully embedded document, if it needs one.
+        
+        The current index keeps serving searches meanwhile; install the
+        result with replace_index.
+        """
+        shard = self._get(document_id)
+        if shard is None or shard.index is None:
+            return None
+        return pdf_service.finalize_index(shard.index, num_chunks)
+    
+    def replace_index(self, document_id: str, index: faiss.Index):
+        """
+        Swap in a new shard with the given index, holding the same vectors in the same order.
+        
+        Queries that pinned the old shard finish on it.
+        """
+        shard = self._get(document_id)
+        if shard is None:
+            return
+        # Shared with the new shard, so merge pending postings while only the old one is reachable
+        with shard.lock.write():
+            shard.lexical_index.compact()
+        with self._lock:
+            if self.shards.get(document_id) is not shard:
+                return
+            self.shards[document_id] = replace(shard, index=index, lock=_ReadWriteLock(), readers=0)
+            free = self._retire(shard)
+        if free:
+            self._free(shard)
+    
+    def _arena_eligible(self, shard: Shard) -> bool:
+        return (
+            self.use_arena
+            and shard.index is not None
+            and shard.count > 0
+            and pdf_service.index_type_of(shard.index) == "flat"
+            and (self._arena is None or self._arena.d == shard.index.d)
+        )
+    
+    def consolidate(self, document_id: str) -> bool:
+        """
+        Move a completed flat-indexed document into the shared arena.
+        
+        Returns:
+            True if the document is now stored in the arena
+        """
+        shard = self._get(document_id)
+        if shard is None:
+            return False
+        with self._arena_lock.write():
+            if shard.in_arena:
+                return True
+            if not self._arena_eligible(shard) or self._get(document_id) is not shard:
+                return False
+            vectors = shard.index.reconstruct_n(0, shard.count)
+            if self._arena is None:
+                self._arena = pdf_service.new_index(
+                    "flat",
+                    vectors.shape[1],
+                    precision=pdf_service.index_precision(),
+                    training_vectors=vectors,
+                    range_margin=ARENA_RANGE_MARGIN
+                )
+            # Checked again under the lock _free reads in_arena under, so a
+            # shard removed meanwhile is never given arena rows
+            with self._lock:
+                if self.shards.get(document_id) is not shard:
+                    return False
+                shard.arena_start = self._arena.ntotal
+            self._arena.add(vectors)
+            shard.index = None
+        return True
+    
+    def remove(self, document_id: str):
+        """Drop a document's chunks and indexes from memory, once no query has them pinned."""
+        with self._lock:
+            shard = self.shards.pop(document_id, None)
+            if shard is None:
+                return
+            free = self._retire(shard)
+        if free:
+            self._free(shard)
+    
+    def _free(self, shard: Shard):
+        """Mark an unreachable shard's arena rows dead, compacting the arena when enough are."""
+        # Dedicated shards are freed without the arena lock, so the last unpin
+        # of a query never waits for arena searches or a compaction
+        with self._lock:
+            if not shard.in_arena:
+                self._retired = [retired for retired in self._retired if retired is not shard]
+                return
+        with self._arena_lock.write():
+            with self._lock:
+                self._retired = [retired for retired in self._retired if retired is not shard]
+            self._dead_ranges.append((shard.arena_start, shard.count))
+            self._dead_rows += shard.count
+            if self._dead_rows > self.compact_ratio * self._arena.ntotal:
+                self._compact_arena()
+    
+    def _compact_arena(self):
+        """Delete dead rows from the arena and shift the remaining ranges down (write lock held)."""
+        dead_starts = np.array(sorted(start for start, _ in self._dead_ranges), dtype=np.int64)
+        dead_ids = np.concatenate([
+            np.arange(start, start + count, dtype=np.int64) for start, count in self._dead_ranges
+        ])
+        # Rows dead before each range start, for shifting the live ranges
+        dead_before = np.concatenate([[0], np.cumsum([count for _, count in sorted(self._dead_ranges)])])
+        
+        self._arena.remove_ids(faiss.IDSelectorBatch(dead_ids))
+        with self._lock:
+            for shard in list(self.shards.values()) + self._retired:
+                if shard.in_arena:
+                    shard.arena_start -= int(dead_before[np.searchsorted(dead_starts, shard.arena_start)])
+        
+        logger.info(f"Compacted shared index: removed {self._dead_rows} rows, {self._arena.ntotal} remain")
+        self._dead_ranges = []
+        self._dead_rows = 0
+        self.compactions += 1
+    
+    def search(self, document_id: str, query_embedding: List[float], k: int) -> List[Tuple[int, float]]:
+        """
+        Search one document's vectors.
+        
+        Returns:
+            List of (chunk id, L2 distance) pairs, closest first
+        """
+        return self.search_batch(document_id, [query_embedding], k)[0]
+    
+    def search_batch(self, document_id: str, query_embeddings: List[List[float]], k: int) -> List[List[Tuple[int, float]]]:
+        """
+        Search one document's vectors for several queries in one index call.
+        
+        Returns:
+            Per query, a list of (chunk id, L2 distance) pairs, closest first
+        """
+        shard = self._get(document_id)
+        if shard is None:
+            return [[] for _ in query_embeddings]
+        return self.search_shard(shard, query_embeddings, k)
+    
+    def search_shard(
+        self,
+        shard: Shard,
+        query_embeddings: List[List[float]],
+        k: int,
+        limit: Optional[int] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Search a shard's vectors for several queries, seeing only its first limit chunks.
+        
+        Returns:
+            Per query, a list of (chunk id, L2 distance) pairs, closest first
+        """
+        limit = shard.count if limit is None else min(limit, shard.count)
+        if limit == 0:
+            return [[] for _ in query_embeddings]
+        with shard.lock.read():
+            full_vectors = shard.full_vectors if settings.INDEX_RESCORE else None
+            with self._arena_lock.read():
+                if shard.in_arena:
+                    id_range = (shard.arena_start, shard.arena_start + limit)
+                    return pdf_service.search_index_batch(self._arena, query_embeddings, k, full_vectors, id_range=id_range)
+                index = shard.index
+            
+            # Chunks appended after the limit are fetched and dropped
+            hidden = index.ntotal - limit
+            results = pdf_service.search_index_batch(index, query_embeddings, k + hidden, full_vectors)
+        if hidden:
+            results = [[hit for hit in hits if hit[0] < limit][:k] for hits in results]
+        return results
+    
+    def lexical_search(self, document_id: str, question: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Search one document's BM25 index.
+        
+        Returns:
+            List of (chunk id, BM25 score) pairs, best first
+        """
+        shard = self._get(document_id)
+        if shard is None:
+            return []
+        return self.lexical_search_shard(shard, question, k)
+    
+    def lexical_search_shard(self, shard: Shard, question: str, k: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Search a shard's BM25 index, scoring only its first limit chunks."""
+        with shard.lock.read():
+            if not shard.lexical_index.pending:
+                return shard.lexical_index.search(question, k, limit)
+        # The first search after an append merges the new postings
+        with shard.lock.write():
+            return shard.lexical_index.search(question, k, limit)
+    
+    def get_chunks(self, document_id: str, chunk_ids: List[int]) -> List[Document]:
+        """Look up a document's chunks by their position in its index."""
+        shard = self._get(document_id)
+        if shard is None:
+            return []
+        return self.shard_chunks(shard, chunk_ids)
+    
+    def shard_chunks(self, shard: Shard, chunk_ids: List[int]) -> List[Document]:
+        """Look up a shard's chunks by their position in its index."""
+        with shard.lock.read():
+            return [shard.chunks.get(chunk_id) for chunk_id in chunk_ids]
+    
+    def _export_index(self, shard: Shard) -> faiss.Index:
+        """A standalone copy of an arena document's rows, for persisting."""
+        with self._arena_lock.read():
+            if not shard.in_arena:
+                return shard.index
+            vectors = self._arena.reconstruct_n(shard.arena_start, shard.count)
+        index = pdf_service.new_index(
+            "flat",
+            vectors.shape[1],
+            precision=pdf_service.index_precision(),
+            training_vectors=vectors
+        )
+        index.add(vectors)
+        return index
+    
+    def save(self, document_id: str, meta: Dict[str, Any]):
+        """Persist a document through the index store."""
+        shard = self._get(document_id)
+        if shard is None:
+            raise ValueError(f"Document {document_id} is not loaded")
+        with shard.lock.write():
+            shard.lexical_index.compact()
+        index_store.save(
+            document_id,
+            self._export_index(shard),
+            shard.chunks,
+            shard.lexical_index,
+            shard.full_vectors,
+            meta
+        )
+        if shard.full_vectors is not None:
+            # Re-score from the page cache rather than holding full vectors in memory
+            shard.full_vectors = index_store.load_vectors(document_id)
+    
+    def load(self, document_id: str):
+        """Load a persisted document, placing it in the arena if it is small enough."""
+        index, chunks = index_store.load(document_id)
+        pdf_service.configure_index(index)
+        shard = Shard(
+            chunks=chunks,
+            index=index,
+            count=index.ntotal,
+            full_vectors=index_store.load_vectors(document_id)
+        )
+        lexical_index = index_store.load_lexical(document_id, k1=settings.BM25_K1, b=settings.BM25_B)
+        if lexical_index is None:
+            # Stored before lexical indexing existed; rebuild from the chunk text
+            shard.lexical_index.add(chunks.texts)
+        else:
+            shard.lexical_index = lexical_index
+        
+        with self._lock:
+            self.shards[document_id] = shard
+        self.consolidate(document_id)
+    
+    def memory_bytes(self, document_id: str) -> int:
+        """Approximate resident bytes of a document's vectors, BM25 postings, chunk metadata and unmapped re-score vectors."""
+        shard = self._get(document_id)
+        if shard is None:
+            return 0
+        size = shard.lexical_index.nbytes + shard.chunks.metadata_nbytes
+        with self._arena_lock.read():
+            if shard.in_arena:
+                size += shard.count * self._arena.code_size
+            elif shard.index is not None:
+                size += pdf_service.index_memory_bytes(shard.index)
+        if shard.full_vectors is not None and not isinstance(shard.full_vectors, np.memmap):
+            size += shard.full_vectors.nbytes
+        return size
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._arena_lock.read():
+            with self._lock:
+                arena_documents = sum(1 for shard in self.shards.values() if shard.in_arena)
+                documents = len(self.shards)
+                pinned = sum(1 for shard in self.shards.values() if shard.readers)
+                retired = len(self._retired)
+            arena_rows = self._arena.ntotal if self._arena is not None else 0
+            arena_bytes = pdf_service.index_memory_bytes(self._arena) if self._arena is not None else 0
+            dead_rows = self._dead_rows
+        return {
+            "documents": documents,
+            "arena_documents": arena_documents,
+            "dedicated_documents": documents - arena_documents,
+            "pinned_documents": pinned,
+            "retired_shards": retired,
+            "arena_vectors": arena_rows - dead_rows,
+            "arena_dead_vectors": dead_rows,
+            "arena_bytes": arena_bytes,
+            "compactions": self.compactions,
+        }
+
+
+# Global index service instance
+index_service = IndexService(
+    use_arena=settings.INDEX_SHARED_ARENA,
+    compact_ratio=settings.INDEX_ARENA_COMPACT_RATIO
+)
@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Any
+import logging
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.chunk_store import ChunkStore
+from app.services.lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+
+class IndexStore:
+    """
+    On-disk persistence for document indexes.
+    
+    Each document is stored under its content hash as ``index.faiss`` (the
+    raw FAISS index), ``chunks.jsonl`` (one JSON line of text and metadata
+    per vector, in index order), ``lexical.npz`` (the BM25 postings arrays),
+    optionally ``vectors.npy`` (full-precision embeddings used to re-score
+    candidates from a compressed index) and ``meta.json`` (chunk counts and
+    embedding model). The index is read back memory-mapped where
+    FAISS supports it, so reload is fast and pages are read on demand; no
+    pickle is involved and nothing is re-embedded.
+    """
+    
+    def __init__(self, storage_dir: str, use_mmap: bool = True):
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.use_mmap = use_mmap
+        logger.info(f"IndexStore initialized at {self.storage_dir}")
+    
+    def _document_dir(self, content_hash: str) -> Path:
+        return self.storage_dir / content_hash
+    
+    def exists(self, content_hash: str) -> bool:
+        """Whether a complete index is stored for a document."""
+        return (self._document_dir(content_hash) / "meta.json").exists()
+    
+    def save(
+        self,
+        content_hash: str,
+        index: faiss.Index,
+        chunks: ChunkStore,
+        lexical_index: Optional[LexicalIndex],
+        full_vectors: Optional[np.ndarray],
+        meta: Dict[str, Any]
+    ):
+        """
+        Write a document's index, chunks and metadata to disk.
+        
+        Files are written to a temporary directory that is renamed into
+        place, so a crash mid-write never leaves a partial index behind.
+        """
+        target_dir = self._document_dir(content_hash)
+        tmp_dir = self.storage_dir / f".{content_hash}.{os.urandom(4).hex()}.tmp"
+        tmp_dir.mkdir(parents=True)
+        try:
+            faiss.write_index(index, str(tmp_dir / "index.faiss"))
+            
+            with open(tmp_dir / "chunks.jsonl", "w", encoding="utf-8") as f:
+                for chunk_id in range(len(chunks)):
+                    f.write(json.dumps({
+                        "text": chunks.texts[chunk_id],
+                        "metadata": chunks.metadata(chunk_id)
+                    }) + "\n")
+            
+            if lexical_index is not None:
+                np.savez(tmp_dir / "lexical.npz", **lexical_index.to_arrays())
+            if full_vectors is not None:
+                np.save(tmp_dir / "vectors.npy", full_vectors)
+            
+            # meta.json marks the index as complete, so it is written last
+            with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+                json.dump(dict(meta, embedding_model=settings.EMBEDDING_MODEL), f)
+            
+            if target_dir.exists():
+                shutil.rmtree(target_dir)
+            os.replace(tmp_dir, target_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info(f"Persisted index for document {content_hash[:12]}")
+    
+    def load_meta(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Read a stored document's metadata, or None if it isn't stored."""
+        if not self.exists(content_hash):
+            return None
+        with open(self._document_dir(content_hash) / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("embedding_model") != settings.EMBEDDING_MODEL:
+            logger.info(f"Ignoring stored index for {content_hash[:12]}: built with a different embedding model")
+            return None
+        return meta
+    
+    def load(self, content_hash: str) -> Tuple[faiss.Index, ChunkStore]:
+        """Load a stored FAISS index and its chunks."""
+        document_dir = self._document_dir(content_hash)
+        index_path = str(document_dir / "index.faiss")
+        index = None
+        if self.use_mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.warning(f"Memory-mapped load failed for {content_hash[:12]}, reading fully: {e}")
+        if index is None:
+            index = faiss.read_index(index_path)
+        
+        chunks = ChunkStore()
+        with open(document_dir / "chunks.jsonl", encoding="utf-8") as f:
+            for line in f:
+                chunk = json.loads(line)
+                chunks.add([chunk["text"]], [chunk["metadata"]])
+        
+        logger.info(f"Loaded index for document {content_hash[:12]} ({index.ntotal} vectors)")
+        return index, chunks
+    
+    def load_lexical(self, content_hash: str, k1: float = 1.2, b: float = 0.75) -> Optional[LexicalIndex]:
+        """Load a stored BM25 index, or None if the document was stored without one."""
+        path = self._document_dir(content_hash) / "lexical.npz"
+        if not path.exists():
+            return None
+        with np.load(path) as arrays:
+            return LexicalIndex.from_arrays(arrays, k1=k1, b=b)
+    
+    def load_vectors(self, content_hash: str) -> Optional[np.ndarray]:
+        """Memory-map stored full-precision vectors, or None if there are none."""
+        path = self._document_dir(content_hash) / "vectors.npy"
+        if not path.exists():
+            return None
+        return np.load(path, mmap_mode="r")
+    
+    def delete(self, content_hash: str):
+        """Remove a document's stored index."""
+        shutil.rmtree(self._document_dir(content_hash), ignore_errors=True)
+    
+    def stored_hashes(self) -> List[str]:
+        """Content hashes with an index directory on disk, complete or not."""
+        return [
+            path.name for path in self.storage_dir.iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        ]
+
+
+# Global index store instance
+index_store = IndexStore(settings.INDEX_STORAGE_DIR, use_mmap=settings.INDEX_MMAP)
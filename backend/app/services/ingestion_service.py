@@ -0,0 +1,335 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Any
+from dataclasses import dataclass, field
+import logging
+
+from app.core.config import settings
+from app.services.pdf_service import pdf_service
+from app.services.session_service import session_service
+from app.services.document_service import document_service
+from app.services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+# Progress updates are written to the session store at most this often
+JOB_SAVE_INTERVAL_SECONDS = 1.0
+
+# Unfinished jobs not updated for this long were lost with their worker
+STALE_JOB_MINUTES = 10
+
+# Each worker refreshes its unfinished jobs in the session store this often,
+# well within STALE_JOB_MINUTES, even while they are queued or between updates
+JOB_HEARTBEAT_SECONDS = 60
+
+
+@dataclass
+class IngestionJob:
+    """State of a single PDF ingestion job."""
+    job_id: str
+    session_id: str
+    filename: str
+    file_path: str
+    content_hash: str
+    replace_document_id: Optional[str] = None
+    # Whether this job added its document to the session (rather than finding it there)
+    added_document: bool = False
+    status: str = "queued"
+    progress: float = 0.0
+    num_chunks: Optional[int] = None
+    error: Optional[str] = None
+    reused_index: bool = False
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("completed", "failed")
+    
+    @property
+    def processing_time(self) -> Optional[float]:
+        if not self.started_at:
+            return None
+        end = self.finished_at or datetime.now()
+        return (end - self.started_at).total_seconds()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "filename": self.filename,
+            "file_path": self.file_path,
+            "content_hash": self.content_hash,
+            "replace_document_id": self.replace_document_id,
+            "added_document": self.added_document,
+            "status": self.status,
+            "progress": self.progress,
+            "num_chunks": self.num_chunks,
+            "error": self.error,
+            "reused_index": self.reused_index,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IngestionJob":
+        timestamps = {
+            key: datetime.fromisoformat(data[key]) if data.get(key) else None
+            for key in ("created_at", "started_at", "finished_at")
+        }
+        return cls(**dict(data, **timestamps))
+
+
+class IngestionService:
+    """
+    Service for running PDF ingestion jobs on a bounded worker pool.
+    
+    Job state is written to the session store as the job progresses, so its
+    status can be polled on any worker.
+    """
+    
+    def __init__(self, max_workers: int = 2):
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._saved_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Serializes writes of job state, so a heartbeat can't overwrite a newer save
+        self._save_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="ingestion"
+        )
+        logger.info(f"IngestionService initialized with {max_workers} workers")
+    
+    def create_job(
+        self,
+        session_id: str,
+        file_path: str,
+        filename: str,
+        content_hash: str,
+        replace_document_id: Optional[str] = None
+    ) -> str:
+        """
+        Record a queued ingestion job and return its ID; start it with start_job.
+        
+        Call this before acquiring the document and storing its file. The
+        job is saved under the document's lock in the session store, which
+        marks the document in use on every worker, so no worker deletes the
+        file while it is being stored. replace_document_id is removed from
+        the session when the new document is added to it.
+        """
+        job_id = str(uuid.uuid4())
+        job = IngestionJob(
+            job_id=job_id,
+            session_id=session_id,
+            filename=filename,
+            file_path=file_path,
+            content_hash=content_hash,
+            replace_document_id=replace_document_id
+        )
+        
+        with session_store.document_lock(content_hash):
+            session_store.save_job(job.to_dict(), time.time())
+        with self._lock:
+            self.jobs[job_id] = job
+        return job_id
+    
+    def start_job(self, job_id: str):
+        """
+        Queue a job made by create_job for processing.
+        
+        The job takes over a document reference the caller has acquired, and
+        holds it until it is handed to the session.
+        """
+        with self._lock:
+            job = self.jobs[job_id]
+        self._executor.submit(self._run_job, job)
+        logger.info(f"Queued ingestion job {job_id} for session {job.session_id}")
+    
+    def cancel_job(self, job_id: str, error: str):
+        """Mark a job made by create_job that will not be started as failed, so its document is no longer held."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.error = error
+        job.status = "failed"
+        job.finished_at = datetime.now()
+        self._save(job)
+    
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        """Get job state by ID, from the session store if another worker runs the job."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        data = session_store.get_job(job_id)
+        return IngestionJob.from_dict(data) if data else None
+    
+    def _save(self, job: IngestionJob, force: bool = True):
+        """Write a job's state to the session store; progress-only updates are throttled."""
+        with self._save_lock:
+            now = time.monotonic()
+            if not force and now - self._saved_at.get(job.job_id, 0.0) < JOB_SAVE_INTERVAL_SECONDS:
+                return
+            self._saved_at[job.job_id] = now
+            try:
+                session_store.save_job(job.to_dict(), time.time())
+            except Exception as e:
+                logger.error(f"Error saving ingestion job {job.job_id}: {e}")
+    
+    def heartbeat(self) -> int:
+        """
+        Refresh the stored update time of this worker's unfinished jobs.
+        
+        Queued jobs and long stages report no progress for a while; without
+        this, other workers would fail them as lost. Returns the number of
+        jobs refreshed.
+        """
+        with self._lock:
+            unfinished = [job for job in self.jobs.values() if not job.is_finished]
+        for job in unfinished:
+            self._save(job)
+        return len(unfinished)
+    
+    def _update_progress(self, job: IngestionJob, stage: str, progress: float):
+        """Record a stage/progress update reported by the PDF service."""
+        stage_changed = job.status != stage
+        job.status = stage
+        job.progress = round(min(max(progress, 0.0), 1.0), 3)
+        self._save(job, force=stage_changed)
+    
+    def _run_job(self, job: IngestionJob):
+        """Process the PDF and attach the result to the job's session."""
+        job.started_at = datetime.now()
+        self._save(job)
+        attached = False
+        
+        def attach_to_session():
+            # Recorded before adding, so whoever cleans up after this job
+            # (here, or another worker if this one dies) never removes a
+            # document the session already held before the job
+            session = session_service.get_session(job.session_id)
+            job.added_document = session is not None and job.content_hash not in session.documents
+            self._save(job)
+            # Hands the job's document reference over to the session
+            session_service.add_document(
+                session_id=job.session_id,
+                document_id=job.content_hash,
+                filename=job.filename,
+                file_path=job.file_path,
+                replace_document_id=job.replace_document_id
+            )
+        
+        try:
+            # Identical content is indexed once; concurrent jobs for the same
+            # document wait here and reuse the index built by the first one
+            with document_service.index_lock(job.content_hash):
+                record = document_service.get_document(job.content_hash)
+                if record.is_indexed:
+                    job.reused_index = True
+                    logger.info(f"Reusing index for document {job.content_hash[:12]}")
+                else:
+                    # Left over from a failed build
+                    if record.is_loaded:
+                        document_service.reset_index(job.content_hash)
+                    
+                    batches = pdf_service.process_pdf(
+                        job.file_path,
+                        progress_callback=lambda stage, progress: self._update_progress(job, stage, progress)
+                    )
+                    for text_embeddings, metadatas, num_chunks in batches:
+                        job.status = "indexing"
+                        document_service.append_index(job.content_hash, text_embeddings, metadatas, num_chunks)
+                        job.num_chunks = num_chunks
+                        
+                        # Publish as soon as the first batch is searchable
+                        if not attached:
+                            attach_to_session()
+                            attached = True
+                        self._update_progress(job, "indexing", 0.2 + 0.8 * record.indexed_fraction)
+                    
+                    # Survives restarts and lets the in-memory index be evicted
+                    document_service.persist(job.content_hash)
+                    document_service.consolidate(job.content_hash)
+            
+            if not attached:
+                attach_to_session()
+                attached = True
+            
+            job.num_chunks = record.num_chunks
+            job.progress = 1.0
+            job.status = "completed"
+            job.finished_at = datetime.now()
+            logger.info(f"Ingestion job {job.job_id} completed: {record.num_chunks} chunks")
+        
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            job.finished_at = datetime.now()
+            logger.error(f"Ingestion job {job.job_id} failed: {e}", exc_info=True)
+            
+            # Recorded as finished first, so the release below can delete the file
+            self._save(job)
+            
+            # Drop the reference (the job's, or the session's if the partial
+            # index was already published by this job); the file goes if
+            # nothing else uses it
+            if not attached:
+                document_service.release(job.content_hash)
+            elif job.added_document:
+                session_service.remove_document(job.session_id, job.content_hash)
+        
+        finally:
+            job.finished_at = job.finished_at or datetime.now()
+            self._save(job)
+            with self._save_lock:
+                self._saved_at.pop(job.job_id, None)
+    
+    def cleanup_finished_jobs(self, retention_minutes: int) -> int:
+        """
+        Forget finished jobs older than the retention window.
+        
+        Also fails jobs a lost worker left unfinished in the session store,
+        removing their partial document from the session if the job added it. Live workers keep
+        their jobs out of this through heartbeat().
+        """
+        cutoff = datetime.now() - timedelta(minutes=retention_minutes)
+        with self._lock:
+            expired_jobs = [
+                job_id for job_id, job in self.jobs.items()
+                if job.is_finished and job.finished_at < cutoff
+            ]
+            for job_id in expired_jobs:
+                del self.jobs[job_id]
+        
+        with self._lock:
+            running = set(self.jobs)
+        stale_cutoff = time.time() - STALE_JOB_MINUTES * 60
+        for data in session_store.stale_jobs(stale_cutoff):
+            if data["job_id"] in running:
+                continue
+            job = IngestionJob.from_dict(data)
+            job.status = "failed"
+            job.error = "Ingestion was interrupted"
+            job.finished_at = datetime.now()
+            session_store.save_job(job.to_dict(), time.time())
+            if job.added_document:
+                session_service.remove_document(job.session_id, job.content_hash)
+            logger.warning(f"Ingestion job {job.job_id} was interrupted; marked failed")
+        
+        session_store.delete_jobs(cutoff.timestamp())
+        return len(expired_jobs)
+    
+    def shutdown(self):
+        """Stop accepting jobs and cancel any that have not started."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("IngestionService shut down")
+
+
+# Global ingestion service instance
+ingestion_service = IngestionService(max_workers=settings.INGESTION_WORKERS)
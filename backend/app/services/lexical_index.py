@@ -0,0 +1,184 @@
+import re
+from typing import Dict, List, Optional, Tuple, Iterable
+
+import numpy as np
+
+# Words, numbers and identifiers such as "XK-12", "E_1042" or "v2.3.1"
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[-_./:][A-Za-z0-9]+)*")
+IDENTIFIER_SEPARATORS = re.compile(r"[-_./:]")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "the this that to was what when where which who why with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms for indexing and search.
+    
+    Compound identifiers are kept whole and also split into their parts, so
+    "XK-12" matches both the exact code and a search for "xk 12".
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text):
+        term = match.group().lower()
+        terms.append(term)
+        if IDENTIFIER_SEPARATORS.search(term):
+            terms.extend(part for part in IDENTIFIER_SEPARATORS.split(term) if part)
+    return terms
+
+
+def is_identifier(word: str) -> bool:
+    """Part numbers, error codes and the like: digits, inner separators or all caps."""
+    return (
+        any(c.isdigit() for c in word)
+        or IDENTIFIER_SEPARATORS.search(word) is not None
+        or (len(word) >= 2 and word.isupper())
+    )
+
+
+def identifier_ratio(question: str) -> float:
+    """Fraction of the question's content words that look like identifiers."""
+    words = [w for w in TOKEN_PATTERN.findall(question) if w.lower() not in STOPWORDS]
+    if not words:
+        return 0.0
+    return sum(1 for w in words if is_identifier(w)) / len(words)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one document's chunks.
+    
+    Chunk ids are positions in the document's FAISS index, so lexical and
+    vector hits refer to the same chunks. Postings are held as flat numpy
+    arrays in CSR layout (per-term offsets into chunk-id and term-frequency
+    arrays). Batches added during ingestion are kept pending and merged into
+    the CSR arrays on the next search, so a search with batches pending
+    modifies the index and needs the same exclusive access as add.
+    """
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.chunk_ids = np.zeros(0, dtype=np.int32)
+        self.term_freqs = np.zeros(0, dtype=np.float32)
+        self.chunk_lengths = np.zeros(0, dtype=np.float32)
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._pending_lengths: List[np.ndarray] = []
+    
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_lengths) + sum(len(lengths) for lengths in self._pending_lengths)
+    
+    @property
+    def pending(self) -> bool:
+        """Whether added batches are waiting to be merged into the postings."""
+        return bool(self._pending)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.chunk_ids.nbytes + self.term_freqs.nbytes + self.chunk_lengths.nbytes
+    
+    def add(self, texts: Iterable[str]):
+        """Index chunks, numbered after those already added."""
+        first_id = self.num_chunks
+        term_ids, chunk_ids, term_freqs, lengths = [], [], [], []
+        for offset, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            counts: Dict[int, int] = {}
+            for term in terms:
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_ids.extend(counts.keys())
+            term_freqs.extend(counts.values())
+            chunk_ids.extend([first_id + offset] * len(counts))
+        
+        self._pending.append((
+            np.array(term_ids, dtype=np.int64),
+            np.array(chunk_ids, dtype=np.int32),
+            np.array(term_freqs, dtype=np.float32)
+        ))
+        self._pending_lengths.append(np.array(lengths, dtype=np.float32))
+    
+    def compact(self):
+        """Merge pending batches into the CSR postings."""
+        if not self._pending:
+            return
+        existing_terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int64), np.diff(self.offsets))
+        term_ids = np.concatenate([existing_terms] + [batch[0] for batch in self._pending])
+        chunk_ids = np.concatenate([self.chunk_ids] + [batch[1] for batch in self._pending])
+        term_freqs = np.concatenate([self.term_freqs] + [batch[2] for batch in self._pending])
+        
+        # Stable sort keeps each term's postings in chunk order
+        order = np.argsort(term_ids, kind="stable")
+        self.chunk_ids = chunk_ids[order]
+        self.term_freqs = term_freqs[order]
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)), out=self.offsets[1:])
+        self.chunk_lengths = np.concatenate([self.chunk_lengths] + self._pending_lengths)
+        self._pending = []
+        self._pending_lengths = []
+    
+    def search(self, query: str, k: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Score chunks against the query with BM25.
+        
+        With limit, only the first limit chunks are scored, with the
+        statistics they had before any later chunks were added.
+        
+        Returns:
+            List of (chunk id, score) pairs for chunks matching at least one
+            query term, best first
+        """
+        self.compact()
+        num_chunks = len(self.chunk_lengths) if limit is None else min(limit, len(self.chunk_lengths))
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids or num_chunks == 0:
+            return []
+        
+        chunk_lengths = self.chunk_lengths[:num_chunks]
+        average_length = float(chunk_lengths.mean()) or 1.0
+        scores = np.zeros(num_chunks, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            ids = self.chunk_ids[start:end]
+            tf = self.term_freqs[start:end]
+            if num_chunks < len(self.chunk_lengths):
+                # Postings are in chunk order, so the visible chunks' are a prefix
+                visible = int(np.searchsorted(ids, num_chunks))
+                ids, tf = ids[:visible], tf[:visible]
+            idf = np.log(1.0 + (num_chunks - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * chunk_lengths[ids] / average_length)
+            scores[ids] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in matched]
+    
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays for np.savez; the vocabulary is stored in term-id order."""
+        self.compact()
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        return {
+            "vocabulary": np.array(terms, dtype=str),
+            "offsets": self.offsets,
+            "chunk_ids": self.chunk_ids,
+            "term_freqs": self.term_freqs,
+            "chunk_lengths": self.chunk_lengths,
+        }
+    
+    @classmethod
+    def from_arrays(cls, arrays, k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        index = cls(k1=k1, b=b)
+        index.vocabulary = {str(term): term_id for term_id, term in enumerate(arrays["vocabulary"])}
+        index.offsets = arrays["offsets"]
+        index.chunk_ids = arrays["chunk_ids"]
+        index.term_freqs = arrays["term_freqs"]
+        index.chunk_lengths = arrays["chunk_lengths"]
+        return index
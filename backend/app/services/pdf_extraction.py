@@ -0,0 +1,46 @@
+"""
+Page-range text extraction used by the parallel PDF loader.
+
+Kept free of application imports so process-pool workers can import it
+without loading settings, embeddings or the other services.
+"""
+from typing import List, Tuple, Dict, Any
+
+import fitz
+
+
+def get_page_count(file_path: str) -> int:
+    """Return the number of pages in a PDF."""
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def extract_page_range(file_path: str, start: int, stop: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Extract text for pages [start, stop) of a PDF.
+    
+    Metadata matches what PyMuPDFLoader produces, so documents built from
+    these results are interchangeable with the single-process loader.
+    
+    Returns:
+        List of (page_text, metadata) tuples in page order
+    """
+    with fitz.open(file_path) as doc:
+        doc_metadata = {
+            k: v for k, v in doc.metadata.items()
+            if type(v) in [str, int]
+        }
+        pages = []
+        for page_number in range(start, min(stop, len(doc))):
+            page = doc[page_number]
+            metadata = dict(
+                {
+                    "source": file_path,
+                    "file_path": file_path,
+                    "page": page_number,
+                    "total_pages": len(doc),
+                },
+                **doc_metadata
+            )
+            pages.append((page.get_text(), metadata))
+        return pages
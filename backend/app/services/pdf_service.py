@@ -1,99 +1,543 @@
 import os
+import hashlib
 import tempfile
 from pathlib import Path
 import logging
-from typing import Tuple
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Tuple, Callable, Optional, List, Iterator
 
+import aiofiles
+import aiofiles.os
+import faiss
+import numpy as np
+from fastapi import UploadFile
+from langchain_core.documents import Document
 from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 
 from app.core.config import settings
+from app.services.pdf_extraction import get_page_count, extract_page_range
+from app.services.embedding_service import embedding_service
+from app.services.text_chunker import TextChunker
 
 logger = logging.getLogger(__name__)
 
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+PRECISION_BYTES = {"float32": 4, "float16": 2, "int8": 1}
+INDEX_PRECISIONS = tuple(PRECISION_BYTES)
+
+
+class PDFValidationError(Exception):
+    """Raised when an uploaded file is rejected."""
+    
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class PDFService:
     """Service for processing PDF files."""
     
     def __init__(self):
-        self.embedding_model = OpenAIEmbeddings(
-            model="text-embedding-3-large",
-            openai_api_key=settings.OPENAI_API_KEY
-        )
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.embedding_model = embedding_service
+        self.text_splitter = TextChunker(
             chunk_size=settings.CHUNK_SIZE,
             chunk_overlap=settings.CHUNK_OVERLAP
         )
-        logger.info("PDFService initialized with OpenAI embeddings")
+        self._extraction_pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        logger.info("PDFService initialized with cached OpenAI embeddings")
+    
+    def _get_extraction_pool(self) -> ProcessPoolExecutor:
+        """Lazily create the process pool used for parallel page extraction."""
+        with self._pool_lock:
+            if self._extraction_pool is None:
+                # Spawn rather than fork: the pool is created from ingestion threads
+                self._extraction_pool = ProcessPoolExecutor(
+                    max_workers=settings.EXTRACTION_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started PDF extraction pool with {settings.EXTRACTION_PROCESSES} processes")
+            return self._extraction_pool
     
-    async def save_uploaded_file(self, file_content: bytes, filename: str) -> str:
-        """Save uploaded file to uploads directory."""
+    def _discard_extraction_pool(self, pool: ProcessPoolExecutor):
+        """Drop a broken pool so the next large PDF starts a fresh one."""
+        with self._pool_lock:
+            if self._extraction_pool is pool:
+                self._extraction_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def load_pdf(self, file_path: str) -> List[Document]:
+        """
+        Extract one document per PDF page.
+        
+        Large PDFs are split into contiguous page ranges extracted across a
+        process pool; results are reassembled in page order with the same
+        metadata PyMuPDFLoader produces. PDFs below
+        PARALLEL_EXTRACTION_MIN_PAGES are extracted in-process, as is a PDF
+        whose pool broke (a worker process died); the broken pool is
+        replaced for the next one.
+        """
+        num_pages = get_page_count(file_path)
+        processes = settings.EXTRACTION_PROCESSES
+        if processes <= 1 or num_pages < settings.PARALLEL_EXTRACTION_MIN_PAGES:
+            return PyMuPDFLoader(file_path).load()
+        
+        pages_per_range = -(-num_pages // processes)
+        ranges = [
+            (start, min(start + pages_per_range, num_pages))
+            for start in range(0, num_pages, pages_per_range)
+        ]
+        logger.info(f"Extracting {num_pages} pages across {len(ranges)} processes")
+        
+        pool = self._get_extraction_pool()
+        try:
+            futures = [
+                pool.submit(extract_page_range, file_path, start, stop)
+                for start, stop in ranges
+            ]
+            return [
+                Document(page_content=text, metadata=metadata)
+                for future in futures
+                for text, metadata in future.result()
+            ]
+        except BrokenProcessPool as e:
+            logger.error(f"PDF extraction pool broke ({e}); extracting {file_path} in-process")
+            self._discard_extraction_pool(pool)
+            return PyMuPDFLoader(file_path).load()
+    
+    def shutdown(self):
+        """Stop the extraction process pool, if it was started."""
+        with self._pool_lock:
+            pool, self._extraction_pool = self._extraction_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def upload_path(content_hash: str) -> str:
+        """Content-addressed path of a stored upload."""
+        return str(Path("uploads") / f"{content_hash}.pdf")
+    
+    async def save_uploaded_file(self, upload_file: UploadFile, filename: str) -> Tuple[str, str, int]:
+        """
+        Stream an uploaded file to a temporary file in the uploads directory.
+        
+        The upload is read and written asynchronously in fixed-size blocks, so
+        memory per upload stays constant regardless of file size. The PDF
+        magic bytes are checked on the first block and the upload is aborted
+        as soon as it crosses the size limit. Move the result to its
+        content-addressed path with store_uploaded_file.
+        
+        Returns:
+            Tuple of (temporary file path, content_hash, file_size)
+        
+        Raises:
+            PDFValidationError: If the file is not a valid PDF or is too large
+        """
+        # Check file extension before reading anything
+        if not filename or not filename.lower().endswith('.pdf'):
+            raise PDFValidationError("Invalid file type. Only PDF files are allowed")
+        
         # Create uploads directory if it doesn't exist
         uploads_dir = Path("uploads")
         uploads_dir.mkdir(exist_ok=True)
         
-        # Create unique filename
-        file_path = uploads_dir / f"{os.urandom(8).hex()}_{filename}"
+        # Write via a temporary name so concurrent identical uploads never
+        # observe a partially written file
+        tmp_path = uploads_dir / f"{os.urandom(8).hex()}.tmp"
+        block_size = settings.UPLOAD_CHUNK_SIZE_KB * 1024
+        hasher = hashlib.sha256()
+        file_size = 0
+        header = b""
+        
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                while True:
+                    block = await upload_file.read(block_size)
+                    if not block:
+                        break
+                    
+                    # Check PDF magic bytes (PDF files start with %PDF)
+                    if len(header) < 4:
+                        header += block[:4 - len(header)]
+                        if not b"%PDF".startswith(header):
+                            raise PDFValidationError("Invalid PDF file format")
+                    
+                    # Check file size
+                    file_size += len(block)
+                    if file_size > settings.max_file_size_bytes:
+                        raise PDFValidationError(
+                            f"File size exceeds {settings.MAX_FILE_SIZE_MB}MB limit",
+                            status_code=413
+                        )
+                    
+                    hasher.update(block)
+                    await f.write(block)
+            
+            if header != b"%PDF":
+                raise PDFValidationError("Invalid PDF file format")
         
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        except Exception:
+            await aiofiles.os.remove(tmp_path)
+            raise
         
-        logger.info(f"Saved uploaded file to: {file_path}")
-        return str(file_path)
+        return str(tmp_path), hasher.hexdigest(), file_size
     
-    def process_pdf(self, file_path: str) -> Tuple[any, int]:
+    async def store_uploaded_file(self, tmp_path: str, content_hash: str) -> str:
         """
-        Process PDF file and create vector store.
+        Move a file written by save_uploaded_file to its content-addressed path.
+        
+        The caller must already have recorded the upload's job and hold a
+        reference to the document, so a release of the same content on any
+        worker can't delete the file once it is in place. A stored copy is replaced rather than reused, in case a
+        release deleted it just before the reference was taken.
         
         Returns:
-            Tuple of (vector_store, num_chunks)
+            The stored file's path
+        """
+        file_path = self.upload_path(content_hash)
+        existed = os.path.exists(file_path)
+        await aiofiles.os.replace(tmp_path, file_path)
+        if existed:
+            logger.info(f"Replaced stored copy of {content_hash[:12]}: {file_path}")
+        else:
+            logger.info(f"Saved uploaded file to: {file_path}")
+        return file_path
+    
+    def process_pdf(
+        self,
+        file_path: str,
+        progress_callback: Optional[Callable[[str, float], None]] = None
+    ) -> Iterator[Tuple[List[Tuple[str, List[float]]], List[dict], int]]:
+        """
+        Process PDF file into embedded chunk batches.
+        
+        Chunks are embedded and yielded in page order, one batch at a time, so
+        the caller can publish a partial index before the whole document has
+        been embedded. The first batch is kept small to make the document
+        queryable as early as possible.
+        
+        Args:
+            file_path: Path to the PDF file on disk
+            progress_callback: Optional callable receiving (stage, progress) updates,
+                where progress is a fraction between 0 and 1 of the whole job
+        
+        Yields:
+            Tuples of (text_embeddings, metadatas, num_chunks), where num_chunks
+            is the total chunk count of the document
         """
+        def report(stage: str, progress: float):
+            if progress_callback:
+                progress_callback(stage, progress)
+        
         try:
             # Load PDF
+            report("loading", 0.0)
             logger.info(f"Loading PDF from: {file_path}")
-            loader = PyMuPDFLoader(file_path)
-            docs = loader.load()
+            docs = self.load_pdf(file_path)
             logger.info(f"Loaded {len(docs)} pages from PDF")
             
             # Split into chunks
+            report("splitting", 0.1)
             chunks = self.text_splitter.split_documents(docs)
             num_chunks = len(chunks)
             logger.info(f"Split PDF into {num_chunks} chunks")
+            if num_chunks == 0:
+                raise ValueError("No text could be extracted from the PDF")
             
-            # Create vector store
-            logger.info("Creating FAISS vector store...")
-            vector_store = FAISS.from_documents(chunks, self.embedding_model)
-            logger.info("Vector store created successfully")
-            
-            return vector_store, num_chunks
-            
+            # Embed chunks in page-ordered steps; each step is sent as
+            # concurrent API batches, skipping cached chunks
+            step = max(1, settings.EMBEDDING_BATCH_SIZE * settings.EMBEDDING_MAX_CONCURRENCY)
+            start = 0
+            while start < num_chunks:
+                stop = min(start + (settings.EMBEDDING_BATCH_SIZE if start == 0 else step), num_chunks)
+                report("embedding", 0.2 + 0.8 * start / num_chunks)
+                
+                batch = chunks[start:stop]
+                texts = [chunk.page_content for chunk in batch]
+                embeddings = self.embedding_model.embed_documents(texts)
+                yield list(zip(texts, embeddings)), [chunk.metadata for chunk in batch], num_chunks
+                start = stop
+        
         except Exception as e:
             logger.error(f"Error processing PDF: {e}")
             raise
     
-    def validate_pdf_file(self, content: bytes, filename: str, file_size: int) -> Tuple[bool, str]:
+    def index_dimension(self, dimension: int) -> int:
+        """
+        Stored vector dimension for embeddings of the given size.
+        
+        text-embedding-3 vectors are Matryoshka-trained, so a prefix of
+        EMBEDDING_DIMENSIONS components (renormalised) is itself a usable
+        embedding.
+        """
+        if 0 < settings.EMBEDDING_DIMENSIONS < dimension:
+            return settings.EMBEDDING_DIMENSIONS
+        return dimension
+    
+    @staticmethod
+    def reduce_vectors(vectors: np.ndarray, dimension: int) -> np.ndarray:
+        """Truncate vectors to their first dimension components and L2-normalise them again."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] == dimension:
+            return vectors
+        reduced = np.ascontiguousarray(vectors[:, :dimension])
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return reduced / np.where(norms > 0, norms, 1.0)
+    
+    def choose_index_type(self, num_chunks: int, dimension: int) -> str:
         """
-        Validate PDF file.
+        Pick the FAISS index type for a document of num_chunks vectors.
+        
+        Small documents use an exact flat index. Larger ones use HNSW, which
+        keeps the stored vectors plus a neighbour graph, as long as that fits
+        the per-document memory budget; beyond it they use IVF-PQ, which
+        stores a few dozen bytes of compressed code per vector.
+        """
+        if settings.INDEX_TYPE in INDEX_TYPES:
+            return settings.INDEX_TYPE
+        if num_chunks <= settings.INDEX_FLAT_MAX_CHUNKS:
+            return "flat"
+        budget = settings.INDEX_MEMORY_BUDGET_MB * 1024 * 1024
+        if num_chunks * self.bytes_per_vector("hnsw", dimension) <= budget:
+            return "hnsw"
+        if num_chunks < self._ivf_min_training_points(num_chunks):
+            return "hnsw"
+        return "ivfpq"
+    
+    @staticmethod
+    def index_precision() -> str:
+        return settings.INDEX_PRECISION if settings.INDEX_PRECISION in INDEX_PRECISIONS else "float32"
+    
+    def is_compressed(self, index_type: str, dimension: int, full_dimension: int) -> bool:
+        """Whether stored vectors lose precision relative to the embeddings (so re-scoring helps)."""
+        return (
+            index_type == "ivfpq"
+            or dimension < full_dimension
+            or self.index_precision() != "float32"
+        )
+    
+    def bytes_per_vector(self, index_type: str, dimension: int) -> int:
+        """Approximate resident bytes per vector for an index type at the configured precision."""
+        if index_type == "ivfpq":
+            # PQ code plus the int64 id kept in the inverted list
+            return self._pq_subquantizers(dimension) + 8
+        code_size = dimension * PRECISION_BYTES[self.index_precision()]
+        if index_type == "hnsw":
+            # Stored vector plus the level-0 neighbour list (2 * M int32 ids)
+            return code_size + settings.INDEX_HNSW_M * 2 * 4
+        return code_size
+    
+    @staticmethod
+    def index_memory_bytes(index: faiss.Index) -> int:
+        """Approximate resident bytes of a built index."""
+        if isinstance(index, faiss.IndexHNSW):
+            storage = faiss.downcast_index(index.storage)
+            return index.ntotal * (storage.code_size + index.hnsw.nb_neighbors(0) * 4)
+        if isinstance(index, faiss.IndexIVFPQ):
+            return index.ntotal * (index.code_size + 8)
+        return index.ntotal * index.code_size
+    
+    @staticmethod
+    def index_type_of(index: faiss.Index) -> str:
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "ivfpq"
+        return "flat"
+    
+    @staticmethod
+    def index_precision_of(index: faiss.Index) -> str:
+        if isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            return "float16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "pq"
+        return "float32"
+    
+    @staticmethod
+    def _pq_subquantizers(dimension: int) -> int:
+        """Largest sub-quantizer count up to INDEX_PQ_M that divides the dimension."""
+        m = min(settings.INDEX_PQ_M, dimension)
+        while dimension % m:
+            m -= 1
+        return m
+    
+    @staticmethod
+    def _ivf_lists(num_chunks: int) -> int:
+        return max(1, int(4 * num_chunks ** 0.5))
+    
+    def _ivf_min_training_points(self, num_chunks: int) -> int:
+        # k-means wants ~39 points per centroid, and each PQ codebook 256
+        return max(39 * self._ivf_lists(num_chunks), 256)
+    
+    def new_index(
+        self,
+        index_type: str,
+        dimension: int,
+        precision: str = "float32",
+        training_vectors: Optional[np.ndarray] = None,
+        range_margin: float = 0.0
+    ) -> faiss.Index:
+        """
+        Create an empty FAISS index of the given type and vector precision.
+        
+        IVF-PQ and int8 indexes are trained on training_vectors, which must
+        be supplied for them. IVF-PQ ignores precision. For flat int8
+        indexes, range_margin widens the trained per-component range by that
+        fraction of it on each side, for indexes that will also hold vectors
+        they were not trained on.
+        """
+        needs_training = index_type == "ivfpq" or precision == "int8"
+        if needs_training and training_vectors is None:
+            raise ValueError(f"{index_type} {precision} indexes need training vectors")
+        
+        if index_type == "ivfpq":
+            nlist = min(self._ivf_lists(len(training_vectors)), len(training_vectors) // 39 or 1)
+            quantizer = faiss.IndexFlatL2(dimension)
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, self._pq_subquantizers(dimension), 8)
+            # Codebooks train fine on a few points per code; skip FAISS's under-sampling warning
+            index.pq.cp.min_points_per_centroid = 1
+        elif precision == "float32":
+            if index_type == "hnsw":
+                index = faiss.IndexHNSWFlat(dimension, settings.INDEX_HNSW_M)
+            else:
+                index = faiss.IndexFlatL2(dimension)
+        else:
+            qtype = faiss.ScalarQuantizer.QT_fp16 if precision == "float16" else faiss.ScalarQuantizer.QT_8bit
+            if index_type == "hnsw":
+                index = faiss.IndexHNSWSQ(dimension, qtype, settings.INDEX_HNSW_M)
+            else:
+                index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_L2)
+                index.sq.rangestat_arg = range_margin
+        
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efConstruction = settings.INDEX_HNSW_EF_CONSTRUCTION
+        if needs_training:
+            index.train(training_vectors)
+        self.configure_index(index)
+        return index
+    
+    @staticmethod
+    def configure_index(index: faiss.Index):
+        """Apply the configured search-time recall knobs to an index."""
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = settings.INDEX_HNSW_EF_SEARCH
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = settings.INDEX_IVF_NPROBE
+    
+    def search_index(
+        self,
+        index: faiss.Index,
+        query_embedding: List[float],
+        k: int,
+        full_vectors: Optional[np.ndarray] = None,
+        id_range: Optional[Tuple[int, int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Search an index with a full-size query embedding.
+        
+        Returns:
+            List of (vector id, L2 distance) pairs, closest first
+        """
+        return self.search_index_batch(index, [query_embedding], k, full_vectors, id_range)[0]
+    
+    def search_index_batch(
+        self,
+        index: faiss.Index,
+        query_embeddings: List[List[float]],
+        k: int,
+        full_vectors: Optional[np.ndarray] = None,
+        id_range: Optional[Tuple[int, int]] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Search an index with a matrix of full-size query embeddings in one call.
+        
+        The queries are reduced to the index's stored dimension. With
+        id_range (start, end), only those rows are searched and ids are
+        returned relative to start. When full-precision vectors are given
+        (indexed by those relative ids), each query's top
+        k * INDEX_RESCORE_FACTOR candidates are re-ranked by exact distance
+        to the full query.
         
         Returns:
-            Tuple of (is_valid, error_message)
+            Per query, a list of (vector id, L2 distance) pairs, closest first
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        rescore = full_vectors is not None and full_vectors.shape[1] == queries.shape[1]
+        fetch = k * max(1, settings.INDEX_RESCORE_FACTOR) if rescore else k
+        reduced = self.reduce_vectors(queries, index.d)
+        
+        if id_range is None:
+            distances, ids = index.search(reduced, fetch)
+        elif isinstance(index, faiss.IndexFlat):
+            # Flat search only visits the selected range
+            start, end = id_range
+            params = faiss.SearchParameters(sel=faiss.IDSelectorRange(start, end))
+            distances, ids = index.search(reduced, fetch, params=params)
+            ids = np.where(ids >= 0, ids - start, -1)
+        else:
+            # Quantized codes: decode just the range rather than scanning the whole index
+            start, end = id_range
+            distances, ids = faiss.knn(reduced, index.reconstruct_n(start, end - start), min(fetch, end - start))
+        
+        results = []
+        for query, row_ids, row_distances in zip(queries, ids, distances):
+            hits = [(int(i), float(d)) for i, d in zip(row_ids, row_distances) if i != -1]
+            if not rescore or not hits:
+                results.append(hits[:k])
+                continue
+            
+            candidates = np.array([vector_id for vector_id, _ in hits])
+            exact = ((full_vectors[candidates] - query) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            results.append([(int(candidates[i]), float(exact[i])) for i in order])
+        return results
+    
+    def create_index(self, num_chunks: int, dimension: int) -> faiss.Index:
+        """
+        Create the index a document's vectors are added to while it is embedded.
+        
+        The index type is chosen for the document's full chunk count. It is
+        always float32 so it can grow in place as later batches arrive;
+        documents that are stored quantized or as IVF-PQ are converted by
+        finalize_index once every chunk is embedded, since those encodings
+        are trained on the data.
         """
-        # Check file size
-        if file_size > settings.max_file_size_bytes:
-            return False, f"File size exceeds {settings.MAX_FILE_SIZE_MB}MB limit"
+        index_type = self.choose_index_type(num_chunks, dimension)
+        return self.new_index("flat" if index_type == "ivfpq" else index_type, dimension)
+    
+    def finalize_index(self, index: faiss.Index, num_chunks: int) -> Optional[faiss.Index]:
+        """
+        Build the compressed index for a fully embedded document, if it needs one.
         
-        # Check file extension
-        if not filename.lower().endswith('.pdf'):
-            return False, "Invalid file type. Only PDF files are allowed"
+        Documents are indexed in float32 while embedding runs, so the index
+        can grow in place; quantized and IVF-PQ encodings are trained on the
+        data and are built once every chunk is in.
         
-        # Check PDF magic bytes (PDF files start with %PDF)
-        if not content.startswith(b'%PDF'):
-            return False, "Invalid PDF file format"
+        Returns:
+            A replacement index holding the same vectors in the same order, or
+            None if the current index already has the chosen type and precision
+        """
+        index_type = self.choose_index_type(num_chunks, index.d)
+        precision = "pq" if index_type == "ivfpq" else self.index_precision()
+        if self.index_type_of(index) == index_type and self.index_precision_of(index) == precision:
+            return None
+        if index.ntotal < 256:
+            # Too few vectors to train codebooks; the float32 index is small anyway
+            return None
         
-        return True, ""
+        vectors = index.reconstruct_n(0, index.ntotal)
+        compressed = self.new_index(index_type, index.d, precision=precision, training_vectors=vectors)
+        compressed.add(vectors)
+        logger.info(
+            f"Compressed {index.ntotal} vectors to {index_type} ({precision}, "
+            f"{self.bytes_per_vector(index_type, index.d)} bytes per vector)"
+        )
+        return compressed
 
 
 # Global PDF service instance
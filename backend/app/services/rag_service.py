@@ -1,29 +1,69 @@
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
 import json
 
 from langchain_openai import ChatOpenAI
-from tavily import TavilyClient
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
 from app.core.config import settings
+from app.services.embedding_service import embedding_service
+from app.services.answer_cache import answer_cache
+from app.services.web_search_service import web_search_service
+from app.services.token_service import token_service, TokenUsage
+from app.services.lexical_index import identifier_ratio
 
 logger = logging.getLogger(__name__)
 
+NEED_WEB_SEARCH = "[NEED_WEB_SEARCH]"
+
+
+def _sentinel_prefix_length(text: str) -> int:
+    """Length of the longest tail of text that could be the start of the web search sentinel."""
+    for length in range(min(len(text), len(NEED_WEB_SEARCH) - 1), 0, -1):
+        if NEED_WEB_SEARCH.startswith(text[-length:]):
+            return length
+    return 0
+
+
+@dataclass
+class Retrieval:
+    """Chunks retrieved for a question and how they were found."""
+    chunks: List[Document]
+    indexed_fraction: float
+    mode: str
+    best_similarity: Optional[float] = None
+    query_embedding: Optional[List[float]] = None
+
 
 class RAGService:
-    """Service for RAG query processing."""
+    """
+    Service for RAG query processing.
+    
+    The query path is async end to end so a worker can serve many queries
+    at once: LLM and query-embedding calls are awaited, index searches run
+    in the default thread pool, and web searches go through the cached web
+    search service.
+    """
     
     def __init__(self):
         self.llm = ChatOpenAI(
             model="gpt-3.5-turbo",
             temperature=0,
-            openai_api_key=settings.OPENAI_API_KEY
+            openai_api_key=settings.OPENAI_API_KEY,
+            openai_api_base=settings.OPENAI_BASE_URL
         )
-        self.tavily_client = TavilyClient(api_key=settings.TAVILY_API_KEY)
         self._setup_prompts()
+        
+        self.speculative_searches = 0
+        self.speculative_useful = 0
+        self.speculative_wasted = 0
+        self.speculative_failed = 0
+        self.routed = {"pdf": 0, "web": 0, "check": 0}
         logger.info("RAGService initialized")
     
     def _setup_prompts(self):
@@ -41,6 +81,18 @@ If the context contains sufficient information to answer the question, respond w
 
 If the context does NOT contain sufficient information to fully answer the question, respond with exactly: "[NEED_WEB_SEARCH]"
 
+Your response:
+""")
+        
+        self.answer_prompt = ChatPromptTemplate.from_template("""
+You are an AI assistant answering a user's question from the content of a PDF.
+
+Context from PDF: {context}
+
+User Question: {question}
+
+Respond with a complete and accurate answer based ONLY on the provided context.
+
 Your response:
 """)
         
@@ -56,67 +108,529 @@ Make sure to cite sources from the search results where appropriate.
 """)
     
     def format_docs(self, docs) -> str:
-        """Format retrieved documents into a single string."""
-        return "\n\n".join(doc.page_content for doc in docs)
+        """Pack ranked documents into a single string within CONTEXT_TOKEN_BUDGET."""
+        texts, _ = token_service.pack_chunks(docs, settings.CONTEXT_TOKEN_BUDGET)
+        return "\n\n".join(texts)
+    
+    async def retrieve(self, documents: List, question: str) -> Retrieval:
+        """Retrieve the best chunks for one question (see retrieve_batch)."""
+        return (await self.retrieve_batch(documents, [question]))[0]
     
-    def query_pdf(self, vector_store, question: str) -> Dict[str, Any]:
+    async def retrieve_batch(self, documents: List, questions: List[str]) -> List[Retrieval]:
         """
-        Query the PDF using RAG with web search fallback.
+        Retrieve the best chunks across all of a session's documents, for each question.
+        
+        Questions that are mostly identifiers (part numbers, error codes) are
+        answered from the BM25 indexes alone, skipping the query embedding
+        call, as long as some chunk contains one of the terms. The others
+        are embedded in a single request and searched as one query matrix
+        per document, and their vector and BM25 rankings are merged with
+        reciprocal rank fusion. documents are the index snapshots pinned for
+        the query; a document still indexing is searched as far as its
+        snapshot goes.
         
         Returns:
-            Dict containing answer, source, and metadata
+            Per question, a Retrieval with the chunks, the fraction of the
+            documents' chunks indexed at retrieval time, the mode ("lexical"
+            or "hybrid") and, for hybrid retrieval, the best chunk's cosine
+            similarity
+        """
+        total_chunks = sum(document.num_chunks or 0 for document in documents)
+        indexed_chunks = sum(document.indexed_chunks for document in documents)
+        indexed_fraction = min(indexed_chunks / total_chunks, 1.0) if total_chunks else 0.0
+        
+        top_k = settings.TOP_K_CHUNKS
+        candidates = max(top_k, settings.HYBRID_CANDIDATES)
+        
+        lexical_hits = await asyncio.to_thread(
+            lambda: [self._lexical_hits(documents, question, candidates) for question in questions]
+        )
+        fast_path = [
+            bool(hits) and identifier_ratio(question) >= settings.LEXICAL_FAST_PATH_RATIO
+            for question, hits in zip(questions, lexical_hits)
+        ]
+        hybrid = [i for i, lexical in enumerate(fast_path) if not lexical]
+        if len(hybrid) < len(questions):
+            logger.info(f"{len(questions) - len(hybrid)} identifier queries, using lexical retrieval only")
+        
+        query_embeddings: Dict[int, List[float]] = {}
+        vector_hits: Dict[int, List[tuple]] = {}
+        if hybrid:
+            embeddings = await embedding_service.aembed_queries([questions[i] for i in hybrid])
+            query_embeddings = dict(zip(hybrid, embeddings))
+            vector_hits = dict(zip(hybrid, await asyncio.to_thread(self._vector_hits, documents, embeddings, candidates)))
+        
+        # Reciprocal rank fusion over both rankings
+        best_hits = []
+        for i in range(len(questions)):
+            if fast_path[i]:
+                best_hits.append(lexical_hits[i][:top_k])
+                continue
+            fused: Dict[Tuple[str, int], list] = {}
+            for ranking in (vector_hits[i][:candidates], lexical_hits[i][:candidates]):
+                for rank, (document, chunk_id, _) in enumerate(ranking):
+                    entry = fused.setdefault((document.content_hash, chunk_id), [document, chunk_id, 0.0])
+                    entry[2] += 1.0 / (settings.RRF_K + rank + 1)
+            best_hits.append(sorted(fused.values(), key=lambda entry: -entry[2])[:top_k])
+        
+        chunks = await asyncio.to_thread(lambda: [self._load_chunks(hits) for hits in best_hits])
+        retrievals = []
+        for i in range(len(questions)):
+            if fast_path[i]:
+                retrievals.append(Retrieval(chunks[i], indexed_fraction, "lexical"))
+                continue
+            # Squared L2 between unit vectors is 2 - 2 * cosine
+            best_similarity = 1.0 - vector_hits[i][0][2] / 2.0 if vector_hits[i] else None
+            retrievals.append(Retrieval(chunks[i], indexed_fraction, "hybrid", best_similarity, query_embeddings[i]))
+        return retrievals
+    
+    @staticmethod
+    def _lexical_hits(documents: List, question: str, k: int) -> List[tuple]:
+        """BM25 (document, chunk id, score) hits across documents, best first."""
+        hits = []
+        for document in documents:
+            hits.extend((document, chunk_id, score) for chunk_id, score in document.lexical_search(question, k=k))
+        hits.sort(key=lambda hit: -hit[2])
+        return hits
+    
+    @staticmethod
+    def _vector_hits(documents: List, query_embeddings: List[List[float]], k: int) -> List[List[tuple]]:
+        """Per query, vector (document, chunk id, distance) hits across documents, closest first."""
+        hits = [[] for _ in query_embeddings]
+        for document in documents:
+            for query_hits, document_hits in zip(hits, document.search_batch(query_embeddings, k=k)):
+                query_hits.extend((document, chunk_id, distance) for chunk_id, distance in document_hits)
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[2])
+        return hits
+    
+    @staticmethod
+    def _load_chunks(hits: List[tuple]) -> List:
+        """Fetch the chunk documents for ranked (document, chunk id, score) hits, keeping their order."""
+        by_document: Dict[str, List[int]] = {}
+        records = {}
+        for document, chunk_id, _ in hits:
+            by_document.setdefault(document.content_hash, []).append(chunk_id)
+            records[document.content_hash] = document
+        
+        chunks = {}
+        for content_hash, chunk_ids in by_document.items():
+            for chunk_id, chunk in zip(chunk_ids, records[content_hash].get_chunks(chunk_ids)):
+                chunks[(content_hash, chunk_id)] = chunk
+        return [chunks[(document.content_hash, chunk_id)] for document, chunk_id, _ in hits]
+    
+    def route(self, retrieval: Retrieval) -> str:
+        """
+        Decide from the retrieval scores how a question is answered.
+        
+        Returns "pdf" when the best vector match reaches
+        ROUTER_PDF_MIN_SIMILARITY (answer from the context, no sufficiency
+        check), "web" when it is below ROUTER_WEB_MAX_SIMILARITY and the
+        documents are fully indexed (skip the PDF), and otherwise "check",
+        where the LLM decides between answering and the web search sentinel.
+        Lexical fast-path retrievals have no similarity and are always checked.
+        """
+        similarity = retrieval.best_similarity
+        if not settings.ROUTER_ENABLED or similarity is None:
+            route = "check"
+        elif similarity >= settings.ROUTER_PDF_MIN_SIMILARITY:
+            route = "pdf"
+        elif similarity < settings.ROUTER_WEB_MAX_SIMILARITY and retrieval.indexed_fraction >= 1.0:
+            # A partial index may not have reached the relevant pages yet
+            route = "web"
+        else:
+            route = "check"
+        self.routed[route] += 1
+        return route
+    
+    @staticmethod
+    def _cache_scope(documents: List, session_id: Optional[str]) -> Optional[str]:
+        """
+        Answer cache scope for the documents, or None if answers for them aren't cached.
+        
+        A session without documents gets a scope of its own.
+        """
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        # Answers over partially indexed documents would go stale as indexing finishes
+        if not all(document.is_indexed for document in documents):
+            return None
+        if not documents and session_id is None:
+            return None
+        return answer_cache.scope((document.content_hash for document in documents), session_id)
+    
+    async def query_pdf(self, documents: List, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Query the session's PDFs using RAG with web search fallback.
+        
+        Fully indexed documents consult the answer cache first, by exact
+        question and then, once the question is embedded for retrieval, by
+        similar question. Otherwise the retrieval scores pick the route (see
+        route), so clear-cut questions skip the LLM sufficiency check.
+        
+        Returns:
+            Dict containing answer, source, and metadata, including the
+            prompt and completion tokens of all LLM calls made
         """
         try:
-            # Create retriever
-            retriever = vector_store.as_retriever(
-                search_kwargs={"k": settings.TOP_K_CHUNKS}
-            )
+            logger.info(f"Processing query: {question[:100]}...")
+            scope = self._cache_scope(documents, session_id)
+            if scope is not None:
+                cached = answer_cache.get_exact(scope, question)
+                if cached is not None:
+                    logger.info("Answered from cache (same question)")
+                    return dict(cached, cache="exact", prompt_tokens=0, completion_tokens=0)
             
-            # Build determination chain
-            determination_chain = (
-                {
-                    "context": retriever | self.format_docs,
-                    "question": RunnablePassthrough(),
-                }
-                | self.answer_determination_prompt
+            # Retrieve relevant chunks from the (possibly partial) indexes
+            retrieval = await self.retrieve(documents, question)
+            return await self._answer_retrieved(scope, question, retrieval)
+        
+        except Exception as e:
+            logger.error(f"Error querying PDF: {e}")
+            raise
+    
+    async def _answer_retrieved(self, scope: Optional[str], question: str, retrieval: Retrieval) -> Dict[str, Any]:
+        """Answer a question whose chunks are retrieved, from the answer cache or the LLM."""
+        if scope is not None:
+            cached = answer_cache.get_similar(scope, retrieval.query_embedding)
+            if cached is not None:
+                logger.info("Answered from cache (similar question)")
+                return dict(cached, cache="semantic", prompt_tokens=0, completion_tokens=0)
+        
+        usage = TokenUsage()
+        route = self.route(retrieval)
+        if route == "web":
+            logger.info("Retrieval is a clear miss, answering from web search")
+            result = await self._web_search_fallback(question, usage=usage)
+        else:
+            result = await self._answer_from_pdf(question, retrieval, route, usage)
+        
+        result["indexed_fraction"] = retrieval.indexed_fraction
+        result["retrieval"] = retrieval.mode
+        result["route"] = route
+        if scope is not None:
+            answer_cache.put(scope, question, retrieval.query_embedding, result)
+        result["cache"] = None
+        result["prompt_tokens"] = usage.prompt_tokens
+        result["completion_tokens"] = usage.completion_tokens
+        return result
+    
+    async def query_batch(
+        self,
+        documents: List,
+        questions: List[str],
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Answer several questions about the session's PDFs, yielding (index, result) as each finishes.
+        
+        Exact answer cache hits come first. The remaining questions are
+        retrieved together (one embeddings request, one batched search per
+        document), then answered with at most BATCH_LLM_CONCURRENCY
+        questions in LLM calls at once. A question that fails yields
+        {"error": ...} instead of failing the batch.
+        """
+        logger.info(f"Processing batch of {len(questions)} queries")
+        scope = self._cache_scope(documents, session_id)
+        pending = []
+        for i, question in enumerate(questions):
+            cached = answer_cache.get_exact(scope, question) if scope is not None else None
+            if cached is not None:
+                yield i, dict(cached, cache="exact", prompt_tokens=0, completion_tokens=0)
+            else:
+                pending.append(i)
+        if not pending:
+            return
+        
+        retrievals = await self.retrieve_batch(documents, [questions[i] for i in pending])
+        semaphore = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+        
+        async def answer(i: int, retrieval: Retrieval) -> Tuple[int, Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return i, await self._answer_retrieved(scope, questions[i], retrieval)
+                except Exception as e:
+                    logger.error(f"Error answering batch question {i}: {e}")
+                    return i, {"error": "Failed to process question."}
+        
+        tasks = [asyncio.create_task(answer(i, retrieval)) for i, retrieval in zip(pending, retrievals)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # The client went away or the caller stopped early
+            for task in tasks:
+                task.cancel()
+    
+    async def _answer_from_pdf(
+        self,
+        question: str,
+        retrieval: Retrieval,
+        route: str,
+        usage: TokenUsage
+    ) -> Dict[str, Any]:
+        """Answer from the retrieved chunks; the "check" route falls back to web search when they don't suffice."""
+        # Build answer chain; the determination prompt may ask for a web search
+        answer_chain = (
+            (self.answer_prompt if route == "pdf" else self.answer_determination_prompt)
+            | self.llm
+            | StrOutputParser()
+        )
+        
+        # Try to answer from PDF, searching the web alongside when coverage looks weak
+        speculative = self._start_speculative_search(question, retrieval) if route == "check" else None
+        try:
+            pdf_response = await answer_chain.ainvoke({
+                "context": self.format_docs(retrieval.chunks),
+                "question": question
+            }, config={"callbacks": [usage]})
+        except BaseException:
+            self._discard_speculative_search(speculative)
+            raise
+        
+        # Check if web search is needed
+        if route == "check" and NEED_WEB_SEARCH in pdf_response:
+            logger.info("PDF context insufficient, falling back to web search")
+            return await self._web_search_fallback(question, speculative, usage)
+        
+        self._discard_speculative_search(speculative)
+        logger.info("Answer generated from PDF successfully")
+        return {
+            "answer": pdf_response,
+            "source": "pdf",
+            "chunks_used": len(retrieval.chunks),
+            "web_sources": None
+        }
+    
+    async def stream_query(
+        self,
+        documents: List,
+        question: str,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Query the session's PDFs, yielding (event, data) pairs as the answer is generated.
+        
+        Events arrive in order: "retrieval" (retrieval mode, indexed
+        fraction, route and whether the answer comes from the answer cache),
+        "token" (answer text as the LLM produces it), then "done" (source,
+        chunks used, web sources and prompt and completion tokens). A cached
+        answer arrives as a single token. If the model answers with the web search sentinel, a
+        "fallback" event tells the client to discard any answer text received
+        so far and the web answer is streamed in its place. Text that could
+        be the start of the sentinel is held back until it is clearly not, so
+        the sentinel itself never reaches the client.
+        """
+        logger.info(f"Streaming query: {question[:100]}...")
+        scope = self._cache_scope(documents, session_id)
+        cached, cache = None, None
+        if scope is not None:
+            cached, cache = answer_cache.get_exact(scope, question), "exact"
+        if cached is None:
+            retrieval = await self.retrieve(documents, question)
+            if scope is not None:
+                cached, cache = answer_cache.get_similar(scope, retrieval.query_embedding), "semantic"
+        if cached is not None:
+            logger.info(f"Streaming answer from cache ({cache} match)")
+            yield "retrieval", {
+                "retrieval": cached["retrieval"],
+                "indexed_fraction": round(cached["indexed_fraction"], 4),
+                "chunks_retrieved": cached["chunks_used"] or 0,
+                "route": cached["route"],
+                "cache": cache
+            }
+            yield "token", {"text": cached["answer"]}
+            yield "done", {
+                "source": cached["source"],
+                "chunks_used": cached["chunks_used"],
+                "web_sources": cached["web_sources"],
+                "prompt_tokens": 0,
+                "completion_tokens": 0
+            }
+            return
+        
+        route = self.route(retrieval)
+        yield "retrieval", {
+            "retrieval": retrieval.mode,
+            "indexed_fraction": round(retrieval.indexed_fraction, 4),
+            "chunks_retrieved": len(retrieval.chunks),
+            "route": route,
+            "cache": None
+        }
+        
+        usage = TokenUsage()
+        speculative = None
+        if route != "web":
+            answer_chain = (
+                (self.answer_prompt if route == "pdf" else self.answer_determination_prompt)
                 | self.llm
                 | StrOutputParser()
             )
+            if route == "check":
+                speculative = self._start_speculative_search(question, retrieval)
+            tokens = answer_chain.astream({
+                "context": self.format_docs(retrieval.chunks),
+                "question": question
+            }, config={"callbacks": [usage]})
+            pending = ""
+            answer = []
+            need_web_search = False
+            streamed = False
+            try:
+                async for token in tokens:
+                    pending += token
+                    if route == "check" and NEED_WEB_SEARCH in pending:
+                        need_web_search = True
+                        break
+                    if route == "check" and not streamed and NEED_WEB_SEARCH.startswith(pending.lstrip(" \t\n\"'`")):
+                        # The model may quote or indent the sentinel; wait until the opening is unambiguous
+                        continue
+                    ready = len(pending) - (_sentinel_prefix_length(pending) if route == "check" else 0)
+                    if ready > 0:
+                        answer.append(pending[:ready])
+                        yield "token", {"text": pending[:ready]}
+                        pending = pending[ready:]
+                        streamed = True
+            except BaseException:
+                # Includes the client disconnecting mid-answer
+                self._discard_speculative_search(speculative)
+                raise
+            finally:
+                # Stops the LLM request when the sentinel cut the stream short
+                await tokens.aclose()
             
-            # Try to answer from PDF
-            logger.info(f"Processing query: {question[:100]}...")
-            pdf_response = determination_chain.invoke(question)
+            if not need_web_search:
+                self._discard_speculative_search(speculative)
+                if pending:
+                    answer.append(pending)
+                    yield "token", {"text": pending}
+                logger.info("Answer streamed from PDF successfully")
+                result = {"source": "pdf", "chunks_used": len(retrieval.chunks), "web_sources": None}
+                self._cache_streamed_answer(scope, question, retrieval, route, "".join(answer), result)
+                yield "done", dict(
+                    result,
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens
+                )
+                return
             
-            # Check if web search is needed
-            if "[NEED_WEB_SEARCH]" in pdf_response:
-                logger.info("PDF context insufficient, falling back to web search")
-                return self._web_search_fallback(question)
-            else:
-                logger.info("Answer generated from PDF successfully")
-                return {
-                    "answer": pdf_response,
-                    "source": "pdf",
-                    "chunks_used": settings.TOP_K_CHUNKS,
-                    "web_sources": None
-                }
+            logger.info("PDF context insufficient, falling back to web search")
+            yield "fallback", {}
+        else:
+            logger.info("Retrieval is a clear miss, answering from web search")
+        search_text, search_results = await self._web_results(question, speculative)
+        web_search_chain = self.web_search_prompt | self.llm | StrOutputParser()
+        answer = []
+        async for token in web_search_chain.astream(
+            {"question": question, "web_results": search_text},
+            config={"callbacks": [usage]}
+        ):
+            if token:
+                answer.append(token)
+                yield "token", {"text": token}
         
-        except Exception as e:
-            logger.error(f"Error querying PDF: {e}")
-            raise
+        logger.info("Answer streamed from web search successfully")
+        result = {
+            "source": "web",
+            "chunks_used": None,
+            "web_sources": self._parse_web_sources(search_results)
+        }
+        self._cache_streamed_answer(scope, question, retrieval, route, "".join(answer), result)
+        yield "done", dict(result, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
     
-    def _web_search_fallback(self, question: str) -> Dict[str, Any]:
+    @staticmethod
+    def _cache_streamed_answer(
+        scope: Optional[str],
+        question: str,
+        retrieval: Retrieval,
+        route: str,
+        answer: str,
+        result: Dict[str, Any]
+    ):
+        """Store a completed streamed answer in the answer cache."""
+        if scope is None:
+            return
+        answer_cache.put(scope, question, retrieval.query_embedding, dict(
+            result,
+            answer=answer,
+            indexed_fraction=retrieval.indexed_fraction,
+            retrieval=retrieval.mode,
+            route=route
+        ))
+    
+    async def _search_web(self, question: str) -> Tuple[str, list]:
+        """
+        Run the web search for a question.
+        
+        Returns:
+            Tuple of (results packed into WEB_CONTEXT_TOKEN_BUDGET for the
+            prompt, raw search results)
+        """
+        logger.info("Performing web search...")
+        search_results = await web_search_service.search(question, max_results=3)
+        
+        # Format search results as text, trimming lower-ranked content first
+        blocks, _ = token_service.pack_web_results(search_results, settings.WEB_CONTEXT_TOKEN_BUDGET)
+        return "\n\n".join(blocks), search_results
+    
+    def _start_speculative_search(self, question: str, retrieval: Retrieval) -> Optional[asyncio.Task]:
+        """
+        Start the web search before the PDF answer is known, if the mode and retrieval call for it.
+        
+        With SPECULATIVE_WEB_SEARCH "auto", the search starts when the best
+        vector match is below SPECULATIVE_MIN_SIMILARITY (or nothing was
+        retrieved), so a fallback costs one LLM round trip less; "always"
+        speculates on every hybrid query and "off" never does. Lexical
+        fast-path answers matched the question's identifiers and are not
+        speculated on.
+        """
+        mode = settings.SPECULATIVE_WEB_SEARCH
+        if mode not in ("auto", "always") or retrieval.mode == "lexical":
+            return None
+        weak = not retrieval.chunks or (
+            retrieval.best_similarity is not None
+            and retrieval.best_similarity < settings.SPECULATIVE_MIN_SIMILARITY
+        )
+        if mode == "auto" and not weak:
+            return None
+        
+        logger.info(f"Starting speculative web search (best similarity {retrieval.best_similarity})")
+        self.speculative_searches += 1
+        task = asyncio.create_task(self._search_web(question))
+        # Retrieve the outcome of searches that end up discarded, so failures aren't reported as unhandled
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+    
+    def _discard_speculative_search(self, task: Optional[asyncio.Task]):
+        """Drop a speculative search whose results are not needed."""
+        if task is None:
+            return
+        # A search already sent still completes and its results are cached
+        task.cancel()
+        self.speculative_wasted += 1
+    
+    async def _web_results(self, question: str, speculative: Optional[asyncio.Task] = None) -> Tuple[str, list]:
+        """Web search results for a fallback, from the speculative search if one was started."""
+        if speculative is not None:
+            try:
+                results = await speculative
+                self.speculative_useful += 1
+                return results
+            except Exception as e:
+                self.speculative_failed += 1
+                logger.warning(f"Speculative web search failed, searching again: {e}")
+        return await self._search_web(question)
+    
+    async def _web_search_fallback(
+        self,
+        question: str,
+        speculative: Optional[asyncio.Task] = None,
+        usage: Optional[TokenUsage] = None
+    ) -> Dict[str, Any]:
         """Perform web search and generate answer."""
         try:
-            # Perform web search
-            logger.info("Performing web search...")
-            response = self.tavily_client.search(query=question, max_results=3)
-            search_results = response.get('results', [])
-            
-            # Format search results as text
-            search_text = "\n\n".join([
-                f"Title: {r.get('title', '')}\nContent: {r.get('content', '')}\nURL: {r.get('url', '')}"
-                for r in search_results
-            ])
+            # Perform web search, or collect the speculative one
+            search_text, search_results = await self._web_results(question, speculative)
             
             # Build web search chain
             web_search_chain = (
@@ -130,7 +644,7 @@ Make sure to cite sources from the search results where appropriate.
             )
             
             # Generate answer from web results
-            answer = web_search_chain.invoke(question)
+            answer = await web_search_chain.ainvoke(question, config={"callbacks": [usage] if usage else []})
             
             # Parse web sources
             web_sources = self._parse_web_sources(search_results)
@@ -151,7 +665,7 @@ Make sure to cite sources from the search results where appropriate.
         """Parse web search results into structured format."""
         sources = []
         
-        # Extract source information from Tavily results
+        # Extract source information from search results
         if isinstance(search_results, list):
             for result in search_results:
                 if isinstance(result, dict):
@@ -162,8 +676,23 @@ Make sure to cite sources from the search results where appropriate.
                     })
         
         return sources
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Routing and speculative web search counters."""
+        resolved = self.speculative_useful + self.speculative_wasted
+        return {
+            "routed_pdf": self.routed["pdf"],
+            "routed_web": self.routed["web"],
+            "routed_check": self.routed["check"],
+            # Each web route saves the sufficiency check's LLM call
+            "llm_calls_saved": self.routed["web"],
+            "speculative_searches": self.speculative_searches,
+            "speculative_useful": self.speculative_useful,
+            "speculative_wasted": self.speculative_wasted,
+            "speculative_failed": self.speculative_failed,
+            "speculative_useful_rate": round(self.speculative_useful / resolved, 4) if resolved else None,
+        }
 
 
 # Global RAG service instance
 rag_service = RAGService()
-
@@ -1,109 +1,396 @@
+import time
 import uuid
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+import threading
+from datetime import datetime
+from typing import Dict, Optional, List, Set, Any
 from dataclasses import dataclass, field
 import logging
 
+from app.core.config import settings
+from app.services.document_service import document_service
+from app.services.expiry_scheduler import ExpiryScheduler
+from app.services.session_store import SessionStore, session_store
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class SessionDocument:
+    """A document added to a session, identified by its content hash."""
+    document_id: str
+    filename: str
+    file_path: str
+    added_at: datetime = field(default_factory=datetime.now)
+    
+    def to_dict(self) -> dict:
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "file_path": self.file_path,
+            "added_at": self.added_at.isoformat()
+        }
+
+
 @dataclass
 class SessionData:
     """Data stored for each session."""
     session_id: str
-    vector_store: Optional[any] = None
-    pdf_filename: Optional[str] = None
-    num_chunks: Optional[int] = None
-    pdf_path: Optional[str] = None
+    documents: Dict[str, SessionDocument] = field(default_factory=dict)
     created_at: datetime = field(default_factory=datetime.now)
     last_activity: datetime = field(default_factory=datetime.now)
+    loaded_at: float = field(default_factory=time.monotonic, repr=False)
+    queries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    
+    @property
+    def document_ids(self) -> List[str]:
+        return list(self.documents.keys())
+    
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at.isoformat(),
+            "last_activity": self.last_activity.timestamp(),
+            "queries": self.queries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "documents": [document.to_dict() for document in self.documents.values()]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SessionData":
+        return cls(
+            session_id=data["session_id"],
+            documents={
+                document["document_id"]: SessionDocument(
+                    document_id=document["document_id"],
+                    filename=document["filename"],
+                    file_path=document["file_path"],
+                    added_at=datetime.fromisoformat(document["added_at"])
+                )
+                for document in data["documents"]
+            },
+            created_at=datetime.fromisoformat(data["created_at"]),
+            last_activity=datetime.fromtimestamp(data["last_activity"]),
+            queries=data["queries"],
+            prompt_tokens=data["prompt_tokens"],
+            completion_tokens=data["completion_tokens"]
+        )
 
 
 class SessionService:
-    """Service for managing user sessions."""
+    """
+    Service for managing user sessions.
+    
+    Session metadata lives in a SessionStore shared by every worker process,
+    so a session created by an upload on one worker can be queried on any
+    other. Each worker keeps the sessions it serves in a hot cache and
+    re-reads one from the store at most every cache_ttl_seconds, and holds a
+    reference to the cached sessions' documents, whose indexes it loads from
+    the shared index store on first search.
+    
+    Document changes and token usage are written to the store immediately;
+    activity times are written in batches by flush.
+    
+    Sessions expire timeout_minutes after their last activity. Cached
+    sessions sit in a deadline heap, and expire_due, run by a scheduler
+    task at the next deadline, clears the sessions that are due without
+    scanning the others.
+    """
     
-    def __init__(self, timeout_minutes: int = 30):
+    def __init__(
+        self,
+        store: SessionStore,
+        timeout_minutes: int = 30,
+        cache_ttl_seconds: float = 2.0,
+        activity_flush_seconds: float = 30.0,
+        expiry_batch: int = 500
+    ):
+        self.store = store
         self.sessions: Dict[str, SessionData] = {}
         self.timeout_minutes = timeout_minutes
-        logger.info(f"SessionService initialized with timeout: {timeout_minutes} minutes")
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.activity_flush_seconds = activity_flush_seconds
+        self.expiry_batch = expiry_batch
+        self._lock = threading.RLock()
+        self._expiry = ExpiryScheduler()
+        self._active: Set[str] = set()
+        
+        self.cache_hits = 0
+        self.store_reads = 0
+        self.sweeps = 0
+        self.expired = 0
+        self.last_sweep_seconds = 0.0
+        self.max_sweep_seconds = 0.0
+        self.expiry_backlog = 0
+        self.max_expiry_lag_seconds = 0.0
+        logger.info(f"SessionService initialized with {store.name} store, timeout: {timeout_minutes} minutes")
+    
+    def _deadline(self, session: SessionData) -> float:
+        return session.last_activity.timestamp() + self.timeout_minutes * 60
+    
+    def _touch(self, session: SessionData):
+        """Record activity on a session (lock held)."""
+        session.last_activity = datetime.now()
+        self._active.add(session.session_id)
+    
+    def _load(self, session_id: str) -> Optional[SessionData]:
+        """
+        Re-read a session from the store into the hot cache (lock held).
+        
+        The worker takes document references for documents added elsewhere
+        and releases those removed; a session gone from the store is dropped.
+        """
+        self.store_reads += 1
+        data = self.store.get_session(session_id)
+        cached = self.sessions.pop(session_id, None)
+        previous = cached.documents if cached else {}
+        if data is None:
+            self._expiry.cancel(session_id)
+            for document_id in previous:
+                document_service.release(document_id)
+            return None
+        
+        session = SessionData.from_dict(data)
+        if cached is not None and cached.last_activity > session.last_activity:
+            # Activity not flushed yet
+            session.last_activity = cached.last_activity
+        for document_id, document in session.documents.items():
+            if document_id not in previous:
+                document_service.acquire(document_id, document.file_path)
+            # Pick up indexes another worker has finished since
+            document_service.refresh(document_id)
+        for document_id in previous:
+            if document_id not in session.documents:
+                document_service.release(document_id)
+        
+        self.sessions[session_id] = session
+        if cached is None:
+            self._expiry.schedule(session_id, self._deadline(session))
+        return session
+    
+    def flush(self) -> int:
+        """Write the activity times of sessions used since the last flush to the store."""
+        with self._lock:
+            active, self._active = self._active, set()
+            changed = [self.sessions[session_id] for session_id in active if session_id in self.sessions]
+        for session in changed:
+            try:
+                self.store.touch(session.session_id, session.last_activity.timestamp())
+            except Exception as e:
+                logger.error(f"Error saving activity for session {session.session_id}: {e}")
+        return len(changed)
     
     def create_session(self) -> str:
         """Create a new session and return its ID."""
         session_id = str(uuid.uuid4())
-        self.sessions[session_id] = SessionData(session_id=session_id)
+        session = SessionData(session_id=session_id)
+        self.store.create_session(session.to_dict())
+        with self._lock:
+            self.sessions[session_id] = session
+            self._expiry.schedule(session_id, self._deadline(session))
         logger.info(f"Created new session: {session_id}")
         return session_id
     
     def get_session(self, session_id: str) -> Optional[SessionData]:
-        """Get session data by ID."""
-        session = self.sessions.get(session_id)
-        if session:
-            session.last_activity = datetime.now()
-        return session
+        """Get session data by ID, from the hot cache while it is fresh."""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None and time.monotonic() - session.loaded_at < self.cache_ttl_seconds:
+                self.cache_hits += 1
+            else:
+                session = self._load(session_id)
+            if session:
+                self._touch(session)
+            return session
     
-    def update_session(
+    def add_document(
         self,
         session_id: str,
-        vector_store=None,
-        pdf_filename: Optional[str] = None,
-        num_chunks: Optional[int] = None,
-        pdf_path: Optional[str] = None
+        document_id: str,
+        filename: str,
+        file_path: str,
+        replace_document_id: Optional[str] = None
     ):
-        """Update session data."""
-        session = self.get_session(session_id)
-        if not session:
-            raise ValueError(f"Session {session_id} not found")
-        
-        if vector_store is not None:
-            session.vector_store = vector_store
-        if pdf_filename is not None:
-            session.pdf_filename = pdf_filename
-        if num_chunks is not None:
-            session.num_chunks = num_chunks
-        if pdf_path is not None:
-            session.pdf_path = pdf_path
+        """
+        Add a document to a session.
         
-        session.last_activity = datetime.now()
-        logger.info(f"Updated session: {session_id}")
+        Hands the caller's document reference over to the session. Adding a
+        document the session already holds just refreshes its filename and
+        releases the duplicate reference. Documents with the same filename
+        are kept side by side; only replace_document_id, if given, is removed
+        from the session, and its index and file are deleted straight away
+        unless another session holds them.
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
+            
+            document = SessionDocument(document_id=document_id, filename=filename, file_path=file_path)
+            if not self.store.add_document(session_id, document.to_dict()):
+                raise ValueError(f"Session {session_id} not found")
+            
+            existing = session.documents.get(document_id)
+            if existing is not None:
+                existing.filename = filename
+                document_service.release(document_id)
+            else:
+                session.documents[document_id] = document
+            
+            replaced = replace_document_id not in (None, document_id) and replace_document_id in session.documents
+            if replaced:
+                self.store.remove_document(session_id, replace_document_id)
+                del session.documents[replace_document_id]
+            
+            self._touch(session)
+            logger.info(f"Added document {document_id[:12]} to session: {session_id}")
+            
+            if replaced:
+                document_service.release(replace_document_id)
+                logger.info(f"Replaced document {replace_document_id[:12]} in session {session_id} with {document_id[:12]}")
+    
+    def record_usage(self, session_id: str, prompt_tokens: int, completion_tokens: int):
+        """Add a query's LLM token usage to its session's totals."""
+        try:
+            self.store.add_usage(session_id, 1, prompt_tokens, completion_tokens)
+        except Exception as e:
+            logger.error(f"Error recording usage for session {session_id}: {e}")
+            return
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return
+            session.queries += 1
+            session.prompt_tokens += prompt_tokens
+            session.completion_tokens += completion_tokens
+            self._touch(session)
+    
+    def remove_document(self, session_id: str, document_id: str) -> bool:
+        """Remove a document from a session and release the session's reference to it."""
+        with self._lock:
+            session = self._load(session_id)
+            if not session or document_id not in session.documents:
+                return False
+            
+            self.store.remove_document(session_id, document_id)
+            del session.documents[document_id]
+            document_service.release(document_id)
+        logger.info(f"Removed document {document_id[:12]} from session: {session_id}")
+        return True
     
     def clear_session(self, session_id: str) -> bool:
         """Clear a session and its data."""
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
-            
-            # Clean up PDF file if exists
-            if session.pdf_path:
-                try:
-                    import os
-                    if os.path.exists(session.pdf_path):
-                        os.remove(session.pdf_path)
-                        logger.info(f"Deleted PDF file: {session.pdf_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting PDF file: {e}")
-            
-            # Remove session
-            del self.sessions[session_id]
-            logger.info(f"Cleared session: {session_id}")
-            return True
-        return False
-    
-    def cleanup_expired_sessions(self):
-        """Remove expired sessions."""
-        now = datetime.now()
-        timeout_delta = timedelta(minutes=self.timeout_minutes)
-        expired_sessions = []
+        documents = self.store.delete_session(session_id)
+        with self._lock:
+            self._expiry.cancel(session_id)
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                # Release the shared documents; each file is deleted with its last reference
+                for document_id in session.document_ids:
+                    document_service.release(document_id)
+        if documents is None:
+            return False
+        
+        # Documents this worker never loaded are deleted here if nothing else holds them
+        for document in documents:
+            if session is None or document["document_id"] not in session.documents:
+                document_service.delete_unused(document["document_id"], document["file_path"])
+        logger.info(f"Cleared session: {session_id}")
+        return True
+    
+    def expire_due(self) -> float:
+        """
+        Expire the sessions whose deadline has passed.
+        
+        Every worker runs this; a session is cleared by whichever gets to it
+        first. Cached sessions this worker hasn't served for the timeout are
+        dropped from its cache too, even if another worker keeps them alive.
+        At most expiry_batch sessions are cleared per call. Blocking (store
+        calls and file deletion), so run it off the event loop.
         
-        for session_id, session in self.sessions.items():
-            if now - session.last_activity > timeout_delta:
-                expired_sessions.append(session_id)
+        Returns:
+            Seconds until the next call is due: 0 while a backlog remains,
+            and never more than activity_flush_seconds
+        """
+        start = time.perf_counter()
+        now = time.time()
+        timeout = self.timeout_minutes * 60
         
-        for session_id in expired_sessions:
-            self.clear_session(session_id)
-            logger.info(f"Cleaned up expired session: {session_id}")
+        # Write this worker's activity first, so live sessions aren't expired
+        self.flush()
         
-        return len(expired_sessions)
+        for session_id in self._expiry.pop_due(now, self.expiry_batch):
+            with self._lock:
+                session = self.sessions.get(session_id)
+                if session is None:
+                    continue
+                if self._deadline(session) > now:
+                    # Used since it was scheduled
+                    self._expiry.schedule(session_id, self._deadline(session))
+                    continue
+                del self.sessions[session_id]
+                for document_id in session.document_ids:
+                    document_service.release(document_id)
+        
+        expired, lag = 0, 0.0
+        for session_id, last_activity in self.store.expired_sessions(now - timeout, self.expiry_batch):
+            if self.clear_session(session_id):
+                expired += 1
+                lag = max(lag, now - (last_activity + timeout))
+        backlog = self.store.count_expired(now - timeout)
+        
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.sweeps += 1
+            self.expired += expired
+            self.last_sweep_seconds = elapsed
+            self.max_sweep_seconds = max(self.max_sweep_seconds, elapsed)
+            self.expiry_backlog = backlog
+            self.max_expiry_lag_seconds = max(self.max_expiry_lag_seconds, lag)
+        if expired:
+            logger.info(f"Expired {expired} sessions in {elapsed * 1000:.1f} ms ({backlog} still due)")
+        if backlog:
+            return 0.0
+        
+        deadlines = [now + self.activity_flush_seconds]
+        next_cached = self._expiry.next_deadline()
+        if next_cached is not None:
+            deadlines.append(next_cached)
+        earliest = self.store.earliest_activity()
+        if earliest is not None:
+            deadlines.append(earliest + timeout)
+        return max(0.0, min(deadlines) - time.time())
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Store backend, session count, hot cache and expiry counters."""
+        next_deadline = self._expiry.next_deadline()
+        with self._lock:
+            cached = len(self.sessions)
+            lookups = self.cache_hits + self.store_reads
+            return {
+                "store": self.store.name,
+                "sessions": self.store.count_sessions(),
+                "cached_sessions": cached,
+                "cache_hits": self.cache_hits,
+                "store_reads": self.store_reads,
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else None,
+                "expiry_sweeps": self.sweeps,
+                "expired_sessions": self.expired,
+                "last_sweep_ms": round(self.last_sweep_seconds * 1000, 2),
+                "max_sweep_ms": round(self.max_sweep_seconds * 1000, 2),
+                "expiry_backlog": self.expiry_backlog,
+                "max_expiry_lag_seconds": round(self.max_expiry_lag_seconds, 2),
+                "next_cached_expiry_in_seconds": round(max(next_deadline - time.time(), 0.0), 1) if next_deadline else None,
+            }
 
 
 # Global session service instance
-session_service = SessionService()
-
+session_service = SessionService(
+    session_store,
+    timeout_minutes=settings.SESSION_TIMEOUT_MINUTES,
+    cache_ttl_seconds=settings.SESSION_CACHE_TTL_SECONDS,
+    activity_flush_seconds=settings.SESSION_ACTIVITY_FLUSH_SECONDS,
+    expiry_batch=settings.SESSION_EXPIRY_BATCH
+)
@@ -0,0 +1,553 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Any
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Document locks are leases, so a worker that dies holding one loses it after this long
+DOCUMENT_LOCK_SECONDS = 30.0
+
+
+class SessionStore(ABC):
+    """
+    Session and ingestion job state shared by all worker processes.
+    
+    Sessions are dicts with ``session_id``, ``created_at`` (ISO),
+    ``last_activity`` (epoch seconds), ``queries``, ``prompt_tokens``,
+    ``completion_tokens`` and ``documents``, a list of dicts with
+    ``document_id``, ``filename``, ``file_path`` and ``added_at``. Jobs are
+    the dicts of IngestionJob.to_dict. Every operation is atomic, so workers
+    can update the same session concurrently.
+    """
+    
+    name = "base"
+    
+    @abstractmethod
+    def create_session(self, session: Dict[str, Any]):
+        ...
+    
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+    
+    @abstractmethod
+    def delete_session(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Delete a session; returns its documents, or None if it did not exist."""
+    
+    @abstractmethod
+    def add_document(self, session_id: str, document: Dict[str, Any]) -> bool:
+        """Add a document to a session, or update its filename; False if the session does not exist."""
+    
+    @abstractmethod
+    def remove_document(self, session_id: str, document_id: str) -> bool:
+        ...
+    
+    @abstractmethod
+    def add_usage(self, session_id: str, queries: int, prompt_tokens: int, completion_tokens: int):
+        ...
+    
+    @abstractmethod
+    def touch(self, session_id: str, last_activity: float):
+        """Move a session's last activity forward (never back)."""
+    
+    @abstractmethod
+    def expired_sessions(self, before: float, limit: int) -> List[Tuple[str, float]]:
+        """(id, last activity) of up to limit sessions last active before the given time, least recent first."""
+    
+    @abstractmethod
+    def count_expired(self, before: float) -> int:
+        ...
+    
+    @abstractmethod
+    def earliest_activity(self) -> Optional[float]:
+        """The least recent last activity of any session."""
+    
+    @abstractmethod
+    def count_sessions(self) -> int:
+        ...
+    
+    @abstractmethod
+    def save_job(self, job: Dict[str, Any], updated_at: float):
+        ...
+    
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+    
+    @abstractmethod
+    def stale_jobs(self, before: float) -> List[Dict[str, Any]]:
+        """Unfinished jobs not updated since the given time."""
+    
+    @abstractmethod
+    def delete_jobs(self, before: float) -> int:
+        """Delete finished jobs last updated before the given time."""
+    
+    @abstractmethod
+    def referenced_documents(self) -> Set[str]:
+        """Documents held by any session or unfinished ingestion job."""
+    
+    @abstractmethod
+    def document_in_use(self, document_id: str) -> bool:
+        """Whether any session or unfinished ingestion job holds a document."""
+    
+    @abstractmethod
+    def try_lock_document(self, document_id: str, owner: str, lease_seconds: float) -> bool:
+        """Take a document's lock for owner, unless another owner holds an unexpired lease on it."""
+    
+    @abstractmethod
+    def unlock_document(self, document_id: str, owner: str):
+        """Release a document's lock if owner still holds it."""
+    
+    @contextmanager
+    def document_lock(self, document_id: str, timeout: float = DOCUMENT_LOCK_SECONDS):
+        """
+        Hold a document's lock, shared by all workers.
+        
+        Taken to record a new use of a document (before its file is stored)
+        and to check that a document is unused and delete its files, so the
+        two never interleave across workers. Raises TimeoutError if the lock
+        is not free within timeout.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.try_lock_document(document_id, owner, DOCUMENT_LOCK_SECONDS):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for the lock on document {document_id[:12]}")
+            time.sleep(0.02)
+        try:
+            yield
+        finally:
+            self.unlock_document(document_id, owner)
+    
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in a SQLite database in WAL mode.
+    
+    Workers on one host share the database file; WAL lets readers proceed
+    while another worker writes.
+    """
+    
+    name = "sqlite"
+    
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, created_at TEXT NOT NULL, last_activity REAL NOT NULL, "
+            "queries INTEGER NOT NULL DEFAULT 0, prompt_tokens INTEGER NOT NULL DEFAULT 0, "
+            "completion_tokens INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity);"
+            "CREATE TABLE IF NOT EXISTS session_documents ("
+            "session_id TEXT NOT NULL, document_id TEXT NOT NULL, filename TEXT NOT NULL, "
+            "file_path TEXT NOT NULL, added_at TEXT NOT NULL, PRIMARY KEY (session_id, document_id));"
+            "CREATE INDEX IF NOT EXISTS session_documents_document ON session_documents (document_id);"
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, finished INTEGER NOT NULL, "
+            "updated_at REAL NOT NULL, data TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_unfinished ON jobs (finished, content_hash);"
+            "CREATE TABLE IF NOT EXISTS document_locks ("
+            "document_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        logger.info(f"SQLiteSessionStore opened at {path}")
+    
+    def create_session(self, session: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, created_at, last_activity, queries, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session["session_id"], session["created_at"], session["last_activity"],
+                 session["queries"], session["prompt_tokens"], session["completion_tokens"])
+            )
+    
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, last_activity, queries, prompt_tokens, completion_tokens "
+                "FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            documents = self._conn.execute(
+                "SELECT document_id, filename, file_path, added_at FROM session_documents "
+                "WHERE session_id = ? ORDER BY added_at",
+                (session_id,)
+            ).fetchall()
+        return {
+            "session_id": session_id,
+            "created_at": row[0],
+            "last_activity": row[1],
+            "queries": row[2],
+            "prompt_tokens": row[3],
+            "completion_tokens": row[4],
+            "documents": [
+                {"document_id": document_id, "filename": filename, "file_path": file_path, "added_at": added_at}
+                for document_id, filename, file_path, added_at in documents
+            ]
+        }
+    
+    def delete_session(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock, self._conn:
+            documents = [
+                {"document_id": document_id, "filename": filename, "file_path": file_path, "added_at": added_at}
+                for document_id, filename, file_path, added_at in self._conn.execute(
+                    "SELECT document_id, filename, file_path, added_at FROM session_documents WHERE session_id = ?",
+                    (session_id,)
+                )
+            ]
+            deleted = self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            self._conn.execute("DELETE FROM session_documents WHERE session_id = ?", (session_id,))
+        return documents if deleted else None
+    
+    def add_document(self, session_id: str, document: Dict[str, Any]) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "INSERT INTO session_documents (session_id, document_id, filename, file_path, added_at) "
+                "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?) "
+                "ON CONFLICT (session_id, document_id) DO UPDATE SET filename = excluded.filename",
+                (session_id, document["document_id"], document["filename"], document["file_path"],
+                 document["added_at"], session_id)
+            ).rowcount > 0
+    
+    def remove_document(self, session_id: str, document_id: str) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM session_documents WHERE session_id = ? AND document_id = ?",
+                (session_id, document_id)
+            ).rowcount > 0
+    
+    def add_usage(self, session_id: str, queries: int, prompt_tokens: int, completion_tokens: int):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sessions SET queries = queries + ?, prompt_tokens = prompt_tokens + ?, "
+                "completion_tokens = completion_tokens + ? WHERE session_id = ?",
+                (queries, prompt_tokens, completion_tokens, session_id)
+            )
+    
+    def touch(self, session_id: str, last_activity: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sessions SET last_activity = MAX(last_activity, ?) WHERE session_id = ?",
+                (last_activity, session_id)
+            )
+    
+    def expired_sessions(self, before: float, limit: int) -> List[Tuple[str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT session_id, last_activity FROM sessions WHERE last_activity < ? "
+                "ORDER BY last_activity LIMIT ?",
+                (before, limit)
+            ).fetchall()
+    
+    def count_expired(self, before: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE last_activity < ?", (before,)
+            ).fetchone()[0]
+    
+    def earliest_activity(self) -> Optional[float]:
+        with self._lock:
+            return self._conn.execute("SELECT MIN(last_activity) FROM sessions").fetchone()[0]
+    
+    def count_sessions(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    
+    def save_job(self, job: Dict[str, Any], updated_at: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, content_hash, finished, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                (job["job_id"], job["content_hash"], int(job["status"] in ("completed", "failed")),
+                 updated_at, json.dumps(job))
+            )
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def stale_jobs(self, before: float) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs WHERE finished = 0 AND updated_at < ?", (before,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def delete_jobs(self, before: float) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE finished = 1 AND updated_at < ?", (before,)
+            ).rowcount
+    
+    def referenced_documents(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document_id FROM session_documents "
+                "UNION SELECT content_hash FROM jobs WHERE finished = 0"
+            ).fetchall()
+        return {row[0] for row in rows}
+    
+    def document_in_use(self, document_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM session_documents WHERE document_id = ?) "
+                "OR EXISTS (SELECT 1 FROM jobs WHERE finished = 0 AND content_hash = ?)",
+                (document_id, document_id)
+            ).fetchone()[0] == 1
+    
+    def try_lock_document(self, document_id: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM document_locks WHERE document_id = ? AND expires_at < ?", (document_id, now))
+            return self._conn.execute(
+                "INSERT OR IGNORE INTO document_locks (document_id, owner, expires_at) VALUES (?, ?, ?)",
+                (document_id, owner, now + lease_seconds)
+            ).rowcount == 1
+    
+    def unlock_document(self, document_id: str, owner: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM document_locks WHERE document_id = ? AND owner = ?", (document_id, owner))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store in Redis, for workers spread over several hosts.
+    
+    Works with any client exposing the redis-py API (created with
+    decode_responses=True), such as a fakeredis instance in tests. Keys:
+    ``session:{id}`` (hash of the session fields), ``session:{id}:documents``
+    (document id to JSON), ``sessions:activity`` (sorted set of last
+    activity), ``document:{id}:sessions`` (set of sessions holding a
+    document), ``document:{id}:lock`` (owner of the document's lock, with
+    its lease as expiry), ``job:{id}`` (JSON), ``jobs:updated`` (sorted set
+    of update times) and ``jobs:unfinished`` (job id to content hash).
+    """
+    
+    name = "redis"
+    
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = "notebook:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("SESSION_BACKEND=redis requires the redis package (pip install redis)") from e
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        logger.info(f"RedisSessionStore using {url or type(client).__name__}")
+    
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+    
+    def create_session(self, session: Dict[str, Any]):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key("session", session["session_id"]), mapping={
+            "created_at": session["created_at"],
+            "queries": session["queries"],
+            "prompt_tokens": session["prompt_tokens"],
+            "completion_tokens": session["completion_tokens"],
+        })
+        pipe.zadd(self._key("sessions", "activity"), {session["session_id"]: session["last_activity"]})
+        pipe.execute()
+    
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        pipe = self.client.pipeline()
+        pipe.hgetall(self._key("session", session_id))
+        pipe.zscore(self._key("sessions", "activity"), session_id)
+        pipe.hvals(self._key("session", session_id, "documents"))
+        fields, last_activity, documents = pipe.execute()
+        if not fields:
+            return None
+        return {
+            "session_id": session_id,
+            "created_at": fields["created_at"],
+            "last_activity": float(last_activity or 0),
+            "queries": int(fields.get("queries", 0)),
+            "prompt_tokens": int(fields.get("prompt_tokens", 0)),
+            "completion_tokens": int(fields.get("completion_tokens", 0)),
+            "documents": sorted((json.loads(document) for document in documents), key=lambda d: d["added_at"])
+        }
+    
+    def delete_session(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        session_key = self._key("session", session_id)
+        documents_key = self._key("session", session_id, "documents")
+        
+        def delete(pipe) -> Optional[List[Dict[str, Any]]]:
+            # Watching the documents hash retries the delete when a document is
+            # added meanwhile, so its document:{id}:sessions entry is removed too
+            exists = pipe.exists(session_key)
+            documents = [json.loads(document) for document in pipe.hvals(documents_key)]
+            pipe.multi()
+            pipe.delete(session_key)
+            pipe.delete(documents_key)
+            pipe.zrem(self._key("sessions", "activity"), session_id)
+            for document in documents:
+                pipe.srem(self._key("document", document["document_id"], "sessions"), session_id)
+            return documents if exists else None
+        
+        return self.client.transaction(delete, session_key, documents_key, value_from_callable=True)
+    
+    def add_document(self, session_id: str, document: Dict[str, Any]) -> bool:
+        session_key = self._key("session", session_id)
+        documents_key = self._key("session", session_id, "documents")
+        
+        def add(pipe) -> bool:
+            # Watching the session hash retries the add when the session is
+            # deleted meanwhile, instead of leaving a dangling document entry
+            if not pipe.exists(session_key):
+                pipe.unwatch()
+                return False
+            existing = pipe.hget(documents_key, document["document_id"])
+            entry = document if existing is None else dict(json.loads(existing), filename=document["filename"])
+            pipe.multi()
+            pipe.hset(documents_key, entry["document_id"], json.dumps(entry))
+            pipe.sadd(self._key("document", entry["document_id"], "sessions"), session_id)
+            return True
+        
+        return self.client.transaction(add, session_key, documents_key, value_from_callable=True)
+    
+    def remove_document(self, session_id: str, document_id: str) -> bool:
+        pipe = self.client.pipeline()
+        pipe.hdel(self._key("session", session_id, "documents"), document_id)
+        pipe.srem(self._key("document", document_id, "sessions"), session_id)
+        return pipe.execute()[0] > 0
+    
+    def add_usage(self, session_id: str, queries: int, prompt_tokens: int, completion_tokens: int):
+        key = self._key("session", session_id)
+        
+        def add(pipe):
+            # HINCRBY on a deleted session would recreate it without created_at
+            if not pipe.exists(key):
+                pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.hincrby(key, "queries", queries)
+            pipe.hincrby(key, "prompt_tokens", prompt_tokens)
+            pipe.hincrby(key, "completion_tokens", completion_tokens)
+        
+        self.client.transaction(add, key)
+    
+    def touch(self, session_id: str, last_activity: float):
+        self.client.zadd(self._key("sessions", "activity"), {session_id: last_activity}, xx=True, gt=True)
+    
+    def expired_sessions(self, before: float, limit: int) -> List[Tuple[str, float]]:
+        return [
+            (session_id, float(score)) for session_id, score in self.client.zrangebyscore(
+                self._key("sessions", "activity"), "-inf", f"({before}", start=0, num=limit, withscores=True
+            )
+        ]
+    
+    def count_expired(self, before: float) -> int:
+        return self.client.zcount(self._key("sessions", "activity"), "-inf", f"({before}")
+    
+    def earliest_activity(self) -> Optional[float]:
+        earliest = self.client.zrange(self._key("sessions", "activity"), 0, 0, withscores=True)
+        return float(earliest[0][1]) if earliest else None
+    
+    def count_sessions(self) -> int:
+        return self.client.zcard(self._key("sessions", "activity"))
+    
+    def save_job(self, job: Dict[str, Any], updated_at: float):
+        pipe = self.client.pipeline()
+        pipe.set(self._key("job", job["job_id"]), json.dumps(job))
+        pipe.zadd(self._key("jobs", "updated"), {job["job_id"]: updated_at})
+        if job["status"] in ("completed", "failed"):
+            pipe.hdel(self._key("jobs", "unfinished"), job["job_id"])
+        else:
+            pipe.hset(self._key("jobs", "unfinished"), job["job_id"], job["content_hash"])
+        pipe.execute()
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(self._key("job", job_id))
+        return json.loads(data) if data else None
+    
+    def stale_jobs(self, before: float) -> List[Dict[str, Any]]:
+        unfinished = self.client.hkeys(self._key("jobs", "unfinished"))
+        jobs = []
+        for job_id in unfinished:
+            updated_at = self.client.zscore(self._key("jobs", "updated"), job_id)
+            if updated_at is not None and updated_at < before:
+                job = self.get_job(job_id)
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+    
+    def delete_jobs(self, before: float) -> int:
+        unfinished = set(self.client.hkeys(self._key("jobs", "unfinished")))
+        job_ids = [
+            job_id for job_id in self.client.zrangebyscore(self._key("jobs", "updated"), "-inf", f"({before}")
+            if job_id not in unfinished
+        ]
+        if not job_ids:
+            return 0
+        pipe = self.client.pipeline()
+        pipe.delete(*[self._key("job", job_id) for job_id in job_ids])
+        pipe.zrem(self._key("jobs", "updated"), *job_ids)
+        pipe.execute()
+        return len(job_ids)
+    
+    def referenced_documents(self) -> Set[str]:
+        documents = set(self.client.hvals(self._key("jobs", "unfinished")))
+        for key in self.client.scan_iter(match=self._key("document", "*", "sessions")):
+            if self.client.scard(key):
+                documents.add(key[len(self._key("document", "")):-len(":sessions")])
+        return documents
+    
+    def document_in_use(self, document_id: str) -> bool:
+        if self.client.scard(self._key("document", document_id, "sessions")):
+            return True
+        return document_id in self.client.hvals(self._key("jobs", "unfinished"))
+    
+    def try_lock_document(self, document_id: str, owner: str, lease_seconds: float) -> bool:
+        return bool(self.client.set(self._key("document", document_id, "lock"), owner, nx=True, px=int(lease_seconds * 1000)))
+    
+    def unlock_document(self, document_id: str, owner: str):
+        key = self._key("document", document_id, "lock")
+        
+        def unlock(pipe):
+            # Only the owner's lease is deleted, not one taken after it expired
+            if pipe.get(key) != owner:
+                pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.delete(key)
+        
+        self.client.transaction(unlock, key)
+    
+    def close(self):
+        self.client.close()
+
+
+def create_session_store() -> SessionStore:
+    """The session store selected by SESSION_BACKEND."""
+    if settings.SESSION_BACKEND == "redis":
+        return RedisSessionStore(settings.SESSION_REDIS_URL)
+    if settings.SESSION_BACKEND != "sqlite":
+        raise ValueError(f"Unknown SESSION_BACKEND: {settings.SESSION_BACKEND}")
+    return SQLiteSessionStore(settings.SESSION_DB_PATH)
+
+
+# Global session store instance
+session_store = create_session_store()
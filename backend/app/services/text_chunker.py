@@ -0,0 +1,135 @@
+from collections import deque
+from typing import List, Tuple, Iterable, Optional
+
+from langchain_core.documents import Document
+
+Span = Tuple[int, int]
+
+
+class TextChunker:
+    """
+    Offset-based recursive text chunker.
+    
+    Produces the same chunk boundaries as LangChain's
+    RecursiveCharacterTextSplitter (default separators, separators kept at
+    the start of the following piece, whitespace stripped), but works on
+    (start, end) offsets into the page text: separators are located with
+    str.find on the original string and merged pieces are contiguous spans,
+    so the only strings built are the final chunks themselves.
+    
+    Each chunk's metadata records its character offsets within the page
+    (start_index, end_index) alongside the page metadata from the loader.
+    """
+    
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: Optional[List[str]] = None
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size})"
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+    
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """Split page documents into chunk documents, in page order."""
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end in self.split_spans(text):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+    
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunk strings."""
+        return [text[start:end] for start, end in self.split_spans(text)]
+    
+    def split_spans(self, text: str) -> List[Span]:
+        """Split text into (start, end) chunk offsets."""
+        chunks: List[Span] = []
+        self._split(text, 0, len(text), 0, chunks)
+        return chunks
+    
+    def _split(self, text: str, start: int, end: int, level: int, chunks: List[Span]):
+        """Split text[start:end] on the first separator present, recursing into oversize pieces."""
+        # Get appropriate separator to use
+        separator = self.separators[-1]
+        next_level = len(self.separators)
+        for i in range(level, len(self.separators)):
+            candidate = self.separators[i]
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                next_level = i + 1
+                break
+        
+        # Merge small pieces, recursing into pieces that are too long
+        good_splits: List[Span] = []
+        for piece in self._pieces(text, start, end, separator):
+            if piece[1] - piece[0] < self.chunk_size:
+                good_splits.append(piece)
+                continue
+            if good_splits:
+                self._merge(text, good_splits, chunks)
+                good_splits = []
+            if next_level >= len(self.separators):
+                self._emit(text, piece[0], piece[1], chunks)
+            else:
+                self._split(text, piece[0], piece[1], next_level, chunks)
+        if good_splits:
+            self._merge(text, good_splits, chunks)
+    
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> List[Span]:
+        """Split text[start:end] before each separator occurrence (empty pieces dropped)."""
+        if separator == "":
+            return [(i, i + 1) for i in range(start, end)]
+        
+        pieces = []
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                pieces.append((piece_start, position))
+            piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if end > piece_start:
+            pieces.append((piece_start, end))
+        return pieces
+    
+    def _merge(self, text: str, splits: List[Span], chunks: List[Span]):
+        """Combine adjacent pieces into chunks of up to chunk_size with chunk_overlap."""
+        current = deque()
+        total = 0
+        for piece in splits:
+            length = piece[1] - piece[0]
+            if total + length > self.chunk_size:
+                if current:
+                    self._emit(text, current[0][0], current[-1][1], chunks)
+                    # Keep trailing pieces as overlap for the next chunk
+                    while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                        first = current.popleft()
+                        total -= first[1] - first[0]
+            current.append(piece)
+            total += length
+        if current:
+            self._emit(text, current[0][0], current[-1][1], chunks)
+    
+    @staticmethod
+    def _emit(text: str, start: int, end: int, chunks: List[Span]):
+        """Record a chunk span with surrounding whitespace trimmed, skipping empty chunks."""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            chunks.append((start, end))
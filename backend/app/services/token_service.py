@@ -0,0 +1,200 @@
+import threading
+from typing import Dict, List, Optional, Tuple, Any
+from uuid import UUID
+import logging
+
+import tiktoken
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger(__name__)
+
+# Fewer tokens than this left in the budget aren't worth a truncated chunk
+MIN_PACKED_TOKENS = 32
+
+# Rough size of a token in English text, for counting without the tokenizer
+CHARS_PER_TOKEN = 4
+
+
+class TokenService:
+    """
+    Token counting and budgeted prompt packing for the chat model.
+    
+    The tokenizer is loaded by load, which the app runs at startup off the
+    event loop, since tiktoken downloads an encoding the first time it is
+    used. If it can't be loaded (no network access and no cached copy),
+    tokens are estimated from text length instead.
+    """
+    
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        self.model = model
+        self._encoding: Optional[tiktoken.Encoding] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        logger.info(f"TokenService initialized for {model}")
+    
+    def load(self):
+        """Load the model's tokenizer, once; on failure, fall back to length-based estimates."""
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.model)
+                logger.info(f"Loaded tokenizer for {self.model}")
+            except Exception as e:
+                logger.warning(f"Could not load the tokenizer for {self.model} ({e}); estimating tokens from text length")
+            self._loaded = True
+    
+    @property
+    def encoding(self) -> Optional[tiktoken.Encoding]:
+        """The tokenizer, or None if it couldn't be loaded."""
+        if not self._loaded:
+            self.load()
+        return self._encoding
+    
+    def count(self, text: str) -> int:
+        """Number of tokens in a text."""
+        if self.encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        """Prompt tokens for a chat request, including the per-message framing."""
+        # Each message is framed by 3 tokens and the reply is primed with 3 more
+        return sum(3 + self.count(message.type) + self.count(str(message.content)) for message in messages) + 3
+    
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of a text that fits in max_tokens."""
+        if self.encoding is None:
+            return text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens, 0)])
+    
+    @staticmethod
+    def _uncovered(document: Document, packed: Dict[tuple, List[Tuple[int, int]]]) -> str:
+        """
+        A chunk's text minus the parts already packed from overlapping chunks of the same page.
+        
+        Neighbouring chunks share CHUNK_OVERLAP characters; chunks without
+        offsets are returned whole.
+        """
+        metadata = document.metadata
+        start, end = metadata.get("start_index"), metadata.get("end_index")
+        if start is None or end is None:
+            return document.page_content
+        
+        key = (metadata.get("source"), metadata.get("page"))
+        new_start, new_end = start, end
+        for packed_start, packed_end in packed.get(key, []):
+            if packed_start <= new_start < packed_end:
+                new_start = packed_end
+            if packed_start < new_end <= packed_end:
+                new_end = packed_start
+        packed.setdefault(key, []).append((start, end))
+        if new_start >= new_end:
+            return ""
+        return document.page_content[new_start - start:new_end - start]
+    
+    def pack_chunks(self, documents: List[Document], budget: int) -> Tuple[List[str], int]:
+        """
+        Fit ranked chunks into a token budget.
+        
+        Chunks are taken in rank order with overlapping text removed; the
+        first chunk that doesn't fit is truncated and lower-ranked ones are
+        dropped.
+        
+        Returns:
+            Tuple of (chunk texts in rank order, tokens used)
+        """
+        packed: Dict[tuple, List[Tuple[int, int]]] = {}
+        separator = self.count("\n\n")
+        texts, used = [], 0
+        for document in documents:
+            text = self._uncovered(document, packed)
+            if not text.strip():
+                continue
+            remaining = budget - used - (separator if texts else 0)
+            if remaining < MIN_PACKED_TOKENS:
+                break
+            tokens = self.count(text)
+            if tokens > remaining:
+                text, tokens = self.truncate(text, remaining), remaining
+            texts.append(text)
+            used += tokens + (separator if len(texts) > 1 else 0)
+        return texts, used
+    
+    def pack_web_results(self, results: List[Dict[str, Any]], budget: int) -> Tuple[List[str], int]:
+        """
+        Fit ranked web results into a token budget, trimming their content.
+        
+        Returns:
+            Tuple of (formatted results in rank order, tokens used)
+        """
+        separator = self.count("\n\n")
+        blocks, used = [], 0
+        for result in results:
+            header = f"Title: {result.get('title', '')}\nContent: "
+            footer = f"\nURL: {result.get('url', '')}"
+            framing = self.count(header) + self.count(footer)
+            remaining = budget - used - (separator if blocks else 0) - framing
+            if remaining < MIN_PACKED_TOKENS:
+                break
+            content = self.truncate(result.get("content", ""), remaining)
+            blocks.append(header + content + footer)
+            used += framing + self.count(content) + (separator if len(blocks) > 1 else 0)
+        return blocks, used
+
+
+class TokenUsage(BaseCallbackHandler):
+    """
+    Callback that adds up prompt and completion tokens across LLM calls.
+    
+    Uses the token usage the API reports. Streamed responses don't report
+    usage, so for those the prompt is counted locally and so are the
+    tokens received, including those of a stream closed early.
+    """
+    
+    run_inline = True
+    
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._runs: Dict[UUID, Tuple[int, List[str]]] = {}
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any):
+        self._runs[run_id] = (sum(token_service.count_messages(batch) for batch in messages), [])
+    
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run[1].append(token)
+    
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        prompt_tokens, streamed = self._runs.pop(run_id, (0, []))
+        usage = (response.llm_output or {}).get("token_usage")
+        if usage:
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            return
+        completion = "".join(streamed) or "".join(
+            generation.text for generations in response.generations for generation in generations
+        )
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += token_service.count(completion)
+    
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        prompt_tokens, streamed = self._runs.pop(run_id, (0, []))
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += token_service.count("".join(streamed))
+
+
+# Global token service instance
+token_service = TokenService()
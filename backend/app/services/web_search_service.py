@@ -0,0 +1,166 @@
+import asyncio
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Any
+import logging
+
+from tavily import TavilyClient
+
+from app.core.config import settings
+from app.services.answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+
+class WebSearchBackend(ABC):
+    """
+    A web search provider.
+    
+    Implementations return a list of result dicts with ``title``, ``url``
+    and ``content`` keys. search is blocking and runs on the web search
+    service's executor.
+    """
+    
+    name = "base"
+    
+    @abstractmethod
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        ...
+
+
+class TavilySearchBackend(WebSearchBackend):
+    """Web search through the Tavily API."""
+    
+    name = "tavily"
+    
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.client = TavilyClient(api_key=api_key)
+        if base_url:
+            self.client.base_url = base_url
+    
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        return self.client.search(query=query, max_results=max_results).get("results", [])
+
+
+class WebSearchService:
+    """
+    Cached, coalesced web search.
+    
+    Results are cached for ttl_seconds under the normalized query and
+    result count, up to max_entries (least recently used first out).
+    Concurrent searches for the same key share one outbound call, which
+    keeps running even if a caller stops waiting, so its results still
+    reach the cache. Failures are not cached. Backend calls run on a
+    bounded executor of max_concurrency threads.
+    """
+    
+    def __init__(
+        self,
+        backend: WebSearchBackend,
+        ttl_seconds: float = 600,
+        max_entries: int = 1000,
+        max_concurrency: int = 16
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="web-search")
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.outbound_calls = 0
+        self.failures = 0
+        logger.info(f"WebSearchService initialized with {backend.name} backend")
+    
+    def set_backend(self, backend: WebSearchBackend):
+        """Switch to another search backend, dropping results cached from the previous one."""
+        with self._lock:
+            self.backend = backend
+            self._cache.clear()
+        logger.info(f"Web search backend set to {backend.name}")
+    
+    def shutdown(self):
+        """Stop the web search threads."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def search(self, query: str, max_results: int = 3) -> List[Dict[str, Any]]:
+        """Search results for a query, from the cache, an identical search in flight or the backend."""
+        key = (normalize_question(query), max_results)
+        with self._lock:
+            self.lookups += 1
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(cached[1])
+            if cached is not None:
+                del self._cache[key]
+        
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(key, query, max_results))
+            self._in_flight[key] = future
+            future.add_done_callback(partial(self._fetch_done, key))
+        else:
+            self.coalesced += 1
+        # Shielded, so a caller giving up doesn't cancel the search for the others
+        return list(await asyncio.shield(future))
+    
+    def _fetch_done(self, key: Tuple[str, int], future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Retrieve the outcome when nobody awaits it any more, so failures aren't reported as unhandled
+        future.cancelled() or future.exception()
+    
+    async def _fetch(self, key: Tuple[str, int], query: str, max_results: int) -> List[Dict[str, Any]]:
+        """Run one outbound search and cache its results."""
+        logger.info(f"Searching the web ({self.backend.name}): {query[:100]}")
+        self.outbound_calls += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                partial(self.backend.search, query, max_results)
+            )
+        except Exception:
+            self.failures += 1
+            raise
+        
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl_seconds, results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache and coalescing counters."""
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "entries": len(self._cache),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "outbound_calls": self.outbound_calls,
+                "failures": self.failures,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+                "outbound_calls_saved": self.hits + self.coalesced,
+            }
+
+
+# Global web search service instance
+web_search_service = WebSearchService(
+    TavilySearchBackend(settings.TAVILY_API_KEY, base_url=settings.TAVILY_BASE_URL),
+    ttl_seconds=settings.WEB_SEARCH_CACHE_TTL_SECONDS,
+    max_entries=settings.WEB_SEARCH_CACHE_MAX_ENTRIES,
+    max_concurrency=settings.WEB_SEARCH_MAX_CONCURRENCY
+)
@@ -0,0 +1,127 @@
+"""
+Compare one /query/batch request with the same questions sent as sequential /query calls.
+
+Uses the stub OpenAI and Tavily server from bench_concurrency, answering
+after fixed delays, and runs the real backend as one uvicorn worker
+pointed at it. For each batch size N, N questions are asked one /query at
+a time (as an evaluation script would), then N different questions in a
+single /query/batch. The stub counts embedding and chat requests, so the
+table shows both the wall time and the outbound calls each way takes.
+
+Questions are unique across runs so the answer and web search caches never
+answer them.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_batch --questions 10 50 --llm-ms 500 --batch-concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from benchmarks.bench_concurrency import (
+    BACKEND_DIR,
+    build_pdf,
+    build_stub_app,
+    free_port,
+    start_stub,
+    upload,
+    wait_for_backend,
+)
+
+
+async def run_sequential(client: httpx.AsyncClient, session_id: str, questions) -> float:
+    start = time.perf_counter()
+    for question in questions:
+        response = await client.post("/api/v1/query", json={"session_id": session_id, "question": question})
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run_batch(client: httpx.AsyncClient, session_id: str, questions) -> float:
+    start = time.perf_counter()
+    response = await client.post("/api/v1/query/batch", json={"session_id": session_id, "questions": questions})
+    response.raise_for_status()
+    failed = [result for result in response.json()["results"] if not result["success"]]
+    if failed:
+        raise RuntimeError(f"{len(failed)} batch questions failed: {failed[0]['error']}")
+    return time.perf_counter() - start
+
+
+async def run(args):
+    stub_port, backend_port = free_port(), free_port()
+    stub = build_stub_app(args.llm_ms / 1000, args.embed_ms / 1000, args.search_ms / 1000, args.web, args.dim)
+    calls = Counter()
+    
+    @stub.middleware("http")
+    async def count_calls(request, call_next):
+        calls[request.url.path] += 1
+        return await call_next(request)
+    
+    start_stub(stub, stub_port)
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY="stub",
+            TAVILY_API_KEY="stub",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{stub_port}/v1",
+            TAVILY_BASE_URL=f"http://127.0.0.1:{stub_port}/search",
+            BATCH_LLM_CONCURRENCY=str(args.batch_concurrency),
+            BATCH_MAX_QUESTIONS=str(max(args.questions)),
+            LOG_LEVEL="WARNING",
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", str(BACKEND_DIR),
+             "--port", str(backend_port), "--workers", "1", "--log-level", "warning"],
+            cwd=workdir, env=env
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{backend_port}", timeout=600) as client:
+                await wait_for_backend(client, process)
+                pdf_path = Path(workdir) / "bench.pdf"
+                build_pdf(pdf_path, args.pages)
+                session_id = await upload(client, pdf_path)
+                
+                print(f"Stub latencies: LLM {args.llm_ms} ms, embeddings {args.embed_ms} ms"
+                      f"{f', search {args.search_ms} ms' if args.web else ''}; batch LLM concurrency {args.batch_concurrency}")
+                print(f"{'questions':>10}{'mode':>12}{'wall s':>9}{'q/s':>8}{'embed calls':>13}{'chat calls':>12}{'speedup':>9}")
+                for n in args.questions:
+                    sequential_wall = None
+                    for mode, runner in (("sequential", run_sequential), ("batch", run_batch)):
+                        questions = [f"What is the maintenance schedule for unit {i} ({mode}, batch of {n})?" for i in range(n)]
+                        calls.clear()
+                        wall = await runner(client, session_id, questions)
+                        sequential_wall = sequential_wall or wall
+                        print(
+                            f"{n:>10}{mode:>12}{wall:>9.2f}{n / wall:>8.1f}"
+                            f"{calls['/v1/embeddings']:>13}{calls['/v1/chat/completions']:>12}{sequential_wall / wall:>8.1f}x"
+                        )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, nargs="+", default=[10, 50], help="Batch sizes")
+    parser.add_argument("--batch-concurrency", type=int, default=8, help="BATCH_LLM_CONCURRENCY for the backend")
+    parser.add_argument("--llm-ms", type=int, default=500, help="Stub chat completion latency")
+    parser.add_argument("--embed-ms", type=int, default=50, help="Stub embedding latency")
+    parser.add_argument("--search-ms", type=int, default=300, help="Stub web search latency")
+    parser.add_argument("--web", action="store_true", help="Make every answer fall back to web search")
+    parser.add_argument("--pages", type=int, default=20, help="Pages in the generated PDF")
+    parser.add_argument("--dim", type=int, default=256, help="Stub embedding dimension")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Load-test concurrent /query requests against a single backend worker.
+
+Starts a local stub that stands in for the OpenAI chat and embedding APIs
+and for Tavily, each answering after a fixed delay, then runs the real
+backend as one uvicorn worker pointed at the stub (OPENAI_BASE_URL,
+TAVILY_BASE_URL). A generated PDF is uploaded and queries are fired at
+increasing concurrency. With a non-blocking query path, throughput grows
+with concurrency while per-query latency stays near the stub's delay; a
+blocking path would serialise the LLM round trips and hold throughput at
+about one query per delay.
+
+The backend runs in a temporary directory, so its uploads, indexes,
+sessions and embedding cache are discarded afterwards. The embedding client
+tokenizes with tiktoken, which downloads its encoding on first use.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_concurrency --concurrency 1 8 32 128 --llm-ms 500 --web
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SENTINEL = "[NEED_WEB_SEARCH]"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_stub_app(llm_seconds: float, embed_seconds: float, search_seconds: float, web: bool, dimension: int) -> FastAPI:
+    """OpenAI- and Tavily-compatible endpoints that sleep for a fixed time before answering."""
+    stub = FastAPI()
+    
+    def stub_vector(item) -> list:
+        seed = int(hashlib.sha256(json.dumps(item).encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+    
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(llm_seconds)
+        prompt = body["messages"][-1]["content"]
+        answer = SENTINEL if web and "Context from PDF" in prompt else "The stub model's answer to the question."
+        if not body.get("stream"):
+            return {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        
+        async def events():
+            for word in answer.split(" "):
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
+    @stub.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await asyncio.sleep(embed_seconds)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, item in enumerate(inputs):
+            vector = stub_vector(item)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        return {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+    
+    @stub.post("/search")
+    async def search(request: Request):
+        body = await request.json()
+        await asyncio.sleep(search_seconds)
+        return {"results": [
+            {"title": f"Result {i}", "url": f"https://example.com/{i}", "content": f"Stub result {i} for {body['query']}"}
+            for i in range(body.get("max_results", 3))
+        ]}
+    
+    return stub
+
+
+def start_stub(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def build_pdf(path: Path, pages: int):
+    import fitz
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        page.insert_textbox(
+            fitz.Rect(50, 50, 550, 800),
+            " ".join(f"Section {number}.{line}: maintenance schedule for unit {line * 7 + number}." for line in range(30))
+        )
+    document.save(str(path))
+
+
+async def wait_for_backend(client: httpx.AsyncClient, process: subprocess.Popen):
+    for _ in range(200):
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        try:
+            if (await client.get("/api/v1/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Backend did not start")
+
+
+async def upload(client: httpx.AsyncClient, pdf_path: Path) -> str:
+    with open(pdf_path, "rb") as f:
+        response = await client.post("/api/v1/upload", files={"file": (pdf_path.name, f, "application/pdf")})
+    response.raise_for_status()
+    job = response.json()
+    while True:
+        status = (await client.get(f"/api/v1/upload/{job['job_id']}")).json()
+        if status["status"] == "completed":
+            return job["session_id"]
+        if status["status"] == "failed":
+            raise RuntimeError(f"Ingestion failed: {status['error']}")
+        await asyncio.sleep(0.1)
+
+
+async def run_level(client: httpx.AsyncClient, session_id: str, concurrency: int, requests: int):
+    """
+    Send requests queries with at most concurrency in flight; return (wall seconds, latencies).
+    
+    Questions are unique across levels so the answer and web search caches never answer them.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/v1/query", json={
+                "session_id": session_id,
+                "question": f"What is the maintenance schedule for unit {i} at concurrency {concurrency}?"
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - start, latencies
+
+
+async def run(args):
+    stub_port, backend_port = free_port(), free_port()
+    start_stub(
+        build_stub_app(args.llm_ms / 1000, args.embed_ms / 1000, args.search_ms / 1000, args.web, args.dim),
+        stub_port
+    )
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY="stub",
+            TAVILY_API_KEY="stub",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{stub_port}/v1",
+            TAVILY_BASE_URL=f"http://127.0.0.1:{stub_port}/search",
+            LOG_LEVEL="WARNING",
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", str(BACKEND_DIR),
+             "--port", str(backend_port), "--workers", "1", "--log-level", "warning"],
+            cwd=workdir, env=env
+        )
+        try:
+            limits = httpx.Limits(max_connections=max(args.concurrency) + 10)
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{backend_port}", timeout=300, limits=limits
+            ) as client:
+                await wait_for_backend(client, process)
+                pdf_path = Path(workdir) / "bench.pdf"
+                build_pdf(pdf_path, args.pages)
+                session_id = await upload(client, pdf_path)
+                
+                llm_calls = 2 if args.web else 1
+                floor_ms = args.embed_ms + llm_calls * args.llm_ms + (args.search_ms if args.web else 0)
+                print(f"Stub latency per query: {floor_ms} ms ({'web fallback' if args.web else 'PDF answer'})")
+                print(f"{'concurrency':>12}{'requests':>10}{'wall s':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'in flight':>11}")
+                for concurrency in args.concurrency:
+                    requests = concurrency * args.rounds
+                    wall, latencies = await run_level(client, session_id, concurrency, requests)
+                    print(
+                        f"{concurrency:>12}{requests:>10}{wall:>9.2f}{requests / wall:>9.1f}"
+                        f"{np.percentile(latencies, 50) * 1000:>9.0f}{np.percentile(latencies, 95) * 1000:>9.0f}"
+                        f"{sum(latencies) / wall:>11.1f}"
+                    )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--rounds", type=int, default=4, help="Requests per level, as a multiple of its concurrency")
+    parser.add_argument("--llm-ms", type=int, default=500, help="Stub chat completion latency")
+    parser.add_argument("--embed-ms", type=int, default=50, help="Stub embedding latency")
+    parser.add_argument("--search-ms", type=int, default=300, help="Stub web search latency")
+    parser.add_argument("--web", action="store_true", help="Make every answer fall back to web search")
+    parser.add_argument("--pages", type=int, default=20, help="Pages in the generated PDF")
+    parser.add_argument("--dim", type=int, default=256, help="Stub embedding dimension")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
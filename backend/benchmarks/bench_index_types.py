@@ -0,0 +1,93 @@
+"""
+Benchmark the FAISS index types PDFService can build for a document.
+
+Generates clustered, unit-normalised vectors (the shape of text-embedding
+output) and, for each corpus size and index type, reports build time,
+recall@k against exact search, single-query latency and serialized bytes per
+vector. The type the auto policy would pick under the current Settings is
+marked in the last column.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.bench_index_types --chunks 2000 10000 --dim 3072
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.pdf_service import pdf_service, INDEX_TYPES
+
+
+def build_vectors(num_vectors: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors scattered around num_vectors / 20 topic centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, num_vectors // 20), dimension), dtype=np.float32)
+    assignment = rng.integers(0, len(centres), num_vectors)
+    vectors = centres[assignment] + 0.6 * rng.standard_normal((num_vectors, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_queries(vectors: np.ndarray, num_queries: int, seed: int = 1) -> np.ndarray:
+    """Queries near (but not at) stored vectors, like a question about a chunk."""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), num_queries)]
+    queries = picks + 0.05 * rng.standard_normal(picks.shape, dtype=np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int):
+    """Return (recall@k, median ms per single-vector query)."""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0]) & set(expected))
+    return hits / truth.size, float(np.median(latencies)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[2000, 10000], help="Vectors per document")
+    parser.add_argument("--dim", type=int, default=3072, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=settings.TOP_K_CHUNKS)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = parser.parse_args()
+    
+    faiss.omp_set_num_threads(1)
+    print(f"{'chunks':>8}{'type':>7}{'build s':>9}{f'recall@{args.k}':>10}{'ms/query':>10}{'bytes/vec':>11}{'auto':>6}")
+    for num_chunks in args.chunks:
+        vectors = build_vectors(num_chunks, args.dim)
+        queries = build_queries(vectors, args.queries)
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(vectors)
+        _, truth = exact.search(queries, args.k)
+        chosen = pdf_service.choose_index_type(num_chunks, args.dim)
+        
+        for index_type in args.types:
+            if index_type == "ivfpq" and num_chunks < 256:
+                continue
+            start = time.perf_counter()
+            index = pdf_service.new_index(
+                index_type,
+                args.dim,
+                precision=pdf_service.index_precision(),
+                training_vectors=vectors
+            )
+            index.add(vectors)
+            build_seconds = time.perf_counter() - start
+            
+            recall, latency_ms = measure(index, queries, truth, args.k)
+            bytes_per_vector = len(faiss.serialize_index(index)) / num_chunks
+            print(
+                f"{num_chunks:>8}{index_type:>7}{build_seconds:>9.2f}{recall:>10.3f}"
+                f"{latency_ms:>10.3f}{bytes_per_vector:>11.0f}{'*' if index_type == chosen else '':>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
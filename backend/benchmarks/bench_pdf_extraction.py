@@ -0,0 +1,82 @@
+"""
+Benchmark PDF page extraction throughput against process count.
+
+Generates a synthetic multi-page PDF and reports pages/sec for the
+single-process PyMuPDFLoader path and for the parallel page-range
+extraction at increasing process counts.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_pdf_extraction --pages 800
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import fitz
+from langchain_community.document_loaders import PyMuPDFLoader
+
+from app.services.pdf_extraction import extract_page_range
+
+
+def build_pdf(path: str, num_pages: int):
+    """Write a text-heavy synthetic PDF."""
+    doc = fitz.open()
+    sentence = "The quick brown fox jumps over the lazy dog while the manual describes section {}. "
+    for i in range(num_pages):
+        page = doc.new_page()
+        text = "".join(sentence.format(f"{i}.{j}") for j in range(40))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def extract_parallel(pool: ProcessPoolExecutor, path: str, num_pages: int, processes: int) -> int:
+    pages_per_range = -(-num_pages // processes)
+    futures = [
+        pool.submit(extract_page_range, path, start, min(start + pages_per_range, num_pages))
+        for start in range(0, num_pages, pages_per_range)
+    ]
+    return sum(len(future.result()) for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=800, help="Pages in the synthetic PDF")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per configuration (best is reported)")
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "synthetic.pdf")
+        build_pdf(path, args.pages)
+        
+        print(f"{'mode':<14}{'processes':>10}{'seconds':>10}{'pages/sec':>12}{'speedup':>9}")
+        
+        best = min(_timed(lambda: PyMuPDFLoader(path).load()) for _ in range(args.repeats))
+        baseline = best
+        print(f"{'serial':<14}{1:>10}{best:>10.3f}{args.pages / best:>12.1f}{1.0:>9.2f}")
+        
+        processes = 1
+        while processes <= args.max_processes:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                # Warm the pool so worker start-up isn't counted
+                extract_parallel(pool, path, min(args.pages, processes), processes)
+                best = min(
+                    _timed(lambda: extract_parallel(pool, path, args.pages, processes))
+                    for _ in range(args.repeats)
+                )
+            print(f"{'parallel':<14}{processes:>10}{best:>10.3f}{args.pages / best:>12.1f}{baseline / best:>9.2f}")
+            processes *= 2
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
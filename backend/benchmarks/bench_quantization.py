@@ -0,0 +1,112 @@
+"""
+Benchmark reduced-dimension and quantized vector storage.
+
+Compares flat indexes at several stored dimensions (Matryoshka truncation)
+and precisions (float32, float16, int8), with and without full-precision
+re-scoring, against the full float32 index. Reports resident MB for one
+session's document, median single-query latency and top-k overlap with the
+full-precision results.
+
+The corpus is read from the local embedding cache, so after any real
+ingestion the benchmark runs offline on genuine text-embedding-3 vectors.
+With fewer than --chunks cached vectors it falls back to synthetic vectors
+whose variance decays across dimensions, as in Matryoshka embeddings.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.bench_quantization --chunks 5000 --dims 3072 1024 512 256
+"""
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.pdf_service import pdf_service, INDEX_PRECISIONS
+
+
+def load_cached_vectors(cache_path: str, limit: int) -> np.ndarray:
+    """Up to limit vectors for the configured model from the embedding cache."""
+    if not Path(cache_path).exists():
+        return np.zeros((0, 0), dtype=np.float32)
+    with sqlite3.connect(cache_path) as conn:
+        rows = conn.execute(
+            "SELECT vector FROM embeddings WHERE model = ? LIMIT ?",
+            (settings.EMBEDDING_MODEL, limit)
+        ).fetchall()
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([np.frombuffer(blob, dtype=np.float32) for (blob,) in rows])
+
+
+def build_synthetic_vectors(num_vectors: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors with more variance in the leading dimensions."""
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dimension, dtype=np.float32) / 64.0)
+    centres = rng.standard_normal((max(1, num_vectors // 20), dimension), dtype=np.float32) * scale
+    assignment = rng.integers(0, len(centres), num_vectors)
+    noise = 0.6 * rng.standard_normal((num_vectors, dimension), dtype=np.float32) * scale
+    vectors = centres[assignment] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_queries(vectors: np.ndarray, num_queries: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), num_queries)]
+    queries = picks + 0.02 * rng.standard_normal(picks.shape, dtype=np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000, help="Chunks in the session's document")
+    parser.add_argument("--dims", type=int, nargs="+", default=[3072, 1024, 512, 256], help="Stored dimensions")
+    parser.add_argument("--precisions", nargs="+", default=list(INDEX_PRECISIONS), choices=INDEX_PRECISIONS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=settings.TOP_K_CHUNKS)
+    parser.add_argument("--cache", default=settings.EMBEDDING_CACHE_PATH, help="Embedding cache to read vectors from")
+    args = parser.parse_args()
+    
+    vectors = load_cached_vectors(args.cache, args.chunks)
+    source = "embedding cache"
+    if len(vectors) < args.chunks:
+        vectors = build_synthetic_vectors(args.chunks, max(args.dims))
+        source = "synthetic"
+    full_dimension = vectors.shape[1]
+    queries = build_queries(vectors, args.queries)
+    print(f"{len(vectors)} vectors of dimension {full_dimension} ({source}), k={args.k}")
+    
+    exact = faiss.IndexFlatL2(full_dimension)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+    
+    faiss.omp_set_num_threads(1)
+    print(f"{'dim':>6}{'precision':>10}{'rescore':>9}{'MB/session':>12}{'ms/query':>10}{'overlap@k':>11}")
+    for dimension in sorted({min(d, full_dimension) for d in args.dims}, reverse=True):
+        reduced = pdf_service.reduce_vectors(vectors, dimension)
+        for precision in args.precisions:
+            index = pdf_service.new_index("flat", dimension, precision=precision, training_vectors=reduced)
+            index.add(reduced)
+            index_mb = pdf_service.index_memory_bytes(index) / 1e6
+            
+            for rescore in (False, True):
+                if rescore and dimension == full_dimension and precision == "float32":
+                    continue
+                full_vectors = vectors if rescore else None
+                latencies = []
+                overlap = 0
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    hits = pdf_service.search_index(index, query, args.k, full_vectors)
+                    latencies.append(time.perf_counter() - start)
+                    overlap += len({vector_id for vector_id, _ in hits} & set(expected))
+                print(
+                    f"{dimension:>6}{precision:>10}{'yes' if rescore else 'no':>9}{index_mb:>12.2f}"
+                    f"{float(np.median(latencies)) * 1000:>10.3f}{overlap / truth.size:>11.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark index memory and query latency as the number of sessions grows.
+
+Each session holds one distinct small document. Three layouts are compared:
+
+    per-session  one LangChain FAISS vector store (flat index plus an
+                 in-memory docstore of Document objects) and BM25 index per
+                 document, as sessions held them before the index service
+    dedicated    IndexService with the shared arena disabled: one FAISS
+                 index per document, chunks in a ChunkStore
+    shared       IndexService with small documents in the shared arena
+
+Every (layout, session count) pair runs in a fresh subprocess, which reports
+its resident-memory growth after loading and the median latency of a
+session-scoped search (vector search plus chunk lookup) for random
+sessions. Resident memory is read from /proc, so this runs on Linux.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.bench_sessions --sessions 10 1000 10000 --chunks 20 --dim 256
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from app.core.config import settings
+
+LAYOUTS = ("per-session", "dedicated", "shared")
+WORDS = (
+    "invoice policy engine torque valve sensor contract clause warranty battery module "
+    "firmware release schedule budget quarter revenue margin supplier audit report "
+    "safety procedure manual section figure table appendix protocol network latency"
+).split()
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def build_document(rng: np.random.Generator, num_chunks: int, dimension: int, chunk_chars: int):
+    """Chunk texts, unit vectors and loader-style metadata for one synthetic document."""
+    words_per_chunk = max(1, chunk_chars // 8)
+    texts = [" ".join(rng.choice(WORDS, words_per_chunk)) for _ in range(num_chunks)]
+    vectors = rng.standard_normal((num_chunks, dimension), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    source = f"uploads/{rng.integers(1 << 62):016x}.pdf"
+    metadatas = [
+        {"source": source, "file_path": source, "total_pages": num_chunks // 3 + 1, "page": i // 3,
+         "start_index": i * chunk_chars, "end_index": (i + 1) * chunk_chars}
+        for i in range(num_chunks)
+    ]
+    return texts, vectors, metadatas
+
+
+def run_child(args) -> dict:
+    """Load one document per session in one layout and measure them."""
+    num_sessions = args.sessions[0]
+    import faiss
+    from app.services.index_service import IndexService
+    from app.services.lexical_index import LexicalIndex
+    from app.services.pdf_service import pdf_service
+    
+    faiss.omp_set_num_threads(1)
+    rng = np.random.default_rng(0)
+    # Touch the allocator and libraries before taking the baseline
+    build_document(rng, args.chunks, args.dim, args.chunk_chars)
+    baseline = resident_bytes()
+    
+    start = time.perf_counter()
+    if args.child == "per-session":
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        
+        stores = []
+        for _ in range(num_sessions):
+            texts, vectors, metadatas = build_document(rng, args.chunks, args.dim, args.chunk_chars)
+            store = FAISS(
+                embedding_function=None,
+                index=faiss.IndexFlatL2(args.dim),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
+            store.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+            lexical_index = LexicalIndex(k1=settings.BM25_K1, b=settings.BM25_B)
+            lexical_index.add(texts)
+            stores.append((store, lexical_index))
+        
+        def search(session: int, query: np.ndarray):
+            store = stores[session][0]
+            hits = pdf_service.search_index(store.index, query, args.k)
+            return [store.docstore.search(store.index_to_docstore_id[i]) for i, _ in hits]
+    else:
+        service = IndexService(use_arena=args.child == "shared")
+        for session in range(num_sessions):
+            texts, vectors, metadatas = build_document(rng, args.chunks, args.dim, args.chunk_chars)
+            service.add(str(session), texts, vectors, metadatas, args.chunks)
+            service.consolidate(str(session))
+        
+        def search(session: int, query: np.ndarray):
+            hits = service.search(str(session), query, args.k)
+            return service.get_chunks(str(session), [i for i, _ in hits])
+    load_seconds = time.perf_counter() - start
+    memory = resident_bytes() - baseline
+    
+    latencies = []
+    for _ in range(args.queries):
+        session = int(rng.integers(num_sessions))
+        query = rng.standard_normal(args.dim, dtype=np.float32)
+        query /= np.linalg.norm(query)
+        start = time.perf_counter()
+        search(session, query)
+        latencies.append(time.perf_counter() - start)
+    
+    return {
+        "load_seconds": load_seconds,
+        "memory_mb": memory / 1e6,
+        "ms_per_query": float(np.median(latencies)) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--chunks", type=int, default=20, help="Chunks per session's document")
+    parser.add_argument("--dim", type=int, default=256, help="Stored vector dimension")
+    parser.add_argument("--chunk-chars", type=int, default=settings.CHUNK_SIZE)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=settings.TOP_K_CHUNKS)
+    parser.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS)
+    parser.add_argument("--child", choices=LAYOUTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+    
+    print(f"{args.chunks} chunks of {args.chunk_chars} chars per document, dim {args.dim}, k={args.k}")
+    print(f"{'sessions':>9}{'layout':>13}{'load s':>9}{'MB':>10}{'KB/session':>12}{'ms/query':>10}")
+    for sessions in args.sessions:
+        for layout in args.layouts:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_sessions", "--child", layout,
+                 "--sessions", str(sessions), "--chunks", str(args.chunks), "--dim", str(args.dim),
+                 "--chunk-chars", str(args.chunk_chars), "--queries", str(args.queries), "--k", str(args.k)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{sessions:>9}{layout:>13}{result['load_seconds']:>9.2f}{result['memory_mb']:>10.1f}"
+                f"{result['memory_mb'] * 1000 / sessions:>12.1f}{result['ms_per_query']:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
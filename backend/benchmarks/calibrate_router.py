@@ -0,0 +1,140 @@
+"""
+Calibrate the score-based query router on a labelled question set.
+
+The questions file is JSON Lines, one {"question": ..., "label": "pdf" | "web"}
+per line, where the label says whether the PDFs can answer the question.
+The PDFs are indexed in-process, without persisting or attaching them to a
+session, and each question goes through the real retrieval. Then every
+(ROUTER_WEB_MAX_SIMILARITY, ROUTER_PDF_MIN_SIMILARITY) pair on a grid is
+scored:
+
+    accuracy         fraction of questions routed correctly, counting the
+                     "check" band as correct (the LLM decides those)
+    direct errors    questions sent straight to the wrong side
+    checks skipped   questions that skip the LLM sufficiency check
+    LLM calls saved  questions routed straight to web search, each saving
+                     the sufficiency check's LLM call
+
+The recommended pair skips the most checks with at most --max-error-rate
+direct errors. Question embeddings go through the embedding cache, so
+re-runs are offline; the chat LLM is never called.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.calibrate_router --pdf handbook.pdf --questions labelled.jsonl
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.document_service import document_service
+from app.services.pdf_service import pdf_service
+from app.services.rag_service import rag_service
+
+
+def index_pdf(path: str):
+    """Register and index one PDF in memory; return its document record."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    content_hash = hasher.hexdigest()
+    
+    # Not released afterwards: releasing deletes the document's file
+    record = document_service.acquire(content_hash, path)
+    if not record.is_indexed:
+        for text_embeddings, metadatas, num_chunks in pdf_service.process_pdf(path):
+            document_service.append_index(content_hash, text_embeddings, metadatas, num_chunks)
+    return record
+
+
+def load_questions(path: str):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if item["label"] not in ("pdf", "web"):
+                    raise ValueError(f"Label must be 'pdf' or 'web': {item}")
+                questions.append(item)
+    return questions
+
+
+async def similarities(snapshots, questions):
+    """Best vector similarity per question (None for lexical fast-path questions)."""
+    return [(await rag_service.retrieve(snapshots, item["question"])).best_similarity for item in questions]
+
+
+def score(similarity: np.ndarray, labels: np.ndarray, web_max: float, pdf_min: float):
+    """Routing outcome counts for one threshold pair; NaN similarities are always checked."""
+    routed_pdf = similarity >= pdf_min
+    routed_web = similarity < web_max
+    direct_errors = int(np.sum(routed_pdf & (labels == "web")) + np.sum(routed_web & (labels == "pdf")))
+    return {
+        "web_max": web_max,
+        "pdf_min": pdf_min,
+        "accuracy": 1.0 - direct_errors / len(labels),
+        "direct_errors": direct_errors,
+        "checks_skipped": int(np.sum(routed_pdf | routed_web)),
+        "llm_calls_saved": int(np.sum(routed_web)),
+    }
+
+
+def print_row(name: str, result: dict, total: int):
+    print(
+        f"{name:>13}{result['web_max']:>9.2f}{result['pdf_min']:>9.2f}{result['accuracy']:>10.3f}"
+        f"{result['direct_errors']:>8}{result['checks_skipped']:>9} ({result['checks_skipped'] / total:>4.0%})"
+        f"{result['llm_calls_saved']:>11}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="+", required=True, help="PDFs the questions are asked against")
+    parser.add_argument("--questions", required=True, help="Labelled questions (JSON Lines)")
+    parser.add_argument("--max-error-rate", type=float, default=0.02, help="Allowed fraction of direct routing errors")
+    parser.add_argument("--step", type=float, default=0.01, help="Threshold grid step")
+    args = parser.parse_args()
+    
+    documents = [index_pdf(path) for path in args.pdf]
+    questions = load_questions(args.questions)
+    labels = np.array([item["label"] for item in questions])
+    # Retrieval reads pinned index versions, as for a query
+    snapshots = document_service.open_snapshots(documents)
+    try:
+        raw = asyncio.run(similarities(snapshots, questions))
+    finally:
+        document_service.close_snapshots(snapshots)
+    similarity = np.array([np.nan if s is None else s for s in raw], dtype=np.float64)
+    
+    print(f"{len(questions)} questions ({np.sum(labels == 'pdf')} pdf, {np.sum(labels == 'web')} web), "
+          f"{sum(d.num_chunks for d in documents)} chunks, {settings.EMBEDDING_MODEL}")
+    for label in ("pdf", "web"):
+        values = similarity[(labels == label) & ~np.isnan(similarity)]
+        if len(values):
+            print(f"  {label} similarity: min {values.min():.3f}  median {np.median(values):.3f}  max {values.max():.3f}")
+    print(f"  {int(np.sum(np.isnan(similarity)))} lexical fast-path questions (always checked)")
+    
+    grid = np.round(np.arange(0.0, 1.0 + args.step, args.step), 6)
+    allowed_errors = int(args.max_error_rate * len(questions))
+    best = None
+    for i, web_max in enumerate(grid):
+        for pdf_min in grid[i:]:
+            result = score(similarity, labels, web_max, pdf_min)
+            if result["direct_errors"] > allowed_errors:
+                continue
+            if best is None or (result["checks_skipped"], -result["direct_errors"]) > (best["checks_skipped"], -best["direct_errors"]):
+                best = result
+    
+    print(f"\n{'':>13}{'web <':>9}{'pdf >=':>9}{'accuracy':>10}{'errors':>8}{'checks skipped':>16}{'LLM saved':>11}")
+    print_row("configured", score(similarity, labels, settings.ROUTER_WEB_MAX_SIMILARITY, settings.ROUTER_PDF_MIN_SIMILARITY), len(questions))
+    print_row("recommended", best, len(questions))
+    print(f"\nROUTER_WEB_MAX_SIMILARITY={best['web_max']:.2f}")
+    print(f"ROUTER_PDF_MIN_SIMILARITY={best['pdf_min']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Check how uploads are added to a session.
+
+Two different PDFs uploaded under the same filename must both stay in the
+session, and an upload only replaces the document named by its
+replace_document_id, whose file is then deleted. The session service runs
+on a SQLiteSessionStore in a temporary directory; no index is built.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.check_session_documents
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from app.services.document_service import document_service
+from app.services.session_service import SessionService
+from app.services.session_store import SQLiteSessionStore
+
+
+def upload(service: SessionService, session_id: str, directory: str, content: bytes, filename: str, replace_document_id: str = None) -> str:
+    """Store a file under its content hash and add it to the session, as an ingestion job does."""
+    content_hash = hashlib.sha256(content).hexdigest()
+    file_path = str(Path(directory) / f"{content_hash}.pdf")
+    with open(file_path, "wb") as f:
+        f.write(content)
+    document_service.acquire(content_hash, file_path)
+    service.add_document(session_id, content_hash, filename, file_path, replace_document_id=replace_document_id)
+    return content_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    
+    failures = 0
+    
+    def check(name: str, passed: bool):
+        nonlocal failures
+        failures += not passed
+        print(f"{'ok' if passed else 'FAILED':>6}  {name}")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        service = SessionService(SQLiteSessionStore(str(Path(directory) / "sessions.sqlite3")))
+        session_id = service.create_session()
+        
+        first = upload(service, session_id, directory, b"%PDF-1.4 first scan", "scan.pdf")
+        second = upload(service, session_id, directory, b"%PDF-1.4 second scan", "scan.pdf")
+        session = service.get_session(session_id)
+        check("same-named documents with different content both stay", set(session.document_ids) == {first, second})
+        check("their files are kept", all(os.path.exists(document.file_path) for document in session.documents.values()))
+        
+        upload(service, session_id, directory, b"%PDF-1.4 second scan", "scan-renamed.pdf")
+        session = service.get_session(session_id)
+        check("re-uploading the same content only renames it", session.documents[second].filename == "scan-renamed.pdf" and len(session.documents) == 2)
+        
+        first_path = session.documents[first].file_path
+        third = upload(service, session_id, directory, b"%PDF-1.4 corrected first scan", "scan.pdf", replace_document_id=first)
+        session = service.get_session(session_id)
+        check("replace_document_id replaces only that document", set(session.document_ids) == {second, third})
+        check("the replaced document's file is deleted", not os.path.exists(first_path))
+        
+        service.clear_session(session_id)
+        service.store.close()
+    
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Check that the SQLite and Redis session stores behave the same.
+
+The same sequence of session, document, usage, job and lock operations runs
+against a SQLiteSessionStore in a temporary directory and a
+RedisSessionStore on a fakeredis client, and every result is compared.
+Then each store races add_document against delete_session on fresh
+sessions from two threads: once every session is gone, no document may
+still be referenced, or its file and index would never be reclaimed.
+
+Needs fakeredis (pip install fakeredis), unless --redis-url points at a
+real, disposable Redis database.
+
+Usage (from the backend directory, with the usual .env present):
+    python -m benchmarks.check_session_store --rounds 2000
+"""
+import argparse
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from app.services.session_store import RedisSessionStore, SessionStore, SQLiteSessionStore
+
+
+def new_session(session_id: str, last_activity: float) -> dict:
+    return {
+        "session_id": session_id,
+        "created_at": "2026-01-01T00:00:00",
+        "last_activity": last_activity,
+        "queries": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+    }
+
+
+def new_document(document_id: str, filename: str, added_at: str) -> dict:
+    return {"document_id": document_id, "filename": filename, "file_path": f"uploads/{document_id}.pdf", "added_at": added_at}
+
+
+def run_sequence(store: SessionStore) -> list:
+    results = []
+    store.create_session(new_session("s1", 100.0))
+    store.create_session(new_session("s2", 50.0))
+    results.append(store.add_document("s1", new_document("d1", "a.pdf", "2026-01-01T00:00:01")))
+    results.append(store.add_document("s1", new_document("d1", "b.pdf", "2026-01-01T00:00:05")))
+    results.append(store.add_document("missing", new_document("d1", "b.pdf", "2026-01-01T00:00:05")))
+    results.append(store.add_document("s2", new_document("d2", "c.pdf", "2026-01-01T00:00:02")))
+    store.add_usage("s1", 1, 10, 5)
+    store.add_usage("s1", 1, 10, 5)
+    store.add_usage("missing", 1, 1, 1)
+    store.touch("s1", 90.0)
+    store.touch("s1", 120.0)
+    store.touch("missing", 1.0)
+    results.append(store.get_session("s1"))
+    results.append(store.get_session("missing"))
+    results.append(sorted(store.expired_sessions(100.0, 10)))
+    results.append((store.count_expired(100.0), store.earliest_activity(), store.count_sessions()))
+    results.append((store.document_in_use("d1"), store.document_in_use("d3")))
+    store.save_job({"job_id": "j1", "content_hash": "d3", "status": "indexing"}, 10.0)
+    store.save_job({"job_id": "j2", "content_hash": "d4", "status": "completed"}, 10.0)
+    results.append((store.document_in_use("d3"), store.document_in_use("d4"), sorted(store.referenced_documents())))
+    results.append([job["job_id"] for job in store.stale_jobs(20.0)])
+    results.append((store.delete_jobs(20.0), store.get_job("j2"), store.get_job("j1")["status"]))
+    results.append(store.remove_document("s1", "d1"))
+    results.append(store.remove_document("s1", "d1"))
+    results.append(store.delete_session("s2"))
+    results.append(store.delete_session("s2"))
+    results.append((store.document_in_use("d2"), sorted(store.referenced_documents())))
+    with store.document_lock("d1"):
+        try:
+            with store.document_lock("d1", timeout=0.1):
+                results.append("lock taken twice")
+        except TimeoutError:
+            results.append("lock held")
+    with store.document_lock("d1", timeout=0.1):
+        results.append("lock released")
+    store.delete_session("s1")
+    store.save_job({"job_id": "j1", "content_hash": "d3", "status": "completed"}, 30.0)
+    store.delete_jobs(40.0)
+    return results
+
+
+def run_race(store: SessionStore, rounds: int) -> list:
+    """Race add_document against delete_session; return documents left referenced."""
+    barrier = threading.Barrier(2)
+    
+    def add(session_id: str, document_id: str):
+        barrier.wait()
+        store.add_document(session_id, new_document(document_id, "race.pdf", "2026-01-01T00:00:00"))
+    
+    def delete(session_id: str):
+        barrier.wait()
+        store.delete_session(session_id)
+    
+    for i in range(rounds):
+        session_id = f"race-{i}"
+        store.create_session(new_session(session_id, float(i)))
+        threads = [
+            threading.Thread(target=add, args=(session_id, f"race-doc-{i}")),
+            threading.Thread(target=delete, args=(session_id,)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Whichever thread won, the session must be gone along with its documents
+        store.delete_session(session_id)
+    return sorted(store.referenced_documents())
+
+
+def redis_client(url: str = None):
+    if url:
+        import redis
+        return redis.Redis.from_url(url, decode_responses=True)
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("fakeredis is not installed (pip install fakeredis), and no --redis-url was given")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000, help="add/delete races per store")
+    parser.add_argument("--redis-url", help="Use this Redis database instead of fakeredis (it gets written to)")
+    args = parser.parse_args()
+    # An in-process client answers without a network round trip, so switch
+    # threads often to give the races a chance to interleave
+    sys.setswitchinterval(1e-6)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_store = SQLiteSessionStore(str(Path(directory) / "sessions.sqlite3"))
+        redis_store = RedisSessionStore(client=redis_client(args.redis_url), prefix="notebook-check:")
+        
+        failures = 0
+        for step, (expected, actual) in enumerate(zip(run_sequence(sqlite_store), run_sequence(redis_store)), 1):
+            if expected != actual:
+                failures += 1
+                print(f"step {step}: sqlite returned {expected!r}, redis returned {actual!r}")
+        print(f"parity: {'ok' if not failures else f'{failures} mismatches'}")
+        
+        for store in (sqlite_store, redis_store):
+            leaked = run_race(store, args.rounds)
+            if leaked:
+                failures += 1
+            print(f"{store.name:>6} race: {args.rounds} rounds, {len(leaked)} documents left referenced")
+        
+        sqlite_store.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -64,7 +64,7 @@ function AppContent() {
           name,
           pdfFilename: response.filename,
           sessionId: response.session_id,
-          numChunks: response.num_chunks,
+          numChunks: response.num_chunks ?? 0,
           createdAt: new Date(),
           lastAccessed: new Date(),
           messages: [],
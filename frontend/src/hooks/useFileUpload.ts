@@ -2,7 +2,11 @@ import { useState, useRef } from 'react';
 import { useMutation } from '@tanstack/react-query';
 import { apiClient } from '@/services/api';
 import { useSession } from './useSession';
-import type { ErrorResponse } from '@/types';
+import type { ErrorResponse, UploadStatusResponse } from '@/types';
+
+const STATUS_POLL_INTERVAL_MS = 1000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
 
 export const useFileUpload = () => {
   const [uploadProgress, setUploadProgress] = useState(0);
@@ -13,12 +17,31 @@ export const useFileUpload = () => {
     let progress = 0;
     progressInterval.current = setInterval(() => {
       progress += Math.random() * 15;
-      if (progress < 90) {
-        setUploadProgress(Math.min(progress, 90));
+      if (progress < 20) {
+        setUploadProgress(Math.min(progress, 20));
       }
     }, 300);
   };
 
+  // Poll the ingestion job until it finishes, mapping its progress onto 20-100%
+  const waitForJob = async (jobId: string): Promise<UploadStatusResponse> => {
+    while (true) {
+      const status = await apiClient.getUploadStatus(jobId);
+      if (status.status === 'failed') {
+        throw {
+          success: false,
+          error: status.error || 'Failed to process PDF',
+          error_code: 'PROCESSING_FAILED',
+        } as ErrorResponse;
+      }
+      setUploadProgress(20 + status.progress * 80);
+      if (status.status === 'completed') {
+        return status;
+      }
+      await sleep(STATUS_POLL_INTERVAL_MS);
+    }
+  };
+
   const uploadMutation = useMutation({
     mutationFn: async (file: File) => {
       setUploadProgress(0);
@@ -26,18 +49,20 @@ export const useFileUpload = () => {
       // Start simulating progress
       simulateProgress();
       
-      const response = await apiClient.uploadPDF(file);
+      const upload = await apiClient.uploadPDF(file);
       
-      // Clear interval and set to 100%
+      // Upload accepted; switch from simulated to real job progress
       if (progressInterval.current) {
         clearInterval(progressInterval.current);
       }
+      
+      const response = await waitForJob(upload.job_id);
       setUploadProgress(100);
       
       return response;
     },
     onSuccess: (data) => {
-      setSession(data.session_id, data.filename, data.num_chunks);
+      setSession(data.session_id, data.filename, data.num_chunks ?? 0);
     },
     onError: (error: ErrorResponse) => {
       if (progressInterval.current) {
@@ -1,6 +1,7 @@
 import axios, { AxiosInstance } from 'axios';
 import type {
   UploadResponse,
+  UploadStatusResponse,
   QueryResponse,
   SessionStatusResponse,
   ErrorResponse,
@@ -33,12 +34,15 @@ class APIClient {
     );
   }
 
-  async uploadPDF(file: File, sessionId?: string): Promise<UploadResponse> {
+  async uploadPDF(file: File, sessionId?: string, replaceDocumentId?: string): Promise<UploadResponse> {
     const formData = new FormData();
     formData.append('file', file);
     if (sessionId) {
       formData.append('session_id', sessionId);
     }
+    if (replaceDocumentId) {
+      formData.append('replace_document_id', replaceDocumentId);
+    }
 
     const { data } = await this.client.post<UploadResponse>(
       '/upload',
@@ -53,6 +57,14 @@ class APIClient {
     return data;
   }
 
+  async getUploadStatus(jobId: string): Promise<UploadStatusResponse> {
+    const { data } = await this.client.get<UploadStatusResponse>(
+      `/upload/${jobId}`
+    );
+
+    return data;
+  }
+
   async queryPDF(
     sessionId: string,
     question: string
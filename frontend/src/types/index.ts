@@ -2,9 +2,33 @@ export interface UploadResponse {
   success: boolean;
   message: string;
   session_id: string;
+  document_id: string;
+  job_id: string;
   filename: string;
-  num_chunks: number;
-  processing_time: number;
+  status: string;
+}
+
+export type UploadJobStatus =
+  | 'queued'
+  | 'loading'
+  | 'splitting'
+  | 'embedding'
+  | 'indexing'
+  | 'completed'
+  | 'failed';
+
+export interface UploadStatusResponse {
+  success: boolean;
+  job_id: string;
+  session_id: string;
+  document_id: string;
+  filename: string;
+  status: UploadJobStatus;
+  progress: number;
+  num_chunks?: number;
+  error?: string;
+  reused_index: boolean;
+  processing_time?: number;
 }
 
 export interface WebSource {
@@ -16,6 +40,12 @@ export interface WebSource {
 export interface QueryMetadata {
   model: string;
   tokens_used?: number;
+  prompt_tokens?: number;
+  completion_tokens?: number;
+  retrieval?: 'lexical' | 'hybrid';
+  route?: 'pdf' | 'web' | 'check';
+  cache?: 'exact' | 'semantic' | null;
+  snapshot_versions?: Record<string, number>;
 }
 
 export interface QueryResponse {
@@ -25,15 +55,52 @@ export interface QueryResponse {
   chunks_used?: number;
   web_sources?: WebSource[];
   processing_time: number;
+  indexed_fraction: number;
   metadata: QueryMetadata;
 }
 
+export interface BatchQueryResult {
+  index: number;
+  question: string;
+  success: boolean;
+  answer?: string;
+  source?: 'pdf' | 'web';
+  chunks_used?: number;
+  web_sources?: WebSource[];
+  indexed_fraction?: number;
+  metadata?: QueryMetadata;
+  error?: string;
+}
+
+export interface BatchQueryResponse {
+  success: boolean;
+  results: BatchQueryResult[];
+  processing_time: number;
+}
+
+export interface SessionDocument {
+  document_id: string;
+  filename: string;
+  num_chunks?: number;
+  indexed_chunks: number;
+  memory_bytes: number;
+  loaded: boolean;
+  status: 'ready' | 'indexing' | 'indexing_elsewhere';
+  added_at: string;
+}
+
 export interface SessionStatusResponse {
   success: boolean;
   session_id: string;
   has_pdf: boolean;
   pdf_filename?: string;
   num_chunks?: number;
+  indexed_chunks?: number;
+  documents: SessionDocument[];
+  memory_bytes: number;
+  queries: number;
+  prompt_tokens: number;
+  completion_tokens: number;
   created_at: string;
   last_activity: string;
 }